@@ -0,0 +1,192 @@
+import numpy as np
+import os
+import struct
+import shutil
+import subprocess
+import warnings
+import exo_circle_raster as raster
+
+# Writes the frames of the movie into a single animated file as they are made, keeping only the previous frame:
+# an animated PNG (APNG, written here), or a video (e.g. MP4) encoded by ffmpeg, if it is installed
+#
+# Frames are (height, width, 3) uint8 arrays, e.g. from exo_circle_raster.to_rgb8 or a matplotlib canvas
+
+ffmpeg_path = shutil.which('ffmpeg') # ffmpeg is used for video formats (None: write an animated PNG instead)
+ffmpeg_codec = ['-c:v','libx264','-pix_fmt','yuv420p'] # Encoder options given to ffmpeg for video files
+
+video_extensions = ('.mp4','.mkv','.mov','.webm','.avi')
+
+
+class APNGWriter(object):
+    '''Writes frames one at a time to an animated PNG file, which plays loops times (0: forever).
+    The number of frames is written first, in the animation control chunk; if a different number of frames is
+    written, it is corrected when the writer is closed.
+    Each frame after the first only stores the rectangle that changed since the frame before'''
+
+    def __init__(self, filename, nframes, fps=1.0, loops=0):
+
+        self.filename = filename
+        self.nframes = nframes
+        self.loops = loops
+
+        # Frame delay as a fraction of a second
+        self.delay = (int(round(1000.0/fps)),1000)
+
+        self.file = open(filename,'wb')
+        self.actl_position = None
+        self.previous = None
+        self.sequence = 0
+        self.written = 0
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exception):
+
+        self.close()
+
+    def actl_chunk(self, nframes):
+        '''Returns the animation control chunk: number of frames and number of plays'''
+
+        return raster.png_chunk(b'acTL',struct.pack('>II',nframes,self.loops))
+
+    def write(self, image):
+        '''Appends one frame'''
+
+        image = np.ascontiguousarray(image,dtype=np.uint8)
+        height,width = image.shape[:2]
+
+        if self.previous is None:
+            self.file.write(raster.png_header(width,height,image.shape[2]))
+            self.actl_position = self.file.tell()
+            self.file.write(self.actl_chunk(self.nframes))
+
+            x0,y0,x1,y1 = 0,0,width,height
+        else:
+            if image.shape!=self.previous.shape:
+                raise ValueError('Every frame of an animation must have the same size')
+
+            # Only the rectangle that changed is stored (the rest of the last frame is kept)
+            changed = np.any(image!=self.previous,axis=2)
+            rows = np.flatnonzero(changed.any(axis=1))
+            columns = np.flatnonzero(changed.any(axis=0))
+
+            if len(rows)==0:
+                x0,y0,x1,y1 = 0,0,1,1
+            else:
+                x0,y0,x1,y1 = columns[0],rows[0],columns[-1]+1,rows[-1]+1
+
+        # Frame control: sequence number, size and offset, delay, dispose (none) and blend (replace) operations
+        control = struct.pack('>IIIIIHHBB', self.sequence, x1-x0, y1-y0, x0, y0, self.delay[0], self.delay[1], 0, 0)
+        self.file.write(raster.png_chunk(b'fcTL',control))
+        self.sequence += 1
+
+        data = raster.png_data(image[y0:y1,x0:x1])
+
+        # The first frame is the image shown by viewers without animation support
+        if self.previous is None:
+            self.file.write(raster.png_chunk(b'IDAT',data))
+        else:
+            self.file.write(raster.png_chunk(b'fdAT',struct.pack('>I',self.sequence)+data))
+            self.sequence += 1
+
+        self.previous = image
+        self.written += 1
+
+    def close(self):
+        '''Finishes the file'''
+
+        if self.file is None:
+            return
+
+        if self.written > 0:
+            self.file.write(raster.png_chunk(b'IEND',b''))
+
+            if self.written!=self.nframes:
+                self.file.seek(self.actl_position)
+                self.file.write(self.actl_chunk(self.written))
+
+        self.file.close()
+        self.file = None
+        self.previous = None
+
+
+class FFmpegWriter(object):
+    '''Pipes frames to ffmpeg as raw RGB pixels, which encodes them into a video file as they arrive.
+    ffmpeg is started when the first frame (and so the frame size) is known'''
+
+    def __init__(self, filename, fps=1.0):
+
+        self.filename = filename
+        self.fps = fps
+        self.process = None
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exception):
+
+        self.close()
+
+    def write(self, image):
+        '''Appends one frame'''
+
+        image = np.ascontiguousarray(image,dtype=np.uint8)
+        height,width = image.shape[:2]
+
+        if self.process is None:
+            # Most codecs need even dimensions: pad the frame by a pixel if necessary
+            command = [ffmpeg_path,'-y','-loglevel','error',
+                       '-f','rawvideo','-pix_fmt','rgb24','-s',str(width)+'x'+str(height),'-r',repr(float(self.fps)),
+                       '-i','-','-vf','pad=ceil(iw/2)*2:ceil(ih/2)*2']+ffmpeg_codec+[self.filename]
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+        self.process.stdin.write(image[:,:,:3].tobytes())
+
+    def close(self):
+        '''Waits for ffmpeg to finish the file'''
+
+        if self.process is None:
+            return
+
+        self.process.stdin.close()
+        status = self.process.wait()
+        self.process = None
+
+        if status!=0:
+            raise IOError('ffmpeg could not write '+self.filename+' (exit status '+str(status)+')')
+
+
+def open_writer(filename, nframes, fps=1.0):
+    '''Returns a writer for an animation of nframes frames: a video encoded by ffmpeg if filename has a video
+    extension (e.g. .mp4), or an animated PNG. Without ffmpeg, videos are written as animated PNG instead'''
+
+    base,extension = os.path.splitext(filename)
+
+    if extension.lower() in video_extensions:
+        if ffmpeg_path is not None:
+            return FFmpegWriter(filename, fps)
+
+        warnings.warn('ffmpeg was not found: writing an animated PNG instead of '+filename)
+        filename = base+'.png'
+
+    return APNGWriter(filename, nframes, fps)
+
+def interpolate(frames, steps):
+    '''Inserts steps frames between each pair of consecutive frames, fading from one to the next.
+    frames are (label, image) pairs; the inserted frames are labelled None'''
+
+    previous = None
+
+    for label,image in frames:
+        if previous is not None and steps > 0:
+            start = previous.astype(np.float32)
+            change = image.astype(np.float32)-start
+
+            for k in range(1,steps+1):
+                yield None,(start+change*(k/(steps+1.0))+0.5).astype(np.uint8)
+
+        yield label,image
+        previous = image
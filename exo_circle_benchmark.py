@@ -0,0 +1,388 @@
+# Benchmarks for the hot paths of the exoplanet circle, using synthetic exoplanet radii (no network access)
+# Stages: parsing archive tables, placing circles in the disc and the annulus, and rendering to PNG (with matplotlib,
+# and with the numpy rasterizer of exo_circle_raster)
+# (plus a cross-check of the spatial-hash neighbour index against the original test_neighbours scan,
+# and the speedup of placing the annulus in sectors with several processes over the serial loop)
+#
+# Usage: python exo_circle_benchmark.py [--sizes 500 5000] [--stages parse disc] [--engine frontchain]
+#                                       [--sampler raster] [--jobs 4] [--output results.json]
+#                                       [--baseline baseline.json] [--tolerance 1.2]
+# Results are written as JSON; with --baseline, any stage slower than tolerance x baseline is reported
+# and the exit status is 1
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import exoplanet_data as exo
+import exo_circle_functions as fun
+import exo_circle_placement as place
+import exo_circle_raster as raster
+import matplotlib.pyplot as plt
+from timeit import default_timer as time
+from io import BytesIO
+import argparse
+import json
+import platform
+import sys
+
+pi = 3.141592654
+
+area_spacing_factor = 2.0 # Increases the area of the circle to allow gaps
+placing_spacing = 1.1 # Tolerance for distance between planets. 1=planets can touch
+graphic_border = 1.4 # How big is the graphic relative to the area of the annulus/circle?
+
+benchmark_seed = 42
+benchmark_sizes = [500,2000,10000,50000,100000]
+benchmark_stages = ['parse','disc','annulus','render','raster']
+benchmark_engine = 'random' # Placement engine for the disc and annulus stages ('random' or 'frontchain')
+benchmark_sampler = 'polar' # Trial positions for the random engine ('polar' or 'raster')
+benchmark_jobs = 4 # Worker processes (and sectors) for the sectors stage
+full_comparison_max = 2000 # Largest set for which both full placement loops are run (neighbours stage)
+ntrial = 50 # Number of trial positions used to time single overlap checks (neighbours stage)
+
+
+def synthetic_radii(n, rng):
+    '''Draws n radii (Earth Radii) shaped like the catalogue: a small-planet peak near 2 R_E and a giant peak near 12 R_E'''
+
+    ngiant = n//4
+    small = rng.lognormal(mean=np.log(2.2),sigma=0.5,size=n-ngiant)
+    giant = rng.lognormal(mean=np.log(12.0),sigma=0.25,size=ngiant)
+
+    radii = np.concatenate((small,giant),axis=0)
+    radii = np.sort(radii)[::-1]
+
+    return radii
+
+def synthetic_table(n, rng):
+    '''Writes n synthetic planets (radius, mass, discovery year) as the lines of an archive ascii table,
+    with about a third of the radii missing'''
+
+    radii = synthetic_radii(n, rng)
+    masses = rng.lognormal(mean=np.log(100.0),sigma=1.5,size=n)
+    years = rng.integers(1995,2025,size=n)
+
+    lines = ['\\fixlen = T\n']
+    lines += ['\\comment synthetic table '+str(k)+'\n' for k in range(6)]
+    lines += ['|     pl_rade|   pl_msinie|     pl_disc|\n',
+              '|      double|      double|         int|\n',
+              '|            |            |            |\n',
+              '|        null|        null|        null|\n']
+
+    missing = rng.uniform(size=n) < 0.3
+    for k in range(n):
+        if missing[k]:
+            radius = '        null'
+        else:
+            radius = '%12.4f' % radii[k]
+        lines.append(' '+radius+' %12.4f %12d\n' % (masses[k],years[k]))
+
+    return lines
+
+def disc_radius(radii):
+    '''Radius of the disc holding the circles, as calculated by exoplanet_circle.py'''
+
+    circlearea = np.sum(pi*radii*radii)*area_spacing_factor
+    return np.sqrt(circlearea/pi)
+
+def annulus_radius(radii, circle_rad):
+    '''Outer radius of the annulus holding the circles outside circle_rad, as calculated by exoplanet_circle.py'''
+
+    annulusarea = np.sum(pi*radii*radii)*area_spacing_factor
+    annulus_rad = np.sqrt(annulusarea/pi + circle_rad*circle_rad)
+
+    if 2.0*radii[0]>(annulus_rad-circle_rad):
+        annulus_rad = 1.1*2.0*radii[0] + circle_rad
+
+    return annulus_rad
+
+
+def bench_parse(n):
+    '''Times parsing an n-row, three-column ascii table as exoplanet_data does'''
+
+    lines = synthetic_table(n, place.make_rng(benchmark_seed))
+
+    t0 = time()
+    data = exo.parse_table(iter(lines))
+    seconds = time()-t0
+
+    return seconds,{'rows': len(data)}
+
+def bench_disc(n):
+    '''Times placing n circles in the confirmed-planet disc'''
+
+    rng = place.make_rng(benchmark_seed)
+    radii = synthetic_radii(n, rng)
+    circle_rad = disc_radius(radii)
+
+    t0 = time()
+    xp,yp = place.place_layer(benchmark_engine, radii, 0.0, circle_rad, placing_spacing, rng=rng,
+                              sampler=benchmark_sampler)
+    seconds = time()-t0
+
+    return seconds,{}
+
+def bench_annulus(n):
+    '''Times placing n circles in the candidate annulus around a disc of the same area'''
+
+    rng = place.make_rng(benchmark_seed)
+    radii = synthetic_radii(n, rng)
+    circle_rad = disc_radius(radii)
+    annulus_rad = annulus_radius(radii, circle_rad)
+
+    t0 = time()
+    xc,yc = place.place_layer(benchmark_engine, radii, circle_rad, annulus_rad, placing_spacing, rng=rng,
+                              sampler=benchmark_sampler)
+    seconds = time()-t0
+
+    return seconds,{}
+
+def render_layout(n):
+    '''Places n synthetic circles in the disc, for the render stages'''
+
+    rng = place.make_rng(benchmark_seed)
+    radii = synthetic_radii(n, rng)
+    circle_rad = disc_radius(radii)
+    xp,yp = place.place_circles(radii, 0.0, circle_rad, placing_spacing, rng=rng)
+
+    return radii,xp,yp,circle_rad
+
+def render_png(radii, xp, yp, circle_rad, backend):
+    '''Renders placed circles (with legend) to PNG with either backend, returning the PNG data'''
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.set_xlim(-graphic_border*circle_rad,graphic_border*circle_rad)
+    ax.set_ylim(-graphic_border*circle_rad,graphic_border*circle_rad)
+    ax.set_axis_off()
+
+    layers = []
+    if backend=='raster':
+        planet_layer = raster.blank_layer(*raster.figure_size(fig))
+        raster.draw_axis_circles(planet_layer,ax,xp,yp,radii)
+        layers.append(planet_layer)
+    else:
+        fun.plot_circles(ax,xp,yp,radii)
+
+    fun.make_circle_legend(ax,str(len(radii))+' synthetic exoplanets',0.0,0.0)
+
+    png = BytesIO()
+    if backend=='raster':
+        raster.save_figure(fig, png, layers)
+    else:
+        fig.savefig(png, format='png')
+    plt.close(fig)
+
+    return png.getvalue()
+
+def bench_render(n):
+    '''Times rendering n placed circles (with legend) to PNG with matplotlib'''
+
+    radii,xp,yp,circle_rad = render_layout(n)
+
+    t0 = time()
+    png = render_png(radii, xp, yp, circle_rad, 'matplotlib')
+    seconds = time()-t0
+
+    return seconds,{'bytes': len(png)}
+
+def bench_raster(n):
+    '''Times rendering n placed circles (with legend) to PNG with the numpy rasterizer (exo_circle_raster).
+    The matplotlib path is timed on the same circles for comparison (the speedup is in the details)'''
+
+    radii,xp,yp,circle_rad = render_layout(n)
+
+    t0 = time()
+    render_png(radii, xp, yp, circle_rad, 'matplotlib')
+    reference = time()-t0
+
+    t0 = time()
+    png = render_png(radii, xp, yp, circle_rad, 'raster')
+    seconds = time()-t0
+
+    return seconds,{'bytes': len(png), 'matplotlib': reference, 'speedup': reference/seconds}
+
+def place_disc_loop(radii, circle_rad, seed, use_grid):
+    '''Runs the one-trial-at-a-time accept/reject loop, with either the grid or test_neighbours'''
+
+    rng = place.make_rng(seed)
+
+    nplanet = len(radii)
+    xp = np.zeros(nplanet)
+    yp = np.zeros(nplanet)
+
+    grid = place.NeighbourGrid(circle_rad, place.neighbour_cellsize(radii,placing_spacing), placing_spacing)
+
+    i = 0
+    while i < nplanet:
+        rad = rng.uniform(low=0.0,high = circle_rad-radii[i])
+        phi = rng.uniform(low=0.0,high=2.0*pi)
+
+        xp[i] = rad*np.cos(phi)
+        yp[i] = rad*np.sin(phi)
+
+        overlapflag = fun.test_rad(xp[i], yp[i], radii[i], 0.0, circle_rad)
+        if overlapflag==1: continue
+
+        if use_grid:
+            overlapflag = grid.test_neighbours(xp[i], yp[i], radii[i])
+        else:
+            overlapflag = fun.test_neighbours(i, xp, yp, radii, placing_spacing)
+
+        if overlapflag==0:
+            grid.insert(xp[i], yp[i], radii[i])
+            i +=1
+
+    return xp,yp,grid
+
+def bench_neighbours(n):
+    '''Places n circles with the grid, then times and cross-checks both overlap tests on random trial circles.
+    Reports the mean grid check time (the scan time and the number of disagreements are in the details)'''
+
+    rng = place.make_rng(benchmark_seed)
+    radii = synthetic_radii(n, rng)
+    circle_rad = disc_radius(radii)
+
+    xp,yp,grid = place_disc_loop(radii, circle_rad, benchmark_seed, True)
+
+    details = {}
+
+    if n <= full_comparison_max:
+        xp_old,yp_old,grid_old = place_disc_loop(radii, circle_rad, benchmark_seed, False)
+        details['identical_layout'] = bool(np.array_equal(xp,xp_old) and np.array_equal(yp,yp_old))
+
+    # Single overlap checks at random trial positions, with the trial circle appended as planet n
+    xtest = np.append(xp,0.0)
+    ytest = np.append(yp,0.0)
+    rtest = np.append(radii,0.0)
+
+    tscan = 0.0
+    tgrid = 0.0
+    mismatches = 0
+
+    for k in range(ntrial):
+        rad = rng.uniform(low=0.0,high=circle_rad)
+        phi = rng.uniform(low=0.0,high=2.0*pi)
+        xtest[n] = rad*np.cos(phi)
+        ytest[n] = rad*np.sin(phi)
+        rtest[n] = radii[rng.integers(n)]
+
+        t0 = time()
+        flag_scan = fun.test_neighbours(n, xtest, ytest, rtest, placing_spacing)
+        tscan += time()-t0
+
+        t0 = time()
+        flag_grid = grid.test_neighbours(xtest[n], ytest[n], rtest[n])
+        tgrid += time()-t0
+
+        if flag_scan!=flag_grid: mismatches +=1
+
+    details['check_scan'] = tscan/ntrial
+    details['mismatches'] = mismatches
+
+    return tgrid/ntrial,details
+
+
+def bench_sectors(n):
+    '''Times placing n circles in the candidate annulus in benchmark_jobs sectors with benchmark_jobs processes.
+    The serial loop is timed on the same circles for comparison (the speedup is in the details)'''
+
+    rng = place.make_rng(benchmark_seed)
+    radii = synthetic_radii(n, rng)
+    circle_rad = disc_radius(radii)
+    annulus_rad = annulus_radius(radii, circle_rad)
+
+    t0 = time()
+    place.place_circles(radii, circle_rad, annulus_rad, placing_spacing, rng=rng)
+    serial = time()-t0
+
+    t0 = time()
+    place.place_annulus_sectors(radii, circle_rad, annulus_rad, placing_spacing, benchmark_seed, max(benchmark_jobs,2),
+                                jobs=benchmark_jobs)
+    seconds = time()-t0
+
+    return seconds,{'serial': serial, 'speedup': serial/seconds, 'jobs': benchmark_jobs}
+
+
+stage_functions = {'parse': bench_parse, 'disc': bench_disc, 'annulus': bench_annulus,
+                   'render': bench_render, 'raster': bench_raster, 'neighbours': bench_neighbours, 'sectors': bench_sectors}
+
+def run_benchmarks(stages, sizes):
+    '''Runs every stage at every size, returning a JSON-ready report'''
+
+    results = []
+
+    for stage in stages:
+        for n in sizes:
+            seconds,details = stage_functions[stage](n)
+            results.append({'stage': stage, 'n': n, 'seconds': seconds, 'details': details})
+            print(stage,' N = ',n,': ',seconds,' s',file=sys.stderr)
+
+    report = {'seed': benchmark_seed,
+              'engine': benchmark_engine,
+              'sampler': benchmark_sampler,
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'matplotlib': matplotlib.__version__,
+              'results': results}
+
+    return report
+
+def compare_to_baseline(report, baseline, tolerance):
+    '''Lists the (stage, n) timings that are more than tolerance times slower than in the baseline report'''
+
+    previous = {}
+    for result in baseline['results']:
+        previous[(result['stage'],result['n'])] = result['seconds']
+
+    slower = []
+    for result in report['results']:
+        key = (result['stage'],result['n'])
+        if key in previous and result['seconds'] > tolerance*previous[key]:
+            slower.append({'stage': key[0], 'n': key[1], 'seconds': result['seconds'],
+                           'baseline': previous[key], 'ratio': result['seconds']/previous[key]})
+
+    return slower
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks parsing, placing and rendering with synthetic exoplanets')
+    parser.add_argument('--sizes', type=int, nargs='+', default=benchmark_sizes, help='Numbers of planets to use')
+    parser.add_argument('--stages', nargs='+', default=benchmark_stages, choices=sorted(stage_functions.keys()),
+                        help='Stages to benchmark')
+    parser.add_argument('--engine', default=benchmark_engine, choices=['random','frontchain'],
+                        help='Placement engine for the disc and annulus stages')
+    parser.add_argument('--sampler', default=benchmark_sampler, choices=['polar','raster'],
+                        help='Trial positions for the random engine')
+    parser.add_argument('--jobs', type=int, default=benchmark_jobs, help='Processes for the sectors stage')
+    parser.add_argument('--output', help='Write the JSON report to this file (default: standard output)')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='Slow-down factor reported as a regression')
+    args = parser.parse_args()
+
+    benchmark_engine = args.engine
+    benchmark_sampler = args.sampler
+    benchmark_jobs = args.jobs
+
+    report = run_benchmarks(args.stages, args.sizes)
+
+    status = 0
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['regressions'] = compare_to_baseline(report, baseline, args.tolerance)
+        for regression in report['regressions']:
+            print('Slower than baseline: ',regression['stage'],' N = ',regression['n'],' ',regression['ratio'],'x',
+                  file=sys.stderr)
+        if len(report['regressions']) > 0:
+            status = 1
+
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+    sys.exit(status)
@@ -1,7 +1,11 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import os
+import threading
 from datetime import datetime
 
+# matplotlib is imported by the plotting functions when they are first called, so that placing circles
+# does not have to load it
+
 # Color tables for plots (picked from xkcd graphic)
 
 # Sub Earths (lightblue)
@@ -16,6 +20,13 @@ neptunes = (84.0/256.0,53.0/256.0,16.0/256.0)
 jupiters = (135.0/256.0,40.0/256.0,21.0/256.0)
 
 
+# Radius boundaries (Earth Radii) between Sub Earths, Earths, Super Earths, Neptunes and Jupiters
+category_edges = np.array([0.8,1.25,2.6,6.0])
+
+# Colour of each category, in the same order
+category_colours = (subearth,earth,superearth,neptunes,jupiters)
+
+
 # Alternative color tables
 # Sub Earths
 #subearth = (256.0/256.0,0.0/256.0,256.0/256.0)
@@ -38,13 +49,11 @@ def begin_and_end_years():
     return begin,end
 
 def gen_random_seed_date():
-    '''Uses the date to generate a random number seed'''
+    '''Uses the date to generate a random number seed (pass it to exo_circle_placement.make_rng)'''
     date = datetime.now()
     seed = (date.day*date.year*date.month)
     seed = int(seed)
 
-    np.random.mtrand.RandomState(seed)
-    
     return seed
 
 
@@ -84,30 +93,45 @@ def test_neighbours(i,xp,yp,radii,placing_spacing):
             
     return overlapflag
 
+def pick_circle_categories(radii):
+    '''Classifies every radius at once: 0=Sub Earth, 1=Earth, 2=Super Earth, 3=Neptune, 4=Jupiter
+    (a radius equal to a boundary belongs to the larger category; NaN counts as Jupiter)'''
+    
+    return np.digitize(radii,category_edges)
+
+def pick_circle_colours(radii):
+    '''Selects the plotting colour for every exoplanet depending on its radius: returns an (N,3) array'''
+    
+    return np.array(category_colours)[pick_circle_categories(radii)]
+
 def pick_circle_colour(rad):
     '''Selects the plotting colour for the exoplanet depending on its radius'''    
+    
+    return category_colours[int(pick_circle_categories(rad))]
 
-    colors = jupiters
-                
-    # Sub Earth
-    if rad < 0.8:
-        colors = subearth        
-    elif rad >= 0.8 and rad <1.25:
-        colors = earth
-    # Super Earths
-    elif rad >=1.25 and rad < 2.6:
-        colors = superearth
-    # Neptunes
-    elif rad >=2.6 and rad < 6.0:
-        colors = neptunes
-    # Jupiters
-    elif rad >=6.0:
-        colors = jupiters
-        
-    return colors
+def plot_circles(axis,x,y,radii,categories=None):
+    '''Draws a set of planets on the axis as a single artist (one collection), coloured by radius
+    (or by categories, if these have already been worked out, e.g. the category column of a PlanetTable)'''
+    
+    from matplotlib.collections import EllipseCollection
+    
+    if categories is None:
+        categories = pick_circle_categories(radii)
+    colors = np.array(category_colours)[categories]
+    
+    # Widths and heights are diameters in data units, so circles scale with the axis like plt.Circle
+    diameters = 2.0*np.asarray(radii)
+    angles = np.zeros(len(diameters))
+    offsets = np.column_stack((x,y))
+    
+    circles = EllipseCollection(diameters,diameters,angles,units='xy',offsets=offsets,
+                                transOffset=axis.transData,facecolors=colors,edgecolors='none')
+    axis.add_collection(circles)
+    
+    return circles
 
-def make_circle_legend(axis, textstring,textx,texty):    
-    '''Makes circles of each colour to display as a legend to the plot'''
+def make_category_legend(axis):
+    '''Makes circles of each colour to display as a legend to the plot (returns the legend)'''
     
     # Find size of x and y axes in pixels
     pointlimits = axis.transData.transform([(0,1),(1,0)])-axis.transData.transform((0,0))
@@ -117,58 +141,80 @@ def make_circle_legend(axis, textstring,textx,texty):
     #print pointlimits
     #print pointscale
     
+    from matplotlib.lines import Line2D
     
-    line1 = plt.Line2D(range(1), range(1), color="white", marker='o', markersize = 2.0, markerfacecolor=subearth)
-    line2 = plt.Line2D(range(1), range(1), color="white", marker='o',markersize=2.5*pointscale, markerfacecolor=earth)
-    line3 = plt.Line2D(range(1), range(1), color="white", marker='o',markersize=3.0*pointscale, markerfacecolor=superearth)
-    line4 = plt.Line2D(range(1), range(1), color="white", marker='o',markersize=3.5*pointscale, markerfacecolor=neptunes)
-    line5 = plt.Line2D(range(1), range(1), color="white", marker='o',markersize=5.0*pointscale,markerfacecolor=jupiters)
+    line1 = Line2D(range(1), range(1), color="white", marker='o', markersize = 2.0, markerfacecolor=subearth)
+    line2 = Line2D(range(1), range(1), color="white", marker='o',markersize=2.5*pointscale, markerfacecolor=earth)
+    line3 = Line2D(range(1), range(1), color="white", marker='o',markersize=3.0*pointscale, markerfacecolor=superearth)
+    line4 = Line2D(range(1), range(1), color="white", marker='o',markersize=3.5*pointscale, markerfacecolor=neptunes)
+    line5 = Line2D(range(1), range(1), color="white", marker='o',markersize=5.0*pointscale,markerfacecolor=jupiters)
     
-    axis.legend((line1,line2,line3,line4,line5),('Subearth','Earth ', 'Superearth','Neptune', 'Jupiter'),numpoints=1, loc='upper right', bbox_to_anchor= (1.1,1.1))    
+    return axis.legend((line1,line2,line3,line4,line5),('Subearth','Earth ', 'Superearth','Neptune', 'Jupiter'),numpoints=1, loc='upper right', bbox_to_anchor= (1.1,1.1))    
+
+def make_caption(axis, textstring,textx,texty):
+    '''Writes the caption of the plot (returns the text)'''
     
-    axis.text(textx,texty,textstring, style='italic', transform = axis.transAxes,
+    return axis.text(textx,texty,textstring, style='italic', transform = axis.transAxes,
         bbox={'facecolor':'slategrey', 'alpha':0.01, 'pad':10})
 
-def make_circle_legend_date(axis, textstring,textx,texty):    
-    '''Makes circles of each colour to display as a legend to the plot'''
+def make_circle_legend(axis, textstring,textx,texty):    
+    '''Makes circles of each colour to display as a legend to the plot, and writes the caption'''
     
-    # Find size of x and y axes in pixels
+    make_category_legend(axis)
+    make_caption(axis,textstring,textx,texty)
+
+def date_string():
+    '''Returns today's date as day/month/year'''
     
     now = datetime.now()
     
-    textstring = textstring + str(now.day)+'/'+str(now.month)+'/'+str(now.year)
-    
-    pointlimits = axis.transData.transform([(0,1),(1,0)])-axis.transData.transform((0,0))
-    
-    pointscale = np.sum(pointlimits)/2.0
-    pointscale = 1.0/pointscale
-    #print pointlimits
-    #print pointscale
-    
-    
-    line1 = plt.Line2D(range(1), range(1), color="white", marker='o', markersize = 2.0, markerfacecolor=subearth)
-    line2 = plt.Line2D(range(1), range(1), color="white", marker='o',markersize=2.5*pointscale, markerfacecolor=earth)
-    line3 = plt.Line2D(range(1), range(1), color="white", marker='o',markersize=3.0*pointscale, markerfacecolor=superearth)
-    line4 = plt.Line2D(range(1), range(1), color="white", marker='o',markersize=3.5*pointscale, markerfacecolor=neptunes)
-    line5 = plt.Line2D(range(1), range(1), color="white", marker='o',markersize=5.0*pointscale,markerfacecolor=jupiters)
-    
-    axis.legend((line1,line2,line3,line4,line5),('Subearth','Earth ', 'Superearth','Neptune', 'Jupiter'),numpoints=1, loc='upper right', bbox_to_anchor= (1.1,1.1))    
+    return str(now.day)+'/'+str(now.month)+'/'+str(now.year)
+
+def make_circle_legend_date(axis, textstring,textx,texty):    
+    '''Makes circles of each colour to display as a legend to the plot, and writes the caption followed by the date'''
     
-    axis.text(textx,texty,textstring, style='italic', transform = axis.transAxes,
-        bbox={'facecolor':'slategrey', 'alpha':0.01, 'pad':10})
+    make_circle_legend(axis,textstring+date_string(),textx,texty)
+
+
+def write_atomically(filename, write):
+    '''Writes a file by calling write(f) on a temporary file next to it, then renaming it into place, so readers
+    never see a partial file (the directory is created if necessary)'''
+
+    folder = os.path.dirname(filename)
+    if folder!='' and not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # Another thread or process may have just created it
+            if not os.path.isdir(folder): raise
+
+    tempname = filename+'.'+str(os.getpid())+'.'+str(threading.current_thread().ident)+'.tmp'
+    try:
+        with open(tempname,'wb') as f:
+            write(f)
+        os.replace(tempname,filename)
+    except BaseException:
+        if os.path.exists(tempname): os.remove(tempname)
+        raise
 
 
 def guess_radii_from_masses_PHL(masses):
     '''Uses input np array of masses to guess radii according to simple mass-radius prescription (phl.pr.edu)'''
     
+    masses = np.asarray(masses,dtype=float)
     radii = np.zeros(len(masses))
     
-    for i in range(len(masses)):
-        if masses[i] <= 1.0: 
-            radii[i] = masses[i]**0.3
-        elif masses[i] >1.0 and masses[i] <= 200.0:
-            radii[i] = masses[i]**0.5
-        elif masses[i] > 200.0:         
-            radii[i] = 22.6*masses[i]**(-0.0086)
+    small = masses <= 1.0
+    medium = (masses > 1.0) & (masses <= 200.0)
+    large = masses > 200.0
+    
+    radii[small] = masses[small]**0.3
+    radii[medium] = masses[medium]**0.5
+    radii[large] = 22.6*masses[large]**(-0.0086)
+    
+    return radii
+
+def guess_radius_from_mass_PHL(mass):
+    '''Guesses the radius of a single planet from its mass (see guess_radii_from_masses_PHL)'''
     
-    return radii
\ No newline at end of file
+    return guess_radii_from_masses_PHL([mass])[0]
@@ -0,0 +1,168 @@
+import json
+import sys
+import heapq
+import threading
+from contextlib import contextmanager
+from timeit import default_timer as time
+
+# Instrumentation for the exoplanet circle: wall time per stage, and rejection-sampling statistics for placing
+
+
+class Instrumentation(object):
+    '''Collects stage timings and placement statistics, for a JSON report and/or a callback.
+
+    The callback (if given) is called with a dictionary for each event: {'event':'stage', ...} when a stage ends,
+    and {'event':'acceptance', ...} each time a window of placed circles completes'''
+
+    def __init__(self, callback=None, window=100, nslowest=10):
+
+        self.callback = callback
+        self.window = window # Number of placed circles per acceptance-rate measurement
+        self.nslowest = nslowest # Number of slowest circles to keep for each layer
+
+        self.lock = threading.Lock()
+
+        self.stages = []
+        self.layers = {}
+
+    def add_stage(self, name, seconds, **details):
+        '''Records the wall time of a stage that has already been timed'''
+
+        entry = {'name': name, 'seconds': seconds}
+        entry.update(details)
+
+        with self.lock:
+            self.stages.append(entry)
+
+        if self.callback is not None:
+            event = {'event': 'stage'}
+            event.update(entry)
+            self.callback(event)
+
+    @contextmanager
+    def stage(self, name, **details):
+        '''Times the enclosed block as a stage: with instrumentation.stage('place planets'): ...'''
+
+        t0 = time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time()-t0, **details)
+
+    def layer(self, name):
+        '''Returns the placement statistics of one layer (e.g. planets or candidates), creating them if necessary'''
+
+        with self.lock:
+            return self.layers.setdefault(name, new_layer())
+
+    def record_placement(self, name, index, radius, trials, seconds):
+        '''Records one accepted circle: its index, radius, the number of trial positions and the time it took.
+        Safe to call from several threads at once (e.g. sector workers, or the movie's frames)'''
+
+        trials = int(trials)
+        event = None
+
+        with self.lock:
+            layer = self.layers.setdefault(name, new_layer())
+
+            layer['placed'] += 1
+            layer['trials'] += trials
+            layer['window_trials'] += trials
+            layer['max_trials'] = max(layer['max_trials'], trials)
+
+            # Trials per circle are counted in bins of powers of two (1, 2-3, 4-7, ...), so the report stays
+            # the same size however many circles are placed
+            bin = max(trials,1).bit_length()-1
+            while len(layer['trials_histogram']) <= bin:
+                layer['trials_histogram'].append(0)
+            layer['trials_histogram'][bin] += 1
+
+            # Keep the slowest circles in a min-heap of fixed size
+            entry = (seconds, int(index), float(radius), trials)
+            if len(layer['slowest']) < self.nslowest:
+                heapq.heappush(layer['slowest'], entry)
+            elif seconds > layer['slowest'][0][0]:
+                heapq.heapreplace(layer['slowest'], entry)
+
+            # Acceptance rate over the last window of placed circles
+            if layer['placed'] % self.window == 0:
+                rate = float(self.window)/layer['window_trials']
+                layer['acceptance'].append({'placed': layer['placed'], 'rate': rate})
+                layer['window_trials'] = 0
+                event = {'event': 'acceptance', 'layer': name, 'placed': layer['placed'], 'rate': rate}
+
+        if event is not None and self.callback is not None:
+            self.callback(event)
+
+    def report(self):
+        '''Returns everything recorded so far as a JSON-ready dictionary'''
+
+        with self.lock:
+            layers = {}
+            for name,layer in self.layers.items():
+                slowest = sorted(layer['slowest'], reverse=True)
+                rate = 0.0
+                if layer['trials'] > 0:
+                    rate = float(layer['placed'])/layer['trials']
+
+                layers[name] = {'placed': layer['placed'],
+                                'trials': layer['trials'],
+                                'acceptance_rate': rate,
+                                'max_trials': layer['max_trials'],
+                                'trials_histogram': histogram_bins(layer['trials_histogram']),
+                                'acceptance_over_time': list(layer['acceptance']),
+                                'slowest': [{'index': int(index), 'radius': radius, 'trials': int(trials), 'seconds': seconds}
+                                            for seconds,index,radius,trials in slowest]}
+
+            return {'stages': list(self.stages), 'placement': layers}
+
+    def write_report(self, filename):
+        '''Writes the report to a JSON file'''
+
+        with open(filename,'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+
+def new_layer():
+    '''Returns empty placement statistics for a layer'''
+
+    return {'placed': 0, 'trials': 0, 'max_trials': 0, 'trials_histogram': [], 'acceptance': [], 'slowest': [],
+            'window_trials': 0}
+
+def histogram_bins(counts):
+    '''Labels the counts of a power-of-two histogram of trials per circle: {'1': n, '2-3': n, '4-7': n, ...}'''
+
+    bins = {}
+    for bin,count in enumerate(counts):
+        low,high = 1 << bin, (2 << bin)-1
+        bins[str(low) if low==high else str(low)+'-'+str(high)] = count
+
+    return bins
+
+
+class ProgressReporter(object):
+    '''Prints progress at most once every interval seconds (instead of a line for every planet)'''
+
+    def __init__(self, label, total, interval=2.0, stream=None):
+
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        if self.stream is None:
+            self.stream = sys.stdout
+
+        self.start = time()
+        self.last = self.start
+
+    def __call__(self, done):
+        '''Reports that done items are complete (only printed if interval has passed, or at the end)'''
+
+        now = time()
+        if now-self.last < self.interval and done < self.total:
+            return
+
+        self.last = now
+        rate = done/max(now-self.start,1.0e-9)
+        self.stream.write(self.label+': '+str(done)+' of '+str(self.total)+' ('+('%.1f' % rate)+' per second)\n')
+        self.stream.flush()
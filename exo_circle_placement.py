@@ -0,0 +1,984 @@
+import numpy as np
+import os
+import heapq
+import hashlib
+import zipfile
+import warnings
+from multiprocessing import Pool
+from math import floor, sqrt
+from timeit import default_timer as time
+import exo_circle_functions as fun
+
+# Placement helpers: spatial indexing of placed circles, the batched accept/reject placing engine
+# (with an optional free-space raster for drawing trials) and the deterministic front-chain engine
+
+pi = 3.141592654
+
+# Cache of finished layouts (one .npz file of positions and radii per layout), least recently used files are
+# deleted once the cache holds more than layout_cache_size bytes
+use_layout_cache = True
+layout_cache_dir = os.environ.get('EXOPLANET_LAYOUT_CACHE_DIR',os.path.join(os.path.expanduser('~'),'.exoplanet_circle','layouts'))
+layout_cache_size = 200*1024*1024
+layout_version = 1 # Part of every layout key: increase it when a change to the placing code changes its layouts
+
+
+def make_rng(seed, *stream):
+    '''Returns a numpy Generator for the placement code. The same seed always gives the same numbers, and each
+    stream (e.g. make_rng(seed, year) or make_rng(seed, sector)) is independent of the others and of make_rng(seed).
+    seed=None gives a fresh, unpredictable generator'''
+
+    if seed is None:
+        return np.random.default_rng()
+
+    return np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=stream)))
+
+def spawn_rngs(seed, n):
+    '''Returns n independent Generators derived from seed (the same as make_rng(seed, 0) ... make_rng(seed, n-1))'''
+
+    return [np.random.Generator(np.random.PCG64(child)) for child in np.random.SeedSequence(seed).spawn(n)]
+
+
+class PlacementError(RuntimeError):
+    '''Raised when circles cannot be placed within their disc/annulus'''
+    pass
+
+
+def neighbour_cellsize(radii, placing_spacing):
+    '''Picks a grid cell size from the typical (spacing-inflated) circle diameter'''
+
+    if len(radii)==0:
+        return 1.0
+
+    cellsize = 2.0*placing_spacing*np.median(radii)
+    if cellsize <= 0.0:
+        cellsize = 1.0
+
+    return cellsize
+
+
+class NeighbourGrid(object):
+    '''Uniform grid of square cells covering [-extent,extent]^2, used to find placed circles near a trial position.
+
+    Each placed circle is registered in every cell touched by its bounding box (inflated by placing_spacing),
+    and a trial circle only checks the circles registered in the cells touched by its own inflated bounding box.
+    Two circles closer than placing_spacing*(r1+r2) always have overlapping boxes, so they always share a cell,
+    and the overlap test gives exactly the same answer as test_neighbours in exo_circle_functions'''
+
+    def __init__(self, extent, cellsize, placing_spacing, capacity=8):
+
+        self.extent = float(extent)
+        self.cellsize = float(cellsize)
+        self.placing_spacing = placing_spacing
+
+        self.ncell = int(np.ceil(2.0*self.extent/self.cellsize)) + 1
+
+        # Indices of circles registered in each cell (-1 = empty slot)
+        self.cells = -np.ones((self.ncell,self.ncell,capacity), dtype=int)
+        self.count = np.zeros((self.ncell,self.ncell), dtype=int)
+        self.maxcount = 0 # Most circles registered in any one cell
+
+        # Positions and radii of placed circles, in order of insertion
+        self.nplaced = 0
+        self.xp = np.zeros(64)
+        self.yp = np.zeros(64)
+        self.radii = np.zeros(64)
+
+    def cell_range(self, x, halfwidth):
+        '''Returns the first and last cell index (along one axis) covered by [x-halfwidth, x+halfwidth]'''
+
+        lo = int(floor((x - halfwidth + self.extent)/self.cellsize))
+        hi = int(floor((x + halfwidth + self.extent)/self.cellsize))
+
+        lo = min(max(lo,0),self.ncell-1)
+        hi = min(max(hi,0),self.ncell-1)
+
+        return lo,hi
+
+    def cell_ranges(self, x, halfwidth):
+        '''Array version of cell_range'''
+
+        lo = np.floor((x - halfwidth + self.extent)/self.cellsize).astype(int)
+        hi = np.floor((x + halfwidth + self.extent)/self.cellsize).astype(int)
+
+        lo = np.minimum(np.maximum(lo,0),self.ncell-1)
+        hi = np.minimum(np.maximum(hi,0),self.ncell-1)
+
+        return lo,hi
+
+    def insert(self, x, y, rad):
+        '''Registers a placed circle in every cell its inflated bounding box touches; returns its index'''
+
+        i = self.nplaced
+
+        # Grow storage for positions if required
+        if i==len(self.xp):
+            self.xp = np.concatenate((self.xp,np.zeros(i)))
+            self.yp = np.concatenate((self.yp,np.zeros(i)))
+            self.radii = np.concatenate((self.radii,np.zeros(i)))
+
+        self.xp[i] = x
+        self.yp[i] = y
+        self.radii[i] = rad
+        self.nplaced = i+1
+
+        halfwidth = self.placing_spacing*rad
+        x0,x1 = self.cell_range(x,halfwidth)
+        y0,y1 = self.cell_range(y,halfwidth)
+
+        ix = np.arange(x0,x1+1)[:,None]
+        iy = np.arange(y0,y1+1)[None,:]
+        count = self.count[x0:x1+1,y0:y1+1]
+
+        # Grow cell capacity if any of these cells is full
+        capacity = self.cells.shape[2]
+        if count.max() >= capacity:
+            extra = -np.ones((self.ncell,self.ncell,capacity), dtype=int)
+            self.cells = np.concatenate((self.cells,extra),axis=2)
+
+        self.cells[ix,iy,count] = i
+        count += 1
+        self.maxcount = max(self.maxcount,int(count.max()))
+
+        return i
+
+    def insert_many(self, x, y, radii):
+        '''Registers many placed circles at once, exactly as calling insert for each in turn would;
+        returns their indices'''
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        radii = np.asarray(radii, dtype=float)
+
+        first = self.nplaced
+        n = len(x)
+        if n==0:
+            return np.arange(first,first)
+
+        # Grow storage for positions if required
+        if first+n > len(self.xp):
+            extra = np.zeros(max(first+n,2*len(self.xp))-len(self.xp))
+            self.xp = np.concatenate((self.xp,extra))
+            self.yp = np.concatenate((self.yp,extra))
+            self.radii = np.concatenate((self.radii,extra))
+
+        self.xp[first:first+n] = x
+        self.yp[first:first+n] = y
+        self.radii[first:first+n] = radii
+        self.nplaced = first+n
+
+        halfwidth = self.placing_spacing*radii
+        x0,x1 = self.cell_ranges(x,halfwidth)
+        y0,y1 = self.cell_ranges(y,halfwidth)
+
+        # Every (circle, cell) pair, as a flat cell index
+        nx = x1-x0+1
+        ncells = nx*(y1-y0+1)
+        owner = np.repeat(np.arange(n),ncells)
+        k = np.arange(len(owner))-np.repeat(np.cumsum(ncells)-ncells,ncells)
+        flat = (x0[owner]+k%nx[owner])*self.ncell+(y0[owner]+k//nx[owner])
+
+        # Circles in the same cell take consecutive slots, in order of index
+        order = np.argsort(flat, kind='stable')
+        flat = flat[order]
+        owner = owner[order]
+        starts = np.flatnonzero(np.concatenate(([True],flat[1:]!=flat[:-1])))
+        rank = np.arange(len(flat))-np.repeat(starts,np.diff(np.append(starts,len(flat))))
+
+        count = self.count.reshape(-1)
+        slot = count[flat]+rank
+
+        capacity = self.cells.shape[2]
+        if slot.max() >= capacity:
+            extra = -np.ones((self.ncell,self.ncell,slot.max()+1-capacity), dtype=int)
+            self.cells = np.concatenate((self.cells,extra),axis=2)
+
+        self.cells.reshape(self.ncell*self.ncell,-1)[flat,slot] = first+owner
+        count += np.bincount(flat, minlength=len(count))
+        self.maxcount = max(self.maxcount,int(count.max()))
+
+        return np.arange(first,first+n)
+
+    def query_box(self, xmin, ymin, xmax, ymax):
+        '''Returns the indices (in order) of the placed circles that reach into the box [xmin,xmax] x [ymin,ymax]
+        (whose bounding boxes meet it)'''
+
+        if self.nplaced==0:
+            return np.zeros(0, dtype=int)
+
+        x0,x1 = self.cell_range(0.5*(xmin+xmax),0.5*(xmax-xmin))
+        y0,y1 = self.cell_range(0.5*(ymin+ymax),0.5*(ymax-ymin))
+
+        nearby = self.cells[x0:x1+1,y0:y1+1,:self.maxcount].ravel()
+        nearby = np.unique(nearby[nearby>=0])
+
+        rad = self.radii[nearby]
+        inside = (self.xp[nearby]+rad >= xmin) & (self.xp[nearby]-rad <= xmax) & \
+                 (self.yp[nearby]+rad >= ymin) & (self.yp[nearby]-rad <= ymax)
+
+        return nearby[inside]
+
+    def test_neighbours(self, x, y, rad):
+        '''Tests whether a circle at (x,y) overlaps with any of the placed circles (1=overlap, 0=free)'''
+
+        halfwidth = self.placing_spacing*rad
+        x0,x1 = self.cell_range(x,halfwidth)
+        y0,y1 = self.cell_range(y,halfwidth)
+
+        nearby = self.cells[x0:x1+1,y0:y1+1,:].ravel()
+        nearby = nearby[nearby>=0]
+
+        if len(nearby)==0:
+            return 0
+
+        sep = (x-self.xp[nearby])**2 + (y-self.yp[nearby])**2
+        sep = np.sqrt(sep)
+
+        minsep = self.placing_spacing*(rad+self.radii[nearby])
+
+        overlapflag = 0
+        if np.any(sep < minsep):
+            overlapflag = 1
+
+        return overlapflag
+
+    def overlaps(self, x, y, rad):
+        '''Vectorised overlap test for an array of trial positions sharing the same radius: returns a boolean array'''
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        if self.nplaced==0 or len(x)==0:
+            return np.zeros(len(x), dtype=bool)
+
+        halfwidth = self.placing_spacing*rad
+        x0,x1 = self.cell_ranges(x,halfwidth)
+        y0,y1 = self.cell_ranges(y,halfwidth)
+
+        # Every trial box covers at most span cells along each axis
+        span = max(np.max(x1-x0),np.max(y1-y0)) + 1
+        offset = np.arange(span)
+
+        ix = np.minimum(x0[:,None]+offset,self.ncell-1)
+        iy = np.minimum(y0[:,None]+offset,self.ncell-1)
+
+        # Gather the circles registered in each trial's cells: shape (ntrial, span*span*capacity)
+        capacity = self.maxcount
+        nearby = self.cells[ix[:,:,None],iy[:,None,:],:capacity].reshape(len(x),-1)
+
+        registered = nearby>=0
+        nearby = np.where(registered,nearby,0)
+
+        sep = (x[:,None]-self.xp[nearby])**2 + (y[:,None]-self.yp[nearby])**2
+        sep = np.sqrt(sep)
+
+        minsep = self.placing_spacing*(rad+self.radii[nearby])
+
+        return np.any(registered & (sep < minsep),axis=1)
+
+
+class OccupancyRaster(object):
+    '''Coarse distance field over [-extent,extent]^2, used to draw trial positions only where there is free space.
+
+    Each cell holds D = min(|q - c| - placing_spacing*r) over the placed circles (c,r), at its centre q, capped at
+    reach (cells further than that from every circle keep D = inf). D changes by at most the distance moved, so
+    no point of a cell can take a new circle of radius r (i.e. be placing_spacing*r clear of every circle) unless
+    D + half the cell diagonal >= placing_spacing*r. Trials are drawn uniformly in the cells that pass this test
+    (and could be inside the disc/annulus), and still have to pass the exact overlap test'''
+
+    def __init__(self, extent, cellsize, placing_spacing, reach, maxcells=2048):
+
+        self.extent = float(extent)
+        self.cellsize = max(float(cellsize),2.0*self.extent/maxcells)
+        self.placing_spacing = placing_spacing
+        self.reach = reach # Largest value of placing_spacing*r that will be asked for
+
+        self.ncell = int(np.ceil(2.0*self.extent/self.cellsize))
+        self.halfdiagonal = self.cellsize/np.sqrt(2.0)
+
+        centres = -self.extent + (np.arange(self.ncell)+0.5)*self.cellsize
+        self.xc = np.repeat(centres,self.ncell)
+        self.yc = np.tile(centres,self.ncell)
+        self.rc = np.sqrt(self.xc*self.xc + self.yc*self.yc)
+
+        self.distance = np.empty(self.ncell*self.ncell)
+        self.distance.fill(np.inf)
+
+        # Cells that may have room for the current radius (refreshed by select_cells)
+        self.free = np.arange(self.ncell*self.ncell)
+        self.free_threshold = None
+
+    def insert(self, x, y, rad):
+        '''Lowers the distance field around a newly placed circle'''
+
+        halfwidth = self.placing_spacing*rad + self.reach + self.halfdiagonal
+        lo = int(floor((x - halfwidth + self.extent)/self.cellsize))
+        hi = int(floor((x + halfwidth + self.extent)/self.cellsize))
+        x0,x1 = min(max(lo,0),self.ncell-1),min(max(hi,0),self.ncell-1)
+        lo = int(floor((y - halfwidth + self.extent)/self.cellsize))
+        hi = int(floor((y + halfwidth + self.extent)/self.cellsize))
+        y0,y1 = min(max(lo,0),self.ncell-1),min(max(hi,0),self.ncell-1)
+
+        cells = (np.arange(x0,x1+1)[:,None]*self.ncell + np.arange(y0,y1+1)[None,:]).ravel()
+
+        d = np.sqrt((self.xc[cells]-x)**2 + (self.yc[cells]-y)**2) - self.placing_spacing*rad
+        self.distance[cells] = np.minimum(self.distance[cells],d)
+
+    def select_cells(self, rad, rmin, rmax, slack=0.9):
+        '''Rebuilds the list of cells with room for a circle of radius rad (or anything down to slack*rad)'''
+
+        rad = slack*rad
+        threshold = self.placing_spacing*rad
+
+        viable = self.distance + self.halfdiagonal >= threshold
+        viable &= self.rc - self.halfdiagonal <= rmax - rad
+        if rmin!=0.0:
+            viable &= self.rc + self.halfdiagonal >= rmin + rad
+
+        self.free = np.flatnonzero(viable)
+        self.free_threshold = threshold
+
+    def sample(self, rng, ntrial, rad, rmin, rmax):
+        '''Draws up to ntrial trial positions for a circle of radius rad, from cells that still have room for it.
+        Returns the x and y positions, and the number of draws made (draws from full cells give no position)'''
+
+        threshold = self.placing_spacing*rad
+
+        # Smaller circles may fit in cells left out for the radius the cell list was built for
+        if self.free_threshold is None or threshold < self.free_threshold:
+            self.select_cells(rad, rmin, rmax)
+
+        if len(self.free)==0:
+            return np.zeros(0),np.zeros(0),ntrial
+
+        cells = self.free[rng.integers(len(self.free),size=ntrial)]
+        offsets = rng.uniform(low=-0.5,high=0.5,size=(2,ntrial))*self.cellsize
+
+        room = self.distance[cells] + self.halfdiagonal >= threshold
+
+        # Drop cells that have filled up since the list was built, once they make up most of it
+        if np.count_nonzero(room) < ntrial//2:
+            keep = self.distance[self.free] + self.halfdiagonal >= self.free_threshold
+            self.free = self.free[keep]
+
+        cells = cells[room]
+        x = self.xc[cells] + offsets[0][room]
+        y = self.yc[cells] + offsets[1][room]
+
+        return x,y,ntrial
+
+
+def test_sector_many(x,y,rad,sector,placing_spacing):
+    '''Returns a boolean array, True where a circle is not inside the sector (phi0,phi1) of the disc, at least
+    placing_spacing*rad from both of its edges (so circles in different sectors can never overlap)'''
+
+    phi0,phi1 = sector
+    clearance = placing_spacing*rad
+
+    fail = -x*np.sin(phi0) + y*np.cos(phi0) < clearance
+    fail = fail | (x*np.sin(phi1) - y*np.cos(phi1) < clearance)
+
+    return fail
+
+def test_rad_many(x,y,rad,rmin,rmax):
+    '''Vectorised test_rad: returns a boolean array, True where the circle exceeds its minimum/maximum radii'''
+
+    r = np.sqrt(x*x + y*y)
+    fail = r+rad > rmax
+    if rmin!=0.0:
+        fail = fail | (r-rad < rmin)
+
+    return fail
+
+def place_circles(radii, rmin, rmax, placing_spacing, rng=None, grid=None,
+                  test_bounds=True, nbatch=8, nbatch_max=4096, max_trials=None, sampler='polar', sector=None,
+                  skip_unplaced=False, stats=None, layer='circles', progress=None):
+    '''Places circles (in the order given) at random inside the disc/annulus rmin < r < rmax, without overlaps.
+
+    Trial positions are drawn (from the Generator rng, see make_rng; a fresh one if None) in blocks of K, and the whole block is tested at once against the placed circles
+    (held in a NeighbourGrid); the first valid trial is accepted. K follows the recent number of trials needed
+    per accepted circle, and doubles whenever a whole block is rejected.
+    With sampler='polar', trial positions are drawn uniformly in radius and angle; with sampler='raster', they
+    are drawn from the cells of an OccupancyRaster that still have room for the circle, so the rejection rate
+    stays low as the disc fills up.
+    If test_bounds is False, trial radii are drawn from [rmin,rmax] and circles may overhang the edges
+    (as in exoplanet_circle_movie.py); a circle that cannot find space there is gradually pushed outwards.
+    This requires sampler='polar'. Circles already in grid (if given) are treated as fixed obstacles.
+    If stats (an exo_circle_instrument.Instrumentation) is given, the trials and time taken by every circle are
+    recorded under layer; progress (if given) is called with the number of circles placed so far.
+    If sector = (phi0,phi1) is given, circles are kept inside that sector (see test_sector_many).
+    If a circle needs more than max_trials trial positions, PlacementError is raised (or with skip_unplaced,
+    its position is set to NaN and the next circle is placed).
+    Returns arrays of x and y positions'''
+
+    nplanet = len(radii)
+
+    xp = np.zeros(nplanet)
+    yp = np.zeros(nplanet)
+
+    if rng is None:
+        rng = make_rng(None)
+
+    if grid is None:
+        grid = NeighbourGrid(rmax, neighbour_cellsize(radii,placing_spacing), placing_spacing)
+
+    raster = None
+    if sampler=='raster':
+        if not test_bounds:
+            raise ValueError('The raster sampler needs test_bounds=True')
+        if nplanet > 0:
+            raster = OccupancyRaster(rmax, 0.5*neighbour_cellsize(radii,placing_spacing), placing_spacing,
+                                     placing_spacing*np.max(radii))
+            for j in range(grid.nplaced):
+                raster.insert(grid.xp[j], grid.yp[j], grid.radii[j])
+    elif sampler!='polar':
+        raise ValueError('Unknown sampler: '+str(sampler))
+
+    if sector is not None:
+        if raster is not None:
+            raise ValueError('Sectors need the polar sampler')
+        phi0,phi1 = sector
+    else:
+        phi0,phi1 = 0.0,2.0*pi
+
+    ntrial = nbatch
+    mean_trials = 1.0
+
+    for i in range(nplanet):
+
+        if test_bounds:
+            low = 0.0
+            if rmin!=0.0: low = rmin + radii[i]
+            high = rmax - radii[i]
+        else:
+            low = rmin
+            high = rmax
+
+        trials = 0
+        if stats is not None: t0 = time()
+
+        while True:
+            if raster is None:
+                rad = rng.uniform(low=low,high=high,size=ntrial)
+                phi = rng.uniform(low=phi0,high=phi1,size=ntrial)
+
+                x = rad*np.cos(phi)
+                y = rad*np.sin(phi)
+                ndraw = ntrial
+            else:
+                x,y,ndraw = raster.sample(rng, ntrial, radii[i], rmin, rmax)
+                if len(raster.free)==0:
+                    raise PlacementError('No room left for circle '+str(i)+' (radius '+str(radii[i])+')')
+
+            fail = grid.overlaps(x, y, radii[i])
+            if test_bounds:
+                fail = fail | test_rad_many(x, y, radii[i], rmin, rmax)
+            if sector is not None:
+                fail = fail | test_sector_many(x, y, radii[i], sector, placing_spacing)
+
+            accepted = np.flatnonzero(~fail)
+
+            if len(accepted) > 0:
+                k = accepted[0]
+                trials += k+1
+                break
+
+            trials += ndraw
+
+            if max_trials is not None and trials > max_trials:
+                if skip_unplaced: break
+                raise PlacementError('Circle '+str(i)+' (radius '+str(radii[i])+') not placed after '+str(trials)+' trials')
+
+            # Without bounds, a circle that finds no space in a full block is allowed to spill further out
+            if ntrial==nbatch_max and not test_bounds:
+                high = 1.05*high
+
+            ntrial = min(2*ntrial,nbatch_max)
+
+        if len(accepted)==0:
+            xp[i] = np.nan
+            yp[i] = np.nan
+            continue
+
+        xp[i] = x[k]
+        yp[i] = y[k]
+        grid.insert(xp[i], yp[i], radii[i])
+        if raster is not None:
+            raster.insert(xp[i], yp[i], radii[i])
+
+        if stats is not None:
+            stats.record_placement(layer, i, radii[i], trials, time()-t0)
+        if progress is not None:
+            progress(i+1)
+
+        # Adapt the block size to the recent acceptance rate
+        mean_trials = 0.9*mean_trials + 0.1*trials
+        ntrial = int(min(max(2.0*mean_trials,nbatch),nbatch_max))
+
+    return xp,yp
+
+
+class PlacementLog(object):
+    '''Keeps the record_placement calls made by place_circles, so they can be sent back from a worker process
+    and replayed into an exo_circle_instrument.Instrumentation'''
+
+    def __init__(self):
+        self.records = []
+
+    def record_placement(self, name, index, radius, trials, seconds):
+        self.records.append((index, radius, int(trials), seconds))
+
+def place_sector(args):
+    '''Places the circles of one sector of an annulus, with that sector's own random number stream
+    (args = radii, rmin, rmax, placing_spacing, seed, stream, sector number, number of sectors, trial budget per
+    circle, and the positions and radii of circles already placed). Circles that use up the budget are left unplaced (NaN).
+    Returns positions and the PlacementLog of the placed circles'''
+
+    radii, rmin, rmax, placing_spacing, seed, stream, k, nsectors, budget, fixed = args
+
+    rng = make_rng(seed,*(stream+(k,)))
+    sector = (2.0*pi*k/nsectors, 2.0*pi*(k+1)/nsectors)
+
+    grid = NeighbourGrid(rmax, neighbour_cellsize(radii,placing_spacing), placing_spacing)
+    for x,y,rad in zip(*fixed):
+        grid.insert(x, y, rad)
+
+    log = PlacementLog()
+    xp,yp = place_circles(radii, rmin, rmax, placing_spacing, rng=rng, grid=grid, max_trials=budget, sector=sector,
+                          skip_unplaced=True, stats=log)
+
+    return xp,yp,log
+
+def place_annulus_sectors(radii, rmin, rmax, placing_spacing, seed, nsectors, jobs=1, budget=20000,
+                          max_trials=None, stream=(), stats=None, layer='circles', progress=None):
+    '''Places circles (in descending order of radius) in the annulus rmin < r < rmax with several processes.
+
+    The annulus is split into nsectors equal sectors. Circles too large to move around freely in a sector
+    (diameter more than half the annulus width or the sector width) are placed first, serially. The others are
+    dealt out to the sectors in turn, so every sector gets a similar mix of sizes, and each sector is placed by one
+    of jobs worker processes with its own random number stream make_rng(seed, *stream, sector number), keeping its
+    circles away from the sector edges. Circles that find no room within budget trials are then placed serially
+    among the others, which also fills the gaps along the sector edges.
+    The layout depends only on seed, stream and nsectors, not on jobs. Returns arrays of x and y positions'''
+
+    nplanet = len(radii)
+
+    xp = np.zeros(nplanet)
+    yp = np.zeros(nplanet)
+    xp.fill(np.nan)
+    yp.fill(np.nan)
+
+    if nsectors < 2:
+        raise ValueError('At least two sectors are needed')
+
+    grid = NeighbourGrid(rmax, neighbour_cellsize(radii,placing_spacing), placing_spacing)
+
+    def place_serially(index, number):
+        '''Places circles one after another among everything placed so far, recording them'''
+
+        rng = make_rng(seed,*(stream+(number,)))
+        log = PlacementLog()
+        xs,ys = place_circles(radii[index], rmin, rmax, placing_spacing, rng=rng, grid=grid,
+                              max_trials=max_trials, stats=log)
+        xp[index] = xs
+        yp[index] = ys
+        record(index,log)
+
+    placed = [0]
+    def record(index, log):
+        for j,rad,trials,seconds in log.records:
+            placed[0] += 1
+            if stats is not None: stats.record_placement(layer, index[j], rad, trials, seconds)
+            if progress is not None: progress(placed[0])
+
+    # 1. The largest circles
+    width = min(rmax-rmin, 2.0*pi*rmin/nsectors)
+    nlead = np.count_nonzero(2.0*placing_spacing*np.asarray(radii) > 0.5*width)
+    lead = np.arange(nlead)
+    place_serially(lead, nsectors)
+
+    # 2. Every sector at once
+    fixed = (xp[lead],yp[lead],radii[lead])
+    tasks = [(radii[nlead+k::nsectors], rmin, rmax, placing_spacing, seed, stream, k, nsectors, budget, fixed)
+             for k in range(nsectors)]
+
+    if jobs > 1:
+        pool = Pool(jobs)
+        try:
+            results = pool.map(place_sector, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [place_sector(task) for task in tasks]
+
+    for k in range(nsectors):
+        index = np.arange(nlead+k,nplanet,nsectors)
+        xs,ys,log = results[k]
+
+        xp[index] = xs
+        yp[index] = ys
+
+        for j,rad,trials,seconds in log.records:
+            grid.insert(xs[j], ys[j], rad)
+        record(index,log)
+
+    # 3. Reconciliation: circles left over by the sectors (largest first), placed among everything else
+    leftover = np.flatnonzero(np.isnan(xp))
+    place_serially(leftover, nsectors+1)
+
+    return xp,yp
+
+
+def tangent_position(xa,ya,ra,xb,yb,rb,rc):
+    '''Centre of a circle of radius rc touching circles a and b, on the left of the line from b to a'''
+
+    dx = xb-xa
+    dy = yb-ya
+    d2 = dx*dx + dy*dy
+
+    if d2==0.0:
+        return xa+rc,ya
+
+    a2 = (ra+rc)*(ra+rc)
+    b2 = (rb+rc)*(rb+rc)
+
+    if a2 > b2:
+        x = (d2+b2-a2)/(2.0*d2)
+        y = sqrt(max(0.0,b2/d2-x*x))
+        return xb-x*dx-y*dy, yb-x*dy+y*dx
+    else:
+        x = (d2+a2-b2)/(2.0*d2)
+        y = sqrt(max(0.0,a2/d2-x*x))
+        return xa+x*dx-y*dy, ya+x*dy+y*dx
+
+def place_circles_frontchain(radii, rmin, rmax, placing_spacing, stats=None, layer='circles', progress=None):
+    '''Places circles (in the order given, ideally descending radius) deterministically, without rejection sampling.
+
+    Front-chain packing (Wang et al. 2006): the circles on the outside of the pack form a closed chain. Each new
+    circle is put against the pair of neighbouring chain circles closest to the centre (found with a heap), and
+    if it hits another chain circle, the chain is cut back to that circle and the circle is tried again.
+    Circles are packed with radius placing_spacing*r, so touching circles keep the placing_spacing gap.
+    For an annulus (rmin > 0) the inner disc starts the chain, and the pack grows outwards from it.
+    Positions are checked exactly against the placed circles (via a NeighbourGrid) and against the bounds of
+    test_rad; a pair whose position fails is skipped until the next circle is placed.
+    Raises PlacementError if the circles do not fit inside rmax. Returns arrays of x and y positions'''
+
+    nplanet = len(radii)
+
+    xp = np.zeros(nplanet)
+    yp = np.zeros(nplanet)
+
+    grid = NeighbourGrid(rmax, neighbour_cellsize(radii,placing_spacing), placing_spacing)
+
+    if nplanet==0:
+        return xp,yp
+
+    # Packing radii: a small margin keeps touching circles just outside placing_spacing*(r1+r2)
+    # Node nplanet is the inner disc of an annulus
+    packrad = list(placing_spacing*np.asarray(radii,dtype=float)*(1.0+1.0e-9))
+    packrad.append(rmin)
+
+    x = [0.0]*(nplanet+1)
+    y = [0.0]*(nplanet+1)
+
+    nextnode = [-1]*(nplanet+1)
+    prevnode = [-1]*(nplanet+1)
+    inchain = [False]*(nplanet+1)
+
+    inner = nplanet
+
+    def fits(i,xi,yi):
+        '''Exact checks: inside the bounds, and clear of every placed circle'''
+        r = sqrt(xi*xi+yi*yi)
+        if r+radii[i] > rmax: return False
+        if rmin!=0.0 and r-radii[i] < rmin: return False
+        return grid.test_neighbours(xi,yi,radii[i])==0
+
+    def accept(i,xi,yi):
+        xp[i] = xi
+        yp[i] = yi
+        x[i] = xi
+        y[i] = yi
+        grid.insert(xi,yi,radii[i])
+        if stats is not None: stats.record_placement(layer,i,radii[i],1,0.0)
+        if progress is not None: progress(i+1)
+
+    def score(node):
+        '''Squared distance from the centre of the weighted midpoint of node and the next node on the chain'''
+        other = nextnode[node]
+        ra = packrad[node]
+        rb = packrad[other]
+        xm = (x[node]*rb + x[other]*ra)/(ra+rb)
+        ym = (y[node]*rb + y[other]*ra)/(ra+rb)
+        return xm*xm + ym*ym
+
+    def intersects(node,xi,yi,ri):
+        dx = x[node]-xi
+        dy = y[node]-yi
+        dr = (packrad[node]+ri)*(1.0-1.0e-12)
+        return dr*dr > dx*dx + dy*dy
+
+    # Start the chain with three circles (or the inner disc and two circles)
+    if rmin==0.0:
+        if nplanet==1:
+            if not fits(0,0.0,0.0): raise PlacementError('Circle 0 does not fit inside radius '+str(rmax))
+            accept(0,0.0,0.0)
+            return xp,yp
+        first = [0,1]
+        xa,xb = -packrad[1],packrad[0]
+        start = 2
+    else:
+        first = [inner,0]
+        xa,xb = 0.0,rmin+packrad[0]
+        start = 1
+
+    a,b = first
+    for node,xnode in ((a,xa),(b,xb)):
+        if node!=inner:
+            if not fits(node,xnode,0.0): raise PlacementError('Circle '+str(node)+' does not fit inside radius '+str(rmax))
+            accept(node,xnode,0.0)
+        else:
+            x[node] = xnode
+
+    if start==nplanet:
+        return xp,yp
+
+    c = start
+    xc,yc = tangent_position(x[a],y[a],packrad[a],x[b],y[b],packrad[b],packrad[c])
+    if not fits(c,xc,yc): raise PlacementError('Circle '+str(c)+' does not fit inside radius '+str(rmax))
+    accept(c,xc,yc)
+
+    nextnode[a] = b
+    nextnode[b] = c
+    nextnode[c] = a
+    prevnode[b] = a
+    prevnode[c] = b
+    prevnode[a] = c
+    for node in (a,b,c):
+        inchain[node] = True
+
+    heap = [(score(node),node,nextnode[node]) for node in (a,b,c)]
+    heapq.heapify(heap)
+
+    blocked = []
+
+    def best_pair():
+        '''Pops the chain pair closest to the centre (entries for pairs that no longer exist are discarded)'''
+        while len(heap) > 0:
+            s,node,other = heapq.heappop(heap)
+            if inchain[node] and nextnode[node]==other:
+                return node
+        return -1
+
+    a = best_pair()
+
+    i = start+1
+    while i < nplanet:
+
+        if a==-1:
+            raise PlacementError('Circle '+str(i)+' (radius '+str(radii[i])+') does not fit inside radius '+str(rmax))
+
+        b = nextnode[a]
+        xi,yi = tangent_position(x[b],y[b],packrad[b],x[a],y[a],packrad[a],packrad[i])
+
+        # Chain circles hit by the new position (the inner disc counts as a circle of radius rmin)
+        hits = set()
+        clear = grid.test_neighbours(xi,yi,radii[i])==0
+        if not clear:
+            nearby = grid_hits(grid,xi,yi,radii[i])
+            hits.update(node for node in nearby if inchain[node])
+            if len(hits)==0:
+                hits = None
+        if rmin!=0.0 and intersects(inner,xi,yi,packrad[i]):
+            if inchain[inner]:
+                hits = (hits or set()) | set([inner])
+            else:
+                hits = None
+
+        hits = hits if hits is None else hits - set([a,b])
+
+        if hits is not None and len(hits) > 0:
+            # Cut the chain back to the nearest hit circle (measured along the chain), and try again
+            j = nextnode[b]
+            k = prevnode[a]
+            sj = packrad[b]
+            sk = packrad[a]
+            while True:
+                if sj <= sk:
+                    if j in hits:
+                        node = b
+                        while node!=j:
+                            inchain[node] = False
+                            node = nextnode[node]
+                        b = j
+                        break
+                    sj += packrad[j]
+                    j = nextnode[j]
+                else:
+                    if k in hits:
+                        node = nextnode[k]
+                        while node!=b:
+                            inchain[node] = False
+                            node = nextnode[node]
+                        a = k
+                        break
+                    sk += packrad[k]
+                    k = prevnode[k]
+            nextnode[a] = b
+            prevnode[b] = a
+            continue
+
+        r = sqrt(xi*xi+yi*yi)
+        outside = r+radii[i] > rmax or (rmin!=0.0 and r-radii[i] < rmin)
+
+        if hits is None or outside or not clear:
+            # This pair cannot take the circle (it would leave the bounds, or overlap an enclosed circle):
+            # set it aside and try the next-closest pair
+            blocked.append(a)
+            a = best_pair()
+            continue
+
+        # Success: insert the new circle between a and b
+        accept(i,xi,yi)
+
+        nextnode[a] = i
+        prevnode[i] = a
+        nextnode[i] = b
+        prevnode[b] = i
+        inchain[i] = True
+
+        heapq.heappush(heap,(score(a),a,i))
+        heapq.heappush(heap,(score(i),i,b))
+
+        for node in blocked:
+            if inchain[node]:
+                heapq.heappush(heap,(score(node),node,nextnode[node]))
+        blocked = []
+
+        a = best_pair()
+        i += 1
+
+    return xp,yp
+
+def grid_hits(grid,x,y,rad):
+    '''Returns the indices of the circles in grid that overlap a circle at (x,y)'''
+
+    halfwidth = grid.placing_spacing*rad
+    x0,x1 = grid.cell_range(x,halfwidth)
+    y0,y1 = grid.cell_range(y,halfwidth)
+
+    nearby = grid.cells[x0:x1+1,y0:y1+1,:].ravel()
+    nearby = np.unique(nearby[nearby>=0])
+
+    sep = np.sqrt((x-grid.xp[nearby])**2 + (y-grid.yp[nearby])**2)
+    minsep = grid.placing_spacing*(rad+grid.radii[nearby])
+
+    return [int(node) for node in nearby[sep < minsep]]
+
+def place_layer(engine, radii, rmin, rmax, placing_spacing, rng=None, max_trials=None, sampler='polar',
+                stats=None, layer='circles', progress=None):
+    '''Places circles inside rmin < r < rmax with the chosen engine: 'random' (place_circles, accept/reject,
+    drawing trials with sampler) or 'frontchain' (place_circles_frontchain, deterministic).
+    Returns arrays of x and y positions'''
+
+    if engine=='random':
+        return place_circles(radii, rmin, rmax, placing_spacing, rng=rng, max_trials=max_trials, sampler=sampler,
+                             stats=stats, layer=layer, progress=progress)
+    elif engine=='frontchain':
+        return place_circles_frontchain(radii, rmin, rmax, placing_spacing, stats=stats, layer=layer, progress=progress)
+    else:
+        raise ValueError('Unknown placement engine: '+str(engine))
+
+
+def engine_settings(engine, sampler='polar', jobs=1):
+    '''The settings that change the layouts an engine makes, as a string for layout_key: the random engine's
+    sampler and number of sectors (jobs, when above 1); the frontchain engine depends on neither'''
+
+    if engine=='frontchain':
+        return engine
+
+    return engine+'/'+sampler+'/'+str(max(int(jobs),1))
+
+def layout_key(radii, seed, area_spacing_factor, placing_spacing, engine, previous=''):
+    '''Hash identifying a layout: the sorted radii of every layer (a list of arrays), the seed, the spacing
+    parameters and the placement engine (see engine_settings), plus layout_version and, for layouts built on an
+    earlier one, that layout's key'''
+
+    key = hashlib.sha1()
+    key.update(('layout '+str(layout_version)+'|').encode('utf-8'))
+    for layer in radii:
+        layer = np.sort(np.asarray(layer,dtype='<f8'))
+        key.update(str(len(layer)).encode('utf-8'))
+        key.update(layer.tobytes())
+
+    settings = '|'.join((str(seed),repr(float(area_spacing_factor)),repr(float(placing_spacing)),str(engine),previous))
+    key.update(settings.encode('utf-8'))
+
+    return key.hexdigest()
+
+def layout_filename(key):
+    '''Location of a cached layout'''
+
+    return os.path.join(layout_cache_dir,key+'.npz')
+
+def load_layout(key):
+    '''Reads a cached layout: returns a dictionary of its arrays, or None if it is not cached.
+    A layout that is read is marked as recently used'''
+
+    filename = layout_filename(key)
+
+    if not use_layout_cache or not os.path.exists(filename):
+        return None
+
+    try:
+        cached = np.load(filename)
+        layout = dict((name,cached[name]) for name in cached.files)
+        cached.close()
+        os.utime(filename,None)
+    except (IOError,OSError,ValueError,KeyError,EOFError,zipfile.BadZipFile):
+        # A truncated or damaged file is a cache miss
+        return None
+
+    return layout
+
+def save_layout(key, **arrays):
+    '''Writes a layout (e.g. radii=..., xp=..., yp=...) to the cache, then trims the cache to layout_cache_size.
+    A cache that cannot be written (read-only or full disk) only gives a warning: the layout is still good'''
+
+    if not use_layout_cache:
+        return
+
+    try:
+        fun.write_atomically(layout_filename(key), lambda f: np.savez(f,**arrays))
+    except OSError as error:
+        warnings.warn('Could not write to the layout cache ('+str(error)+'): the layout is not kept')
+        return
+
+    evict_layouts(layout_cache_size)
+
+def evict_layouts(maxbytes):
+    '''Deletes the least recently used layouts until the cache holds at most maxbytes'''
+
+    if not os.path.isdir(layout_cache_dir):
+        return
+
+    entries = []
+    for name in os.listdir(layout_cache_dir):
+        if not name.endswith('.npz'): continue
+        filename = os.path.join(layout_cache_dir,name)
+        try:
+            info = os.stat(filename)
+        except OSError:
+            continue
+        entries.append((info.st_mtime,info.st_size,filename))
+
+    entries.sort()
+    total = sum(size for used,size,filename in entries)
+
+    for used,size,filename in entries:
+        if total <= maxbytes: break
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        total -= size
@@ -0,0 +1,359 @@
+import numpy as np
+import zlib
+import struct
+from collections import OrderedDict
+import exo_circle_functions as fun
+
+# Draws placed circles straight into a numpy image, instead of building a matplotlib artist for them,
+# and writes the result as a PNG file without going through matplotlib either
+#
+# Images are built from layers: float arrays of shape (height, width, 4) holding premultiplied colour and alpha.
+# Circles are anti-aliased by their coverage of each pixel; coverage is summed rather than composited one circle
+# at a time (placed circles do not overlap, so the two agree), which lets many circles be drawn at once and more
+# circles be added to a layer later. Text (legends and captions) is drawn by matplotlib on a transparent figure,
+# and composited on top (see figure_layer and save_figure)
+#
+# Layers can be kept in a LayerCache and reused by later images: an image is then composited from cached layers,
+# and only the layers whose contents have changed are drawn again
+
+raster_chunk = 1<<21 # Pixels of circle bounding boxes evaluated at a time
+png_compression = 6 # zlib level used for PNG files (0-9)
+layer_cache_size = 16 # Layers kept by a LayerCache
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+
+def blank_layer(width, height):
+    '''Returns an empty (fully transparent) layer'''
+
+    return np.zeros((height,width,4), dtype=np.float32)
+
+def axis_transform(axis, height):
+    '''Returns (sx, ox, sy, oy), mapping data coordinates of a matplotlib axis to pixel coordinates of its figure's
+    image: column = sx*x+ox, row = sy*y+oy (rows count down from the top, and pixel k spans k to k+1)'''
+
+    origin,xunit,yunit = axis.transData.transform([(0.0,0.0),(1.0,0.0),(0.0,1.0)])
+
+    sx = xunit[0]-origin[0]
+    sy = -(yunit[1]-origin[1])
+
+    return sx, origin[0], sy, height-origin[1]
+
+def axis_viewport(fig, axis):
+    '''Returns the viewport of a matplotlib axis: (width, height, sx, ox, sy, oy), the size of its figure's image
+    and the transform from data coordinates to pixels (see axis_transform)'''
+
+    width,height = figure_size(fig)
+
+    return (width,height)+tuple(float(value) for value in axis_transform(axis, height))
+
+def draw_circles(layer, px, py, rx, ry, colours, alpha=1.0):
+    '''Adds circles (or ellipses, if an axis has different x and y scales) to a layer: centres px, py and radii
+    rx, ry in pixels, colours an (N,3) array (or one colour for all of them).
+    Every circle's bounding box (the part inside the image) is evaluated; circles with boxes of the same size are
+    done together'''
+
+    px = np.atleast_1d(np.asarray(px,dtype=float))
+    py = np.atleast_1d(np.asarray(py,dtype=float))
+    rx = np.abs(np.broadcast_to(np.asarray(rx,dtype=float),px.shape))
+    ry = np.abs(np.broadcast_to(np.asarray(ry,dtype=float),px.shape))
+    colours = np.broadcast_to(np.asarray(colours,dtype=np.float32),px.shape+(3,))
+
+    height,width = layer.shape[:2]
+
+    # Circles smaller than a pixel are drawn at least half a pixel in radius, with their coverage scaled down to
+    # their area (the anti-aliased edge of a circle of radius r covers pi*(r*r+1/12) pixels in all)
+    rxe = np.maximum(rx,0.5)
+    rye = np.maximum(ry,0.5)
+    scale = np.where(rx*ry < 1.0, (rx*ry)/(rxe*rye+1.0/12.0), 1.0)*alpha
+
+    # Bounding boxes in pixels (with half a pixel to spare for the anti-aliased edge)
+    x0 = np.floor(px-rxe-0.5).astype(np.int64)
+    y0 = np.floor(py-rye-0.5).astype(np.int64)
+    x1 = np.ceil(px+rxe+0.5).astype(np.int64)
+    y1 = np.ceil(py+rye+0.5).astype(np.int64)
+
+    # Clip the boxes to the image, and skip circles entirely outside it
+    x0 = np.maximum(x0,0)
+    y0 = np.maximum(y0,0)
+    nx = np.minimum(x1,width)-x0
+    ny = np.minimum(y1,height)-y0
+
+    visible = (nx > 0) & (ny > 0) & (scale > 0.0)
+
+    pixels = []
+    coverages = []
+    circles = []
+
+    boxes = nx*(ny.max(initial=0)+1)+ny
+    for box in np.unique(boxes[visible]):
+
+        members = np.flatnonzero(visible & (boxes==box))
+        kx = int(nx[members[0]])
+        ky = int(ny[members[0]])
+
+        step = max(raster_chunk//(kx*ky),1)
+
+        for start in range(0,len(members),step):
+            index = members[start:start+step]
+
+            # Pixel centres of every box, relative to the centre of its circle
+            ix = x0[index,None]+np.arange(kx)
+            iy = y0[index,None]+np.arange(ky)
+            dx = (ix+0.5-px[index,None])/rxe[index,None]
+            dy = (iy+0.5-py[index,None])/rye[index,None]
+
+            u = dx[:,None,:]
+            v = dy[:,:,None]
+            d = np.sqrt(u*u+v*v)
+
+            # Distance to the edge in pixels (from the gradient of d), and the covered fraction of each pixel
+            g = np.sqrt((u/rxe[index,None,None])**2+(v/rye[index,None,None])**2)
+            edge = np.divide((1.0-d)*d, g, out=np.full(d.shape,np.inf), where=g>0.0)
+            coverage = np.clip(edge+0.5,0.0,1.0)*scale[index,None,None]
+
+            inside = (coverage > 0.0) & (ix[:,None,:] >= 0) & (ix[:,None,:] < width) & \
+                     (iy[:,:,None] >= 0) & (iy[:,:,None] < height)
+
+            flat = iy[:,:,None]*width+ix[:,None,:]
+            pixels.append(flat[inside])
+            coverages.append(coverage[inside])
+            circles.append(np.broadcast_to(index[:,None,None],inside.shape)[inside])
+
+    if len(pixels)==0:
+        return layer
+
+    pixels = np.concatenate(pixels)
+    coverages = np.concatenate(coverages)
+    circles = np.concatenate(circles)
+
+    npixel = width*height
+    flat_layer = layer.reshape(npixel,4)
+
+    flat_layer[:,3] += np.bincount(pixels, weights=coverages, minlength=npixel).astype(np.float32)
+    for channel in range(3):
+        weights = coverages*colours[circles,channel]
+        flat_layer[:,channel] += np.bincount(pixels, weights=weights, minlength=npixel).astype(np.float32)
+
+    return layer
+
+def draw_axis_circles(layer, axis, x, y, radii, categories=None, colour=None, alpha=1.0):
+    '''Adds circles given in the data coordinates of a matplotlib axis to a layer the size of its figure's image,
+    coloured by category like exo_circle_functions.plot_circles (or all in one colour, if colour is given)'''
+
+    sx,ox,sy,oy = axis_transform(axis, layer.shape[0])
+
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    radii = np.asarray(radii,dtype=float)
+
+    if colour is None:
+        if categories is None:
+            categories = fun.pick_circle_categories(radii)
+        colour = np.array(fun.category_colours)[categories]
+
+    return draw_circles(layer, sx*x+ox, sy*y+oy, sx*radii, sy*radii, colour, alpha)
+
+def resample_weights(ntarget, nsource, scale, offset):
+    '''Returns the source pixels covered by every target pixel along one axis, and the fraction of the target
+    pixel each covers (target = scale*source+offset): (index, weight) arrays with one row per target pixel'''
+
+    lo = (np.arange(ntarget)-offset)/scale
+    hi = lo+1.0/scale
+
+    ntap = int(np.ceil(1.0/scale))+1
+    index = np.floor(lo).astype(np.int64)[:,None]+np.arange(ntap)
+
+    weight = np.clip(np.minimum(hi[:,None],index+1)-np.maximum(lo[:,None],index),0.0,None)*scale
+    weight[(index < 0) | (index >= nsource)] = 0.0
+
+    return np.clip(index,0,nsource-1),weight.astype(np.float32)
+
+def rescale_layer(layer, source, target):
+    '''Redraws a layer made for the source viewport (see axis_viewport) at the target viewport, by averaging
+    the source pixels each target pixel covers. Returns the new layer'''
+
+    width,height = target[:2]
+
+    xindex,xweight = resample_weights(width, layer.shape[1], target[2]/source[2], target[3]-target[2]/source[2]*source[3])
+    yindex,yweight = resample_weights(height, layer.shape[0], target[4]/source[4], target[5]-target[4]/source[4]*source[5])
+
+    rows = np.zeros((height,layer.shape[1],4), dtype=np.float32)
+    for k in range(yindex.shape[1]):
+        rows += yweight[:,k,None,None]*layer[yindex[:,k]]
+
+    result = blank_layer(width,height)
+    for k in range(xindex.shape[1]):
+        result += xweight[None,:,k,None]*rows[:,xindex[:,k]]
+
+    return result
+
+def composite(layers, background=(1.0,1.0,1.0)):
+    '''Stacks layers (bottom first) over an opaque background colour, returning an (height, width, 3) float image'''
+
+    image = None
+
+    for layer in layers:
+        colour = layer[:,:,:3]
+        alpha = layer[:,:,3:]
+
+        # Summed coverage can exceed one where anti-aliased edges meet
+        over = alpha > 1.0
+        if np.any(over):
+            norm = np.where(over,alpha,1.0)
+            colour = colour/norm
+            alpha = alpha/norm
+
+        if image is None:
+            image = np.empty(layer.shape[:2]+(3,), dtype=np.float32)
+            image[:] = np.asarray(background,dtype=np.float32)
+
+        image *= 1.0-alpha
+        image += colour
+
+    return image
+
+def to_rgb8(image):
+    '''Converts a float image (0 to 1) to 8-bit values'''
+
+    return (np.clip(image,0.0,1.0)*255.0+0.5).astype(np.uint8)
+
+def png_chunk(kind, data):
+    '''Returns one PNG chunk: length, type, data and CRC'''
+
+    return struct.pack('>I',len(data))+kind+data+struct.pack('>I',zlib.crc32(kind+data) & 0xffffffff)
+
+def png_header(width, height, channels=3):
+    '''Returns the PNG signature and header chunk for an image of 8-bit RGB (3 channels) or RGBA (4) pixels'''
+
+    colour_type = {3: 2, 4: 6}[channels]
+
+    return png_signature+png_chunk(b'IHDR',struct.pack('>IIBBBBB', width, height, 8, colour_type, 0, 0, 0))
+
+def png_data(pixels):
+    '''Compresses an (height, width, channels) uint8 array into PNG image data (the contents of IDAT chunks)'''
+
+    pixels = np.ascontiguousarray(pixels,dtype=np.uint8)
+    height,width,channels = pixels.shape
+
+    # Every row starts with its filter type (0: none)
+    rows = np.zeros((height,width*channels+1), dtype=np.uint8)
+    rows[:,1:] = pixels.reshape(height,width*channels)
+
+    return zlib.compress(rows.tobytes(),png_compression)
+
+def encode_png(pixels):
+    '''Encodes an (height, width, 3) or (height, width, 4) uint8 array as PNG data (RGB or RGBA, 8 bits per channel)'''
+
+    height,width,channels = np.shape(pixels)
+
+    return png_header(width,height,channels)+png_chunk(b'IDAT',png_data(pixels))+png_chunk(b'IEND',b'')
+
+def write_png(filename, pixels):
+    '''Writes a uint8 RGB or RGBA array to a PNG file (or to an open binary file)'''
+
+    data = encode_png(pixels)
+
+    if hasattr(filename,'write'):
+        filename.write(data)
+        return
+
+    with open(filename,'wb') as f:
+        f.write(data)
+
+def figure_size(fig):
+    '''Returns the (width, height) in pixels of the image of a matplotlib figure'''
+
+    width,height = fig.get_size_inches()*fig.dpi
+
+    return int(round(width)),int(round(height))
+
+def figure_layer(fig):
+    '''Draws a matplotlib figure with a transparent background (e.g. just its legend and text) and returns it as a layer'''
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    facealpha = fig.patch.get_alpha()
+    fig.patch.set_alpha(0.0)
+
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    rgba = np.asarray(canvas.buffer_rgba(),dtype=np.float32)/255.0
+
+    fig.patch.set_alpha(facealpha)
+
+    # The canvas holds straight (not premultiplied) colour
+    layer = rgba.copy()
+    layer[:,:,:3] *= layer[:,:,3:]
+
+    return layer
+
+def artist_layer(fig, artists):
+    '''Draws matplotlib artists just added to an otherwise empty figure (e.g. a legend) as a layer,
+    then removes them from the figure again'''
+
+    layer = figure_layer(fig)
+
+    for artist in artists:
+        artist.remove()
+
+    return layer
+
+def save_figure(fig, filename, layers):
+    '''Writes the layers, with the figure (drawn without its circles) on top, to a PNG file.
+    This replaces fig.savefig(filename) when the circles have been drawn into layers'''
+
+    write_layers(filename, list(layers)+[figure_layer(fig)])
+
+def write_layers(filename, layers):
+    '''Stacks layers (bottom first) over a white background and writes the image to a PNG file'''
+
+    write_png(filename, to_rgb8(composite(layers)))
+
+
+class LayerCache(object):
+    '''Layers kept between images. Each layer is stored under a name and the viewport it was drawn for, with a key
+    describing its contents (e.g. a layout key): it is drawn again only when the key changes.
+    The least recently used layers are dropped once there are more than maxlayers'''
+
+    def __init__(self, maxlayers=None):
+
+        self.maxlayers = maxlayers
+        if self.maxlayers is None:
+            self.maxlayers = layer_cache_size
+
+        self.layers = OrderedDict()
+
+    def get(self, name, key, viewport, draw, rescale=False):
+        '''Returns the named layer for viewport, calling draw() to make it if no layer with the same key is cached.
+        With rescale, a layer with the same name and key cached for a different viewport is rescaled instead
+        (from the one with the most pixels per data unit: its contents must lie inside both viewports)'''
+
+        entry = self.layers.get((name,viewport))
+        if entry is not None and entry[0]==key:
+            self.layers.move_to_end((name,viewport))
+            return entry[1]
+
+        layer = None
+        if rescale:
+            sources = [(abs(other[2]),other,cached[1]) for (othername,other),cached in self.layers.items()
+                       if othername==name and cached[0]==key]
+            if len(sources) > 0:
+                scale,source,source_layer = max(sources, key=lambda entry: entry[0])
+                layer = rescale_layer(source_layer, source, viewport)
+
+        if layer is None:
+            layer = draw()
+
+        self.layers[(name,viewport)] = (key,layer)
+        self.layers.move_to_end((name,viewport))
+
+        while len(self.layers) > self.maxlayers:
+            self.layers.popitem(last=False)
+
+        return layer
+
+    def clear(self):
+        '''Drops every cached layer'''
+
+        self.layers.clear()
@@ -0,0 +1,132 @@
+import numpy as np
+import exo_circle_functions as fun
+
+# A table of planets, held as one numpy array per column, shared by fetching, placing and plotting
+# Rows are kept in the order they are placed in (confirmed planets before candidates, each in descending radius;
+# the movie orders them by discovery year), so the subsets each stage needs are slices of the table:
+# views of the same memory rather than copies
+
+columns = ('radius','mass','x','y','category','year','confirmed')
+
+column_types = {'radius': np.float64, 'mass': np.float64, 'x': np.float64, 'y': np.float64,
+                'category': np.uint8, 'year': np.int16, 'confirmed': np.bool_}
+
+# Values of columns that are not known
+column_defaults = {'mass': np.nan, 'x': np.nan, 'y': np.nan, 'year': 0, 'confirmed': True}
+
+
+def make_column(name, values, n):
+    '''Returns values as an array of the column's type (without copying if it already is one),
+    or an array of n default values if values is None or a single value'''
+
+    if values is None:
+        values = column_defaults[name]
+
+    if np.ndim(values)==0:
+        return np.full(n, values, dtype=column_types[name])
+
+    return np.asarray(values, dtype=column_types[name])
+
+
+class PlanetTable(object):
+    '''Planets as columns: radius (Earth Radii), mass (Earth masses, NaN if unknown), x and y (position in the
+    plot, NaN until placed), category (see exo_circle_functions.pick_circle_categories, worked out once here),
+    discovery year (0 if unknown) and confirmed (False for candidates).
+    Indexing with a slice gives a table of views into this one; any other index gives a copy'''
+
+    __slots__ = columns
+
+    def __init__(self, radius, mass=None, x=None, y=None, category=None, year=None, confirmed=None):
+
+        self.radius = make_column('radius', radius, 0)
+        n = len(self.radius)
+
+        if category is None:
+            category = fun.pick_circle_categories(self.radius)
+
+        self.mass = make_column('mass', mass, n)
+        self.x = make_column('x', x, n)
+        self.y = make_column('y', y, n)
+        self.category = make_column('category', category, n)
+        self.year = make_column('year', year, n)
+        self.confirmed = make_column('confirmed', confirmed, n)
+
+    def __len__(self):
+
+        return len(self.radius)
+
+    def __getitem__(self, index):
+
+        return PlanetTable(*[getattr(self,name)[index] for name in columns])
+
+    def copy(self):
+        '''Returns a table with its own copy of every column'''
+
+        return PlanetTable(*[getattr(self,name).copy() for name in columns])
+
+    def sorted_by_radius(self):
+        '''Returns the rows in descending order of radius (the order circles are placed in)'''
+
+        return self[np.argsort(-self.radius, kind='stable')]
+
+    def sorted_by_year(self, first_year=None):
+        '''Returns the rows in order of discovery year, and in descending radius within each year,
+        so that discovered_before gives each year's planets in the order they are placed in.
+        Planets discovered up to first_year (if given) are treated as one year'''
+
+        year = self.year
+        if first_year is not None:
+            year = np.maximum(year, first_year)
+
+        return self[np.lexsort((-self.radius, year))]
+
+    def confirmed_planets(self):
+        '''Returns a view of the confirmed planets (for a table with these before the candidates)'''
+
+        return self[:np.count_nonzero(self.confirmed)]
+
+    def candidates(self):
+        '''Returns a view of the candidates (for a table with these after the confirmed planets)'''
+
+        return self[np.count_nonzero(self.confirmed):]
+
+    def category_rows(self, category):
+        '''Returns a view of the planets of one category (for a table in descending order of radius)'''
+
+        start = np.count_nonzero(self.category > category)
+
+        return self[start:start+np.count_nonzero(self.category==category)]
+
+    def discovered_before(self, year):
+        '''Returns a view of the planets discovered before the end of year (for a table from sorted_by_year)'''
+
+        return self[:np.count_nonzero(self.year <= year)]
+
+
+def concatenate(tables):
+    '''Joins several tables into one (a copy), in the order given'''
+
+    return PlanetTable(*[np.concatenate([getattr(table,name) for table in tables]) for name in columns])
+
+def from_discoveries(radii, masses, years, guess_radius_from_mass=True):
+    '''Makes a table of confirmed planets from the output of exoplanet_data.pull_exoplanet_discoveries.
+    Planets without a radius get one estimated from their mass if guess_radius_from_mass is set,
+    and are left out otherwise (as are planets with neither)'''
+
+    radii = np.asarray(radii, dtype=float)
+    masses = np.asarray(masses, dtype=float)
+    years = np.asarray(years, dtype=float)
+
+    hasradius = np.isfinite(radii)
+    radii = radii.copy()
+
+    if guess_radius_from_mass:
+        guessed = ~hasradius & np.isfinite(masses)
+        radii[guessed] = fun.guess_radii_from_masses_PHL(masses[guessed])
+        keep = hasradius | guessed
+    else:
+        keep = hasradius
+
+    years = np.where(np.isfinite(years), years, column_defaults['year'])
+
+    return PlanetTable(radii[keep], mass=masses[keep], year=years[keep], confirmed=True)
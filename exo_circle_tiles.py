@@ -0,0 +1,233 @@
+import numpy as np
+import os
+import json
+import shutil
+from multiprocessing import Pool
+import exo_circle_functions as fun
+import exo_circle_placement as place
+import exo_circle_raster as raster
+
+# Splits the picture of a layout into a pyramid of square tiles, for zoomable ("deep zoom" or "slippy map") viewers
+# of very large layouts: zoom level z covers the whole graphic with 2^z x 2^z tiles of tile_size pixels, stored as
+# directory/z/x/y.png (x counts columns from the left, y rows from the top; level 0 is a single tile)
+#
+# Every tile only draws the circles that reach into it, which are looked up in a NeighbourGrid holding every circle
+# of the layout. Tiles are made when they are first asked for (TilePyramid.tile) and then kept on disk;
+# the first few levels can be made in advance by several processes at once (TilePyramid.generate)
+
+tile_size = 256 # Width and height of every tile in pixels
+tile_min_pixels = 2.0 # The deepest zoom level shows the smallest planet at least this many pixels in radius
+tile_max_zoom = 14 # Deepest zoom level allowed
+tile_index_cells = 256 # The circles are indexed in a grid of at most this many cells along each side
+tile_chunksize = 16 # Tiles handed to a process at a time by TilePyramid.generate
+
+backdrop_colour = (112.0/255.0,128.0/255.0,144.0/255.0) # slategrey, as in combined.png
+backdrop_alpha = 0.5
+
+metadata_file = 'tiles.json' # Describes the pyramid (and the layout its tiles show) in its directory
+
+
+class TilePyramid(object):
+    '''The tiles of a layout: the planets of a PlanetTable (with positions) inside the square [-extent,extent]
+    on both axes, over a transparent backdrop circle of radius backdrop_rad (None: no backdrop), on white.
+    Tiles are kept under directory (None: every tile is drawn whenever it is asked for); tiles already there
+    are reused if they were made for the same key (e.g. the layout key), and removed if not'''
+
+    def __init__(self, planets, extent, backdrop_rad=None, directory=None, key=None, max_zoom=None):
+
+        self.planets = planets
+        self.extent = float(extent)
+        self.backdrop_rad = backdrop_rad
+        self.directory = directory
+        self.key = key
+
+        self.max_zoom = max_zoom
+        if self.max_zoom is None:
+            self.max_zoom = self.deepest_zoom()
+
+        # Colours are looked up once; circles that could not be placed are left out of the index
+        self.colours = np.array(fun.category_colours, dtype=np.float32)[planets.category]
+        self.rows = np.flatnonzero(np.isfinite(planets.x) & np.isfinite(planets.y))
+
+        cellsize = max(place.neighbour_cellsize(planets.radius,1.0), 2.0*self.extent/tile_index_cells)
+        self.grid = place.NeighbourGrid(self.extent, cellsize, 1.0)
+        self.grid.insert_many(planets.x[self.rows], planets.y[self.rows], planets.radius[self.rows])
+
+        if self.directory is not None:
+            self.open_directory()
+
+    def deepest_zoom(self):
+        '''Returns the first zoom level at which the smallest planet is tile_min_pixels in radius (at most tile_max_zoom)'''
+
+        radii = self.planets.radius[self.planets.radius > 0.0]
+        if len(radii)==0:
+            return 0
+
+        scale = tile_min_pixels*2.0*self.extent/(tile_size*radii.min())
+
+        return int(min(max(np.ceil(np.log2(scale)),0),tile_max_zoom))
+
+    def metadata(self):
+        '''Returns the description of the pyramid written to its directory'''
+
+        return {'key': self.key, 'tile_size': tile_size, 'max_zoom': self.max_zoom, 'extent': self.extent,
+                'backdrop_rad': self.backdrop_rad, 'nplanet': len(self.planets)}
+
+    def open_directory(self):
+        '''Creates the directory (if needed). If it holds the pyramid of a different layout (as its metadata file
+        says), that pyramid's zoom levels are removed. Raises ValueError if the directory holds anything else'''
+
+        filename = os.path.join(self.directory,metadata_file)
+        metadata = self.metadata()
+
+        if os.path.isdir(self.directory) and not os.path.exists(filename):
+            if len(os.listdir(self.directory)) > 0:
+                raise ValueError('Not writing tiles into '+self.directory+': it is not empty, and holds no '+
+                                 metadata_file+' (choose a new or empty directory)')
+        elif os.path.exists(filename):
+            try:
+                with open(filename) as f:
+                    previous = json.load(f)
+                levels = range(int(previous['max_zoom'])+1)
+            except (IOError,OSError,ValueError,TypeError,KeyError):
+                raise ValueError('Not writing tiles into '+self.directory+': its '+metadata_file+
+                                 ' cannot be read')
+
+            if previous==metadata:
+                return
+
+            # Only the zoom levels the earlier pyramid made are removed
+            for z in levels:
+                shutil.rmtree(os.path.join(self.directory,str(z)), ignore_errors=True)
+
+        fun.write_atomically(filename, lambda f: f.write(json.dumps(metadata, indent=1).encode('utf-8')))
+
+    def ntiles(self, z):
+        '''Returns the number of tiles along each side of zoom level z'''
+
+        return 1 << z
+
+    def check_tile(self, z, x, y):
+        '''Raises ValueError unless (z, x, y) is a tile of the pyramid'''
+
+        if not (0 <= z <= self.max_zoom and 0 <= x < self.ntiles(z) and 0 <= y < self.ntiles(z)):
+            raise ValueError('There is no tile '+str(z)+'/'+str(x)+'/'+str(y)+' (zoom levels 0 to '+
+                             str(self.max_zoom)+')')
+
+    def tile_viewport(self, z, x, y):
+        '''Returns (scale, xmin, ymax): pixels per data unit and the top left corner of a tile in data coordinates'''
+
+        width = 2.0*self.extent/self.ntiles(z)
+
+        return tile_size/width, -self.extent+x*width, self.extent-y*width
+
+    def render_tile(self, z, x, y):
+        '''Draws one tile: returns a (tile_size, tile_size, 3) uint8 image'''
+
+        self.check_tile(z,x,y)
+
+        scale,xmin,ymax = self.tile_viewport(z,x,y)
+        ox = -scale*xmin
+        oy = scale*ymax
+
+        layers = []
+
+        if self.backdrop_rad is not None:
+            layer = raster.blank_layer(tile_size,tile_size)
+            rad = scale*self.backdrop_rad
+            layers.append(raster.draw_circles(layer, ox, oy, rad, rad, backdrop_colour, backdrop_alpha))
+
+        # Only circles reaching into the tile (or into the pixel around it, for anti-aliasing) are drawn
+        margin = 1.0/scale
+        width = tile_size/scale
+        index = self.rows[self.grid.query_box(xmin-margin, ymax-width-margin, xmin+width+margin, ymax+margin)]
+
+        planets = self.planets
+        layer = raster.blank_layer(tile_size,tile_size)
+        layers.append(raster.draw_circles(layer, scale*planets.x[index]+ox, oy-scale*planets.y[index],
+                                          scale*planets.radius[index], scale*planets.radius[index], self.colours[index]))
+
+        return raster.to_rgb8(raster.composite(layers))
+
+    def tile_filename(self, z, x, y):
+        '''Location of a tile in the directory'''
+
+        return os.path.join(self.directory,str(z),str(x),str(y)+'.png')
+
+    def tile(self, z, x, y):
+        '''Returns one tile as PNG data, read from the directory if it was made before, or drawn (and saved) now'''
+
+        if self.directory is None:
+            return raster.encode_png(self.render_tile(z,x,y))
+
+        self.check_tile(z,x,y)
+        filename = self.tile_filename(z,x,y)
+
+        try:
+            with open(filename,'rb') as f:
+                return f.read()
+        except (IOError,OSError):
+            pass
+
+        data = raster.encode_png(self.render_tile(z,x,y))
+
+        # A tile that cannot be kept (e.g. its directory was just removed) is still returned
+        try:
+            fun.write_atomically(filename, lambda f: f.write(data))
+        except (IOError,OSError):
+            pass
+
+        return data
+
+    def make_tile(self, tile):
+        '''Makes tile (z, x, y) unless it is in the directory already: returns 1 if it was made, 0 if not'''
+
+        z,x,y = tile
+        filename = self.tile_filename(z,x,y)
+        if os.path.exists(filename):
+            return 0
+
+        data = raster.encode_png(self.render_tile(z,x,y))
+        fun.write_atomically(filename, lambda f: f.write(data))
+
+        return 1
+
+    def generate(self, max_zoom=None, jobs=1):
+        '''Makes every tile of zoom levels 0 to max_zoom (default: all levels) that is not in the directory yet,
+        with jobs processes. Deeper levels are left to be made when they are asked for.
+        Returns the number of tiles made'''
+
+        if self.directory is None:
+            raise ValueError('Tiles can only be generated in advance into a directory')
+
+        if max_zoom is None or max_zoom > self.max_zoom:
+            max_zoom = self.max_zoom
+
+        tiles = [(z,x,y) for z in range(max_zoom+1) for x in range(self.ntiles(z)) for y in range(self.ntiles(z))]
+
+        if jobs > 1:
+            # Every process is given the pyramid (and its index) once
+            pool = Pool(jobs, initializer=start_worker, initargs=(self,))
+            try:
+                made = sum(pool.imap_unordered(make_worker_tile, tiles, chunksize=tile_chunksize))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            made = sum(self.make_tile(tile) for tile in tiles)
+
+        return made
+
+
+worker_pyramid = None
+
+def start_worker(pyramid):
+    '''Keeps the pyramid a generating process works on'''
+
+    global worker_pyramid
+    worker_pyramid = pyramid
+
+def make_worker_tile(tile):
+    '''Makes one tile in a generating process (see TilePyramid.generate)'''
+
+    return worker_pyramid.make_tile(tile)
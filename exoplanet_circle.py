@@ -1,12 +1,26 @@
 # Code to produce an xkcd style plot using the latest exoplanet data
 # Code pulls data via SQL-type query to the IPAC Exoplanet Archive
-# Confirmed exoplanets are plotted in a circle, and candidates are plotted in an enclosing annulus 
+# Confirmed exoplanets are plotted in a circle, and candidates are plotted in an enclosing annulus
+#
+# The pipeline is available as functions (fetch_planets -> place_planets -> render_confirmed/render_combined, or run
+# for all of them); importing this module does nothing else. matplotlib and the archive code are only imported
+# when they are needed.
+#
+# Usage: python exoplanet_circle.py [--batch] [--quiet] [--engine frontchain] [--jobs 4] [--backend raster] [--seed 1234]
+#                                   [--tiles tiles] [--tile-zoom 4] [--tile-jobs 4]
+# --batch runs headless (Agg backend), without pauses or progress messages
+# --tiles also writes zoomable tiles of the combined image (see exo_circle_tiles)
 
 import numpy as np
-import exoplanet_data as exo
 import exo_circle_functions as fun
-import matplotlib.pyplot as plt
+import exo_circle_placement as place
+import exo_circle_table as table
+import exo_circle_raster as raster
+import exo_circle_tiles as tiles
+import exo_circle_instrument as instrument
+import argparse
 from time import sleep
+from timeit import default_timer as time
 
 pi = 3.141592654
 rearth = 6.371e7/7.1492e8 # Earth Radius in Jupiter Radii
@@ -18,231 +32,394 @@ graphic_border = 1.4 # How big is the graphic relative to the area of the annulu
 
 guess_radius_from_mass = True # Set this to true to estimate planet radius from mass
 
-# 1. Pull exoplanet data using NASA API
+placement_engine = 'random' # 'random' (accept/reject, a new layout every day) or 'frontchain' (deterministic packing)
+max_trials = 10000000 # Trial positions allowed per planet before the random engine gives up
+placement_sampler = 'polar' # Random engine trials: 'polar' (anywhere) or 'raster' (only where there is room left)
+candidate_jobs = 1 # Processes placing the candidate annulus (split into this many sectors) with the random engine
+render_backend = 'matplotlib' # Circles drawn by 'matplotlib' or by 'raster' (exo_circle_raster: faster for many planets)
+layer_cache = raster.LayerCache() # Raster layers (planets, backdrop, legend, captions) reused between images
+rescale_layers = False # True: combined.png rescales the planets drawn for confirmed.png (faster, slightly softer)
+tile_dir = None # Directory for zoomable tiles of combined.png, as z/x/y.png (None: no tiles)
+tile_zoom = 4 # Zoom levels made in advance (deeper levels are made when first asked for: see exo_circle_tiles)
+tile_jobs = 1 # Processes making the tiles
 
-weblink = 'http://exoplanetarchive.ipac.caltech.edu/cgi-bin/nstedAPI/nph-nstedAPI?'
-    
-# First confirmed exoplanets
+report_file = None # Stage timings and placement statistics are written to this JSON file (None = off; see --report)
 
-print 'Retrieving confirmed planets'
+# Called as a library, the pipeline is silent and does not pause: main() switches both on for interactive runs
+verbose = False # Print progress messages
+pause = False # Pause between stages, so the messages can be read
 
-radii = exo.pull_exoplanet_radii()
 
-# Now candidate exoplanets (Kepler)
+def say(*message):
+    '''Prints a progress message (if verbose is set)'''
 
-print 'Retrieving Kepler Candidates'
+    if verbose:
+        print(*message)
 
-radii_c = exo.pull_candidate_exoplanet_radii()
+def fetch_planets(stats=None):
+    '''Pulls the confirmed exoplanets (radius, mass and discovery year; if guess_radius_from_mass is set, planets
+    with only a mass get a radius estimated from it) and the radii of Kepler candidates from the Exoplanet Archive.
+    Returns a PlanetTable (see exo_circle_table): the confirmed planets, then the candidates, each in descending radius'''
 
-# If requested, pull planets with masses and calculate radii
+    import exoplanet_data as exo
 
-if guess_radius_from_mass:
-    print 'Retrieving other planets with masses'
-    
-    masses = exo.pull_exoplanet_masses(extraconditions='+AND+pl_rade+is+null')
-    
-    guessradii = fun.guess_radii_from_masses_PHL(masses)
-    
-    # Add to confirmed exoplanet list
-    
-    radii = np.concatenate((radii,guessradii),axis=0)
+    # 1. Pull exoplanet data using NASA API
+    # Confirmed exoplanets (radii, masses and discovery years in one query) and candidate exoplanets (Kepler)
+    # are retrieved at once
 
-nplanet = len(radii)
-ncandidate = len(radii_c)
+    queries = [(exo.pull_exoplanet_discoveries,{}), (exo.pull_candidate_exoplanet_radii,{})]
 
-if guess_radius_from_mass:
-    print 'There are ',nplanet, ' planets with confirmed and calculated radii'
-else:
-    print 'There are ',nplanet, ' planets with confirmed radii'
-    
-print 'There are ',ncandidate, ' candidates'
+    say('Retrieving confirmed planets and Kepler Candidates')
 
+    # Record the time taken by each archive query
+    exo.stats = stats
+    try:
+        t0 = time()
+        results,errors = exo.pull_concurrently(queries)
+        if stats is not None: stats.add_stage('retrieve', time()-t0)
+    finally:
+        exo.stats = None
 
+    for error in errors:
+        if error is not None:
+            say('Retrieval failed: ',error)
 
-# Sort data into descending order
+    for error in errors:
+        if error is not None: raise error
 
-radii = np.sort(radii)
-radarg = np.argsort(radii, axis=0)[::-1]
-radii = radii[radarg]
+    # If requested, calculate radii for planets with masses (see exo_circle_table.from_discoveries)
 
-radii_c = np.sort(radii_c)
-radarg = np.argsort(radii_c, axis=0)[::-1]
-radii_c = radii_c[radarg]
+    radii_all,masses_all,years_all = results[0]
+    confirmed = table.from_discoveries(radii_all, masses_all, years_all, guess_radius_from_mass)
+    candidates = table.PlanetTable(results[1], confirmed=False)
 
-# Set up arrays to store x and y positions
+    if guess_radius_from_mass:
+        say('There are ',len(confirmed), ' planets with confirmed and calculated radii')
+    else:
+        say('There are ',len(confirmed), ' planets with confirmed radii')
 
-xp = np.zeros(nplanet)
-yp = np.zeros(nplanet)
+    say('There are ',len(candidates), ' candidates')
 
-xc = np.zeros(ncandidate)
-yc = np.zeros(ncandidate)
+    # Sort data into descending order
 
-# 4. Generate random number seed from today's date
+    return table.concatenate((confirmed.sorted_by_radius(), candidates.sorted_by_radius()))
 
-seed = fun.gen_random_seed_date()
-print "Today's seed is ",seed
+def layout_radii(radii, radii_c):
+    '''Calculates the radius of the circle for confirmed planets and the outer radius of the annulus for candidates'''
 
-# 5. Calculate maximum area of circle for confirmed planets
+    # 5. Calculate maximum area of circle for confirmed planets
 
-circlearea = 0.0
-
-for i in range(nplanet):
-    circlearea = circlearea + pi*radii[i]*radii[i]
-
-circlearea = circlearea*area_spacing_factor
-circle_rad2 = circlearea/pi
-circle_rad = np.sqrt(circle_rad2) 
+    circlearea = np.sum(pi*radii*radii)
 
+    circlearea = circlearea*area_spacing_factor
+    circle_rad2 = circlearea/pi
+    circle_rad = np.sqrt(circle_rad2)
 
-print 'Total area of exoplanet circles is ',circlearea
-print 'This gives a circle of radius ',circle_rad
-
-# 5a. Now calculate maximum area of annulus for candidates
-
-annulusarea= 0.0
-
-for i in range(ncandidate):
-    annulusarea = annulusarea + pi*radii_c[i]*radii_c[i]
-
-annulusarea = annulusarea*area_spacing_factor
-
-annulus_rad2 = annulusarea/pi +circle_rad2
-annulus_rad = np.sqrt(annulus_rad2)
-
-print 'Total area of candidate circles is ',annulusarea
-print 'This gives an annulus of outer radius ',annulus_rad,2.0*radii_c[0]
-
-# Check: Is annulus too thin for largest candidate?
-
-if 2.0*radii_c[0]>(annulus_rad-circle_rad):
-    print 'The maximum diameter of an exoplanet candidate is ',radii_c[0]
-    annulus_rad = 1.1*2.0*radii_c[0] + circle_rad
-    print 'The annulus has been enlarged to fit this exoplanet: new outer radius ',annulus_rad
-
-sleep(3)
-
-# 6. Now begin accept reject to build planet circle
-sep = 0.0
-i = 0
-overlapflag = 0
-
-while i < nplanet:    
-    # Randomly select x and y inside the circle
-    
-    rad = np.random.mtrand.uniform(low=0.0,high = circle_rad-radii[i])
-    phi = np.random.mtrand.uniform(low=0.0,high=2.0*pi)
-    
-    xp[i] = rad*np.cos(phi)
-    yp[i] = rad*np.sin(phi)    
-     
-    overlapflag = 0
-    
-    # Check - does planet's extent exceed circle radius?    
-    overlapflag = fun.test_rad(xp[i], yp[i], radii[i], 0.0, circle_rad)
-    if overlapflag==1: continue      
-    
-    # Now check to see if there is overlap among neighbours
-    overlapflag = fun.test_neighbours(i, xp, yp, radii, placing_spacing)    
-        
-    # Check to see if overlap flagged - if not, increase i by 1
-    if overlapflag==0:
-        i +=1
-        print 'Planet ', i, 'placed'
-                
-# End while loop
-
-print 'Planets placed: now candidates'
-sleep(2)
-# Second while loop to place candidates
-
-i=0
-overlapflag = 0
-sep =0.0
-
-while i<ncandidate:
-    # Randomly select x and y inside the annulus
-        
-    rc = np.random.mtrand.uniform(low=circle_rad+radii_c[i],high=annulus_rad-radii_c[i])
-    phic = np.random.mtrand.uniform(low=0.0,high = 2.0*pi)
-        
-    xc[i] = rc*np.cos(phic)    
-    yc[i] = rc*np.sin(phic)
-        
-    overlapflag = 0
-        
-    # Check - does planet's extent exceed circle radius?    
-    overlapflag = fun.test_rad(xc[i], yc[i], radii_c[i], circle_rad, annulus_rad)    
-    if overlapflag==1: continue      
-    
-    # Now check to see if there is overlap among neighbours
-    overlapflag = fun.test_neighbours(i, xc, yc, radii_c, placing_spacing)    
-        
-    # Check to see if overlap flagged - if not, increase i by 1
-    if overlapflag==0:        
-        print 'Candidate ', i, 'placed '
-        i +=1
-    
-
-# End of placing stage
-    
-# Now plot data: just exoplanets first
-fig = plt.figure()
-ax = fig.add_subplot(111)
-ax.set_xlim(-graphic_border*circle_rad,graphic_border*circle_rad)
-ax.set_ylim(-graphic_border*circle_rad,graphic_border*circle_rad)
-ax.set_axis_off()
-print 'Plotting'
-
-
-for i in range(nplanet):    
-    
-    colors = fun.pick_circle_colour(radii[i])
-        
-    circle1=plt.Circle((xp[i],yp[i]),radius=radii[i],edgecolor='none',facecolor=colors)    
-    ax.add_patch(circle1)
-
-if guess_radius_from_mass:
-    textstring = str(nplanet)+' exoplanets with confirmed and calculated physical radii as of '
-else:   
-    textstring = str(nplanet)+' exoplanets with confirmed physical radii as of '
-    
-fun.make_circle_legend_date(ax,textstring,0.0,0.0)
-plt.savefig('confirmed.png', format='png')
-
-# Now plot candidates and planets together
-
-fig = plt.figure()
-ax = fig.add_subplot(111)
-ax.set_xlim(-graphic_border*annulus_rad,graphic_border*annulus_rad)
-ax.set_ylim(-graphic_border*annulus_rad,graphic_border*annulus_rad)
-ax.set_axis_off()
-
-# First, add a transparent circle outlining the confirmed exoplanets
-
-circle1 = plt.Circle((0.0,0.0),radius=circle_rad,edgecolor='none',facecolor='slategrey',alpha=0.5)
-ax.add_patch(circle1)
-
-# Now add planets
-for i in range(nplanet):    
-    
-    colors = fun.pick_circle_colour(radii[i])    
-    circle1=plt.Circle((xp[i],yp[i]),radius=radii[i],edgecolor='none',facecolor=colors)    
-    ax.add_patch(circle1)
-
-# Then add candidates
-for i in range(ncandidate):    
-        
-    colors = fun.pick_circle_colour(radii_c[i])    
-    circle1=plt.Circle((xc[i],yc[i]),radius=radii_c[i],edgecolor='none',facecolor=colors)    
-    ax.add_patch(circle1)
-
-if guess_radius_from_mass:
-    textstring = str(nplanet)+' exoplanets with confirmed and calculated physical radii \n'+str(ncandidate)+' candidate exoplanets as of '
-else:    
-    textstring = str(nplanet)+' exoplanets with confirmed physical radii \n'+str(ncandidate)+' candidate exoplanets as of '
-    
-fun.make_circle_legend_date(ax,textstring,0.0,0.0)
-
-plt.savefig('combined.png', format='png')
-
-print 'Done'
+    say('Total area of exoplanet circles is ',circlearea)
+    say('This gives a circle of radius ',circle_rad)
+
+    # 5a. Now calculate maximum area of annulus for candidates
+
+    annulusarea = np.sum(pi*radii_c*radii_c)
+
+    annulusarea = annulusarea*area_spacing_factor
+
+    annulus_rad2 = annulusarea/pi +circle_rad2
+    annulus_rad = np.sqrt(annulus_rad2)
+
+    say('Total area of candidate circles is ',annulusarea)
+    say('This gives an annulus of outer radius ',annulus_rad)
+
+    # Check: Is annulus too thin for largest candidate?
+
+    if len(radii_c) > 0 and 2.0*radii_c[0]>(annulus_rad-circle_rad):
+        say('The maximum diameter of an exoplanet candidate is ',radii_c[0])
+        annulus_rad = 1.1*2.0*radii_c[0] + circle_rad
+        say('The annulus has been enlarged to fit this exoplanet: new outer radius ',annulus_rad)
+
+    return circle_rad,annulus_rad
+
+def place_planets(planets, seed=None, stats=None):
+    '''Places the confirmed planets of a PlanetTable (from fetch_planets) in the circle and the candidates in the
+    annulus around it, filling in its x and y columns. seed defaults to today's seed.
+    Returns the layout as a dictionary: planets, circle_rad, annulus_rad and key (identifying the layout)'''
+
+    # 4. Generate random number seed from today's date
+
+    if seed is None:
+        seed = fun.gen_random_seed_date()
+    say("Today's seed is ",seed)
+
+    # The confirmed planets and the candidates are views of the table: positions are written straight into it
+
+    confirmed = planets.confirmed_planets()
+    candidates = planets.candidates()
+    radii = confirmed.radius
+    radii_c = candidates.radius
+
+    circle_rad,annulus_rad = layout_radii(radii, radii_c)
+
+    if pause: sleep(3)
+
+    nplanet = len(radii)
+    ncandidate = len(radii_c)
+
+    # Planets and candidates are placed with separate random number streams derived from the seed
+    # (make_rng(seed,0) and make_rng(seed,1); sectors of the annulus use make_rng(seed,1,sector))
+
+    planet_rng,candidate_rng = place.spawn_rngs(seed,2)
+
+    planet_progress = None
+    candidate_progress = None
+    if verbose:
+        planet_progress = instrument.ProgressReporter('Planets placed',nplanet)
+        candidate_progress = instrument.ProgressReporter('Candidates placed',ncandidate)
+
+    # 6. Now begin accept reject to build planet circle
+    # Trial positions are drawn and tested in blocks (see exo_circle_placement.place_circles)
+    # (or with placement_engine = 'frontchain', planets are packed deterministically from the centre outwards)
+    # A layout already made for the same radii, seed and settings is read from the layout cache instead
+
+    engine = place.engine_settings(placement_engine, placement_sampler, candidate_jobs)
+    layout_key = place.layout_key([radii,radii_c], seed, area_spacing_factor, placing_spacing, engine)
+    layout = place.load_layout(layout_key)
+
+    if layout is not None:
+        say('Using cached layout ',layout_key)
+        confirmed.x[:],confirmed.y[:] = layout['xp'],layout['yp']
+        candidates.x[:],candidates.y[:] = layout['xc'],layout['yc']
+
+    else:
+        t0 = time()
+        xp,yp = place.place_layer(placement_engine, radii, 0.0, circle_rad, placing_spacing, rng=planet_rng,
+                                  max_trials=max_trials, sampler=placement_sampler, stats=stats, layer='planets',
+                                  progress=planet_progress)
+        if stats is not None: stats.add_stage('place planets', time()-t0, n=nplanet)
+
+        say('Planets placed: now candidates')
+        if pause: sleep(2)
+
+        # Second accept reject stage to place candidates in the annulus
+        # (with candidate_jobs > 1, sectors of the annulus are placed by several processes at once)
+
+        t0 = time()
+        if placement_engine=='random' and candidate_jobs > 1:
+            xc,yc = place.place_annulus_sectors(radii_c, circle_rad, annulus_rad, placing_spacing, seed, candidate_jobs,
+                                                jobs=candidate_jobs, max_trials=max_trials, stream=(1,), stats=stats,
+                                                layer='candidates', progress=candidate_progress)
+        else:
+            xc,yc = place.place_layer(placement_engine, radii_c, circle_rad, annulus_rad, placing_spacing,
+                                      rng=candidate_rng, max_trials=max_trials, sampler=placement_sampler, stats=stats,
+                                      layer='candidates', progress=candidate_progress)
+        if stats is not None: stats.add_stage('place candidates', time()-t0, n=ncandidate, jobs=candidate_jobs)
+
+        confirmed.x[:],confirmed.y[:] = xp,yp
+        candidates.x[:],candidates.y[:] = xc,yc
+
+        place.save_layout(layout_key, radii=radii, xp=confirmed.x, yp=confirmed.y,
+                          radii_c=radii_c, xc=candidates.x, yc=candidates.y)
+
+    # End of placing stage
+
+    return {'planets': planets, 'circle_rad': circle_rad, 'annulus_rad': annulus_rad, 'key': layout_key}
+
+def planet_layer(viewport, ax, planets):
+    '''Draws planets (a PlanetTable) into a new raster layer for the viewport of ax (see exo_circle_raster)'''
+
+    layer = raster.blank_layer(*viewport[:2])
+
+    return raster.draw_axis_circles(layer,ax,planets.x,planets.y,planets.radius,planets.category)
+
+def text_layers(fig, ax, viewport, textstring):
+    '''Returns raster layers holding the legend and the caption, drawn by matplotlib (or from layer_cache)'''
+
+    legend = layer_cache.get('legend', None, viewport, lambda: raster.artist_layer(fig,[fun.make_category_legend(ax)]))
+    caption = layer_cache.get('caption', textstring, viewport,
+                              lambda: raster.artist_layer(fig,[fun.make_caption(ax,textstring,0.0,0.0)]))
+
+    return [legend,caption]
+
+def render_confirmed(layout, filename='confirmed.png'):
+    '''Plots the confirmed planets of a layout (from place_planets) and writes the image to filename'''
+
+    import matplotlib.pyplot as plt
+
+    confirmed = layout['planets'].confirmed_planets()
+    circle_rad = layout['circle_rad']
+    nplanet = len(confirmed)
+
+    # Now plot data: just exoplanets first
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.set_xlim(-graphic_border*circle_rad,graphic_border*circle_rad)
+    ax.set_ylim(-graphic_border*circle_rad,graphic_border*circle_rad)
+    ax.set_axis_off()
+
+    if guess_radius_from_mass:
+        textstring = str(nplanet)+' exoplanets with confirmed and calculated physical radii as of '
+    else:
+        textstring = str(nplanet)+' exoplanets with confirmed physical radii as of '
+
+    if render_backend=='raster':
+        # The image is composited from layers, each drawn once for a layout and kept in layer_cache
+        viewport = raster.axis_viewport(fig,ax)
+
+        layers = [layer_cache.get('confirmed', layout['key'], viewport, lambda: planet_layer(viewport,ax,confirmed))]
+        layers += text_layers(fig, ax, viewport, textstring+fun.date_string())
+
+        raster.write_layers(filename, layers)
+    else:
+        fun.plot_circles(ax,confirmed.x,confirmed.y,confirmed.radius,confirmed.category)
+
+        fun.make_circle_legend_date(ax,textstring,0.0,0.0)
+        fig.savefig(filename, format='png')
+
+    plt.close(fig)
+
+def render_combined(layout, filename='combined.png'):
+    '''Plots the confirmed planets and the candidates of a layout together and writes the image to filename'''
+
+    import matplotlib.pyplot as plt
+
+    confirmed = layout['planets'].confirmed_planets()
+    candidates = layout['planets'].candidates()
+    annulus_rad = layout['annulus_rad']
+    nplanet = len(confirmed)
+    ncandidate = len(candidates)
+
+    # Now plot candidates and planets together
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.set_xlim(-graphic_border*annulus_rad,graphic_border*annulus_rad)
+    ax.set_ylim(-graphic_border*annulus_rad,graphic_border*annulus_rad)
+    ax.set_axis_off()
+
+    if guess_radius_from_mass:
+        textstring = str(nplanet)+' exoplanets with confirmed and calculated physical radii \n'+str(ncandidate)+' candidate exoplanets as of '
+    else:
+        textstring = str(nplanet)+' exoplanets with confirmed physical radii \n'+str(ncandidate)+' candidate exoplanets as of '
+
+    if render_backend=='raster':
+        from matplotlib.colors import to_rgb
+
+        viewport = raster.axis_viewport(fig,ax)
+
+        def backdrop():
+            layer = raster.blank_layer(*viewport[:2])
+            return raster.draw_axis_circles(layer,ax,0.0,0.0,layout['circle_rad'],colour=to_rgb('slategrey'),alpha=0.5)
+
+        # The transparent circle outlining the confirmed exoplanets, the planets (with rescale_layers set, rescaled
+        # from confirmed.png if that was drawn first) and the candidates are separate layers
+        layers = [layer_cache.get('backdrop', layout['circle_rad'], viewport, backdrop),
+                  layer_cache.get('confirmed', layout['key'], viewport, lambda: planet_layer(viewport,ax,confirmed),
+                                  rescale=rescale_layers),
+                  layer_cache.get('candidates', layout['key'], viewport, lambda: planet_layer(viewport,ax,candidates))]
+        layers += text_layers(fig, ax, viewport, textstring+fun.date_string())
+
+        raster.write_layers(filename, layers)
+    else:
+        # First, add a transparent circle outlining the confirmed exoplanets
+
+        circle1 = plt.Circle((0.0,0.0),radius=layout['circle_rad'],edgecolor='none',facecolor='slategrey',alpha=0.5)
+        ax.add_patch(circle1)
+
+        # Now add planets
+        fun.plot_circles(ax,confirmed.x,confirmed.y,confirmed.radius,confirmed.category)
+
+        # Then add candidates
+        fun.plot_circles(ax,candidates.x,candidates.y,candidates.radius,candidates.category)
+
+        fun.make_circle_legend_date(ax,textstring,0.0,0.0)
+
+        fig.savefig(filename, format='png')
+
+    plt.close(fig)
+
+def tile_pyramid(layout, directory=None):
+    '''Returns the zoomable tiles of the combined image of a layout, kept in directory (see exo_circle_tiles)'''
+
+    return tiles.TilePyramid(layout['planets'], graphic_border*layout['annulus_rad'], backdrop_rad=layout['circle_rad'],
+                             directory=directory, key=layout['key'])
+
+def run(seed=None, stats=None, confirmed_file='confirmed.png', combined_file='combined.png', tile_directory=None):
+    '''Runs the whole pipeline: fetches the data, places the planets and writes both images
+    (and the first tile_zoom levels of tiles into tile_directory, if given). Returns the layout (see place_planets)'''
+
+    planets = fetch_planets(stats=stats)
+
+    layout = place_planets(planets, seed=seed, stats=stats)
+
+    say('Plotting')
+
+    t0 = time()
+    render_confirmed(layout, confirmed_file)
+    if stats is not None: stats.add_stage('plot '+confirmed_file, time()-t0)
+
+    t0 = time()
+    render_combined(layout, combined_file)
+    if stats is not None: stats.add_stage('plot '+combined_file, time()-t0)
+
+    if tile_directory is not None:
+        t0 = time()
+        pyramid = tile_pyramid(layout, tile_directory)
+        made = pyramid.generate(tile_zoom, jobs=tile_jobs)
+        if stats is not None: stats.add_stage('tiles', time()-t0, n=made, jobs=tile_jobs)
+
+        say(made,' tiles written to ',tile_directory,' (zoom levels 0 to ',min(tile_zoom,pyramid.max_zoom),' of ',
+            pyramid.max_zoom,')')
+
+    return layout
+
+def main(argv=None):
+    '''Command line entry point (see the usage at the top of this file)'''
+
+    global verbose, pause, placement_engine, placement_sampler, candidate_jobs, render_backend, report_file
+    global tile_dir, tile_zoom, tile_jobs
+
+    parser = argparse.ArgumentParser(description='Plots confirmed exoplanets in a circle, and Kepler candidates around them')
+    parser.add_argument('--batch', action='store_true',
+                        help='Run headless: non-interactive matplotlib backend, no pauses, no progress messages')
+    parser.add_argument('--quiet', action='store_true', help='No progress messages')
+    parser.add_argument('--engine', default=placement_engine, choices=['random','frontchain'], help='Placement engine')
+    parser.add_argument('--sampler', default=placement_sampler, choices=['polar','raster'],
+                        help='Trial positions for the random engine')
+    parser.add_argument('--jobs', type=int, default=candidate_jobs, help='Processes placing the candidate annulus')
+    parser.add_argument('--backend', default=render_backend, choices=['matplotlib','raster'], help='Circle rendering')
+    parser.add_argument('--seed', type=int, help='Random number seed (default: from the date)')
+    parser.add_argument('--report', default=report_file, help='Write stage timings and placement statistics to this JSON file')
+    parser.add_argument('--tiles', default=tile_dir, help='Directory for zoomable tiles of the combined image')
+    parser.add_argument('--tile-zoom', type=int, default=tile_zoom, help='Zoom levels of tiles made in advance')
+    parser.add_argument('--tile-jobs', type=int, default=tile_jobs, help='Processes making the tiles')
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        import matplotlib
+        matplotlib.use('Agg')
+
+    verbose = not (args.batch or args.quiet)
+    pause = not args.batch
+    placement_engine = args.engine
+    placement_sampler = args.sampler
+    candidate_jobs = args.jobs
+    render_backend = args.backend
+    report_file = args.report
+    tile_dir = args.tiles
+    tile_zoom = args.tile_zoom
+    tile_jobs = args.tile_jobs
+
+    # Record wall time per stage (including each archive query) and placement statistics
+
+    stats = instrument.Instrumentation()
+
+    run(seed=args.seed, stats=stats, tile_directory=tile_dir)
+
+    if report_file:
+        stats.write_report(report_file)
+        say('Timings and placement statistics written to ',report_file)
+
+    say('Done')
+
+
+if __name__ == '__main__':
+    main()
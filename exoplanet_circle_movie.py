@@ -1,11 +1,23 @@
 # Code to produce multiple xkcd style plots using the latest exoplanet data
 # Code pulls data via SQL-type query, and delivers all objects with confirmed radii (Earth Radii)
+#
+# Importing this module does nothing else: run main() (or python exoplanet_circle_movie.py) to make the frames.
+# Usage: python exoplanet_circle_movie.py [--jobs 4] [--batch] [--quiet] [--backend raster] [--seed 1234]
+#                                         [--movie exoplanets.png] [--fps 2] [--interpolate 4]
+# --batch runs headless (Agg backend) without progress messages
 
 import numpy as np
-import exoplanet_data as exo
 import exo_circle_functions as fun
-import matplotlib.pyplot as plt
-from time import sleep
+import exo_circle_placement as place
+import exo_circle_table as table
+import exo_circle_raster as raster
+import exo_circle_animation as animation
+import exo_circle_instrument as instrument
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from collections import deque
+import argparse
+from timeit import default_timer as time
 import os
 
 pi = 3.141592654
@@ -17,142 +29,416 @@ placing_spacing = 1.05 # Tolerance for distance between planets. 1=planets can t
 graphic_border = 1.4 # How big is the graphic relative to the area of the annulus/circle?
 
 guess_radius_from_mass = True # Set this to true to estimate planet radius from mass
+incremental_layout = True # Keep the previous year's layout, and only place newly discovered planets
+frame_rad = 560.0 # Radius of the region shown in every frame (before graphic_border is applied)
+render_backend = 'matplotlib' # Circles drawn by 'matplotlib' or by 'raster' (exo_circle_raster)
 
-# Retrieve candidate exoplanets (Kepler)
+movie_file = None # Stream every frame into this animated file (.png, or .mp4 with ffmpeg) instead of a PNG per year
+movie_fps = 1.0 # Years shown per second in movie_file
+interpolate_frames = 0 # Frames added between years in movie_file, fading from one year to the next
 
-#os.system('tcsh')
+report_file = None # Stage timings and placement statistics are written to this JSON file (None = off; see --report)
 
-seed = fun.gen_random_seed_date()
-print "Today's seed is ",seed
+verbose = False # Print progress messages (main() switches them on, unless run with --batch or --quiet)
 
-# Loop over confirmed exoplanet data by discovery date
 
-beginyear,endyear = fun.begin_and_end_years()
+def say(*message):
+    '''Prints a progress message (if verbose is set)'''
 
-print "Generating graphics for years ",beginyear, " to ",endyear
+    if verbose:
+        print(*message)
 
-weblink = 'http://exoplanetarchive.ipac.caltech.edu/cgi-bin/nstedAPI/nph-nstedAPI?'
 
-for j in range(beginyear,endyear):
+def year_circle_radius(radii):
+    '''Calculates maximum area of circle for confirmed planets, and returns its radius'''
 
-    # 1. Pull exoplanet data using NASA API
+    circlearea = np.sum(pi*radii*radii)
 
-    print 'Retrieving planets detected before ',str(j)
-
-    disc = '+AND+pl_disc<'+str(j+1)
-    
-    radii = exo.pull_exoplanet_radii(extraconditions=disc)
-
-    # If requested, pull planets with masses and calculate radii
+    circlearea = circlearea*area_spacing_factor
+    circle_rad2 = circlearea/pi
+    circle_rad = np.sqrt(circle_rad2) 
 
-    if guess_radius_from_mass:
-        print 'Retrieving other planets with masses'
-        disc = disc+'+AND+pl_rade+is+null'
-        masses = exo.pull_exoplanet_masses(extraconditions=disc)
-        guessradii = fun.guess_radii_from_masses_PHL(masses)
-    
-        # Add to confirmed candidate list
-    
-        if(len(radii) > 0):
-            radii = np.concatenate((radii,guessradii),axis=0)
-        else:
-            radii = guessradii
-            
-    nplanet = len(radii)
+    return circle_rad
 
-    if guess_radius_from_mass:
-        print 'There are ',nplanet, ' planets with confirmed and calculated radii'
-    else:
-        print 'There are ',nplanet, ' planets with confirmed radii'
+def year_random_state(seed,year):
+    '''Random number stream used to place the planets of one year: depends only on the daily seed and the year,
+    so frames come out the same whichever process places them'''
 
-    # Sort data into descending order
+    return place.make_rng(seed,year)
 
-    radii = np.sort(radii)
-    radarg = np.argsort(radii, axis=0)[::-1]
-    radii = radii[radarg]
+def place_year(planets,year,seed):
+    '''Places all planets of one year from scratch, filling in the x and y columns of the table'''
 
-    # Set up arrays to store x and y positions
+    # Planets may overhang the edge of the circle here (no test_rad check)
+    circle_rad = year_circle_radius(planets.radius)
 
-    xp = np.zeros(nplanet)
-    yp = np.zeros(nplanet)
+    # Largest planets first
+    order = np.argsort(-planets.radius, kind='stable')
 
-    # Calculate maximum area of circle for confirmed planets
+    xp,yp = place.place_circles(planets.radius[order], 0.0, circle_rad, placing_spacing, rng=year_random_state(seed,year),
+                                test_bounds=False)
 
-    circlearea = 0.0
+    planets.x[order] = xp
+    planets.y[order] = yp
 
-    for i in range(nplanet):
-        circlearea = circlearea + pi*radii[i]*radii[i]
+def frame_axes():
+    '''Makes the figure and axis a frame is drawn on (the same region for every year)'''
 
-    circlearea = circlearea*area_spacing_factor
-    circle_rad2 = circlearea/pi
-    circle_rad = np.sqrt(circle_rad2) 
+    import matplotlib.pyplot as plt
 
-    print 'Total area of exoplanet circles is ',circlearea
-    print 'This gives a circle of radius ',circle_rad
-   
-    sleep(2)
-
-    # Now begin accept reject to build planet circle
-    
-    sep = 0.0
-    i = 0
-    overlapflag = 0
-
-    while i < nplanet:    
-        # Randomly select x and y inside the circle
-    
-        rad = np.random.mtrand.uniform(low=0.0,high = circle_rad)
-        phi = np.random.mtrand.uniform(low=0.0,high=2.0*pi)
-    
-        xp[i] = rad*np.cos(phi)
-        yp[i] = rad*np.sin(phi)    
-     
-        overlapflag = 0
-    
-        # Check - does planet's extent exceed circle radius?    
-        #overlapflag = fun.test_rad(xp[i], yp[i], radii[i], 0.0, circle_rad)
-        #if overlapflag==1: continue      
-    
-        # Now check to see if there is overlap among neighbours
-        overlapflag = fun.test_neighbours(i, xp, yp, radii, placing_spacing)    
-        
-        # Check to see if overlap flagged - if not, increase i by 1
-        if overlapflag==0:
-            i +=1
-            print 'Planet ', i, 'placed'
-                
-    # End while loop
-
-    print 'Planets placed: plotting'
-    sleep(2)
-
-    
-    # Now plot data 
     fig = plt.figure()
     ax = fig.add_subplot(111)
     #ax.set_xlim(-graphic_border*circle_rad,graphic_border*circle_rad)
     #ax.set_ylim(-graphic_border*circle_rad,graphic_border*circle_rad)
-    ax.set_xlim(-graphic_border*560.0,graphic_border*560.0)
-    ax.set_ylim(-graphic_border*560.0,graphic_border*560.0)
+    ax.set_xlim(-graphic_border*frame_rad,graphic_border*frame_rad)
+    ax.set_ylim(-graphic_border*frame_rad,graphic_border*frame_rad)
     ax.set_axis_off()
 
-    print 'Plotting'
+    return fig,ax
+
+def frame_caption(year,nplanet):
+    '''Caption of one year's frame'''
 
     if guess_radius_from_mass:
-        textstring = str(nplanet)+' exoplanets with confirmed and calculated physical radii as of '+str(j)
+        return str(nplanet)+' exoplanets with confirmed and calculated physical radii as of '+str(year)
     else:   
-        textstring = str(nplanet)+' exoplanets with confirmed physical radii as of '+str(j)
-    
-    fun.make_circle_legend(ax,textstring,0.0,0.0)
-
-
-    for i in range(nplanet):    
-    
-        numstring = '0'+str(j)
-        colors = fun.pick_circle_colour(radii[i])
-        
-        circle1=plt.Circle((xp[i],yp[i]),radius=radii[i],edgecolor='none',facecolor=colors)    
-        ax.add_patch(circle1)
+        return str(nplanet)+' exoplanets with confirmed physical radii as of '+str(year)
+
+def frame_filename(year):
+    '''Name of one year's frame: confirmed0YYYY.png'''
+
+    numstring = '0'+str(year)
+
+    return 'confirmed'+numstring+'.png'
+
+def plot_frame(year,planets):
+    '''Plots one year's planets and writes the frame to confirmed0YYYY.png'''
+
+    import matplotlib.pyplot as plt
+
+    fig,ax = frame_axes()
+
+    fun.make_circle_legend(ax,frame_caption(year,len(planets)),0.0,0.0)
+
+    fun.plot_circles(ax,planets.x,planets.y,planets.radius,planets.category)
  
-    plt.savefig('confirmed'+numstring+'.png', format='png')
-    print 'Year ',str(j), ' Done'
+    plt.savefig(frame_filename(year), format='png')
+    plt.close(fig)
+
+def make_frame(frame):
+    '''Places (if it has not been placed yet) and plots one frame: frame is (year, seed, planets, placed)'''
+
+    year,seed,planets,placed = frame
+
+    if not placed:
+        place_year(planets,year,seed)
+
+    plot_frame(year,planets)
+
+    return year
+
+
+def fetch_discoveries(stats=None):
+    '''Pulls radius, mass and discovery year of every planet with a radius or mass (see exoplanet_data).
+    Returns a PlanetTable (see exo_circle_table) of the planets with a radius (measured or, if
+    guess_radius_from_mass is set, estimated from the mass)'''
+
+    import exoplanet_data as exo
+
+    # 1. Pull exoplanet data using NASA API: radii, masses and discovery years in one query
+    # Each year's planets are then selected from this table
+
+    say('Retrieving planets with radii or masses')
+
+    exo.stats = stats
+    try:
+        radii_all,masses_all,years_all = exo.pull_exoplanet_discoveries()
+    finally:
+        exo.stats = None
+
+    return table.from_discoveries(radii_all, masses_all, years_all, guess_radius_from_mass)
+
+def layout_years(planets, beginyear, endyear, seed, stats=None):
+    '''Returns a frame (year, seed, planets, placed) for every year from beginyear to endyear-1, where planets is
+    the PlanetTable of the planets discovered before the end of year.
+    With incremental_layout, every year's planets are placed here (placed is False otherwise,
+    and each frame is placed from scratch by make_frame)'''
+
+    # Order the planets by discovery year (those up to beginyear together), largest first within each year:
+    # every year's planets are then the first rows of the table, in the order they are placed in
+
+    planets = planets.sorted_by_year(beginyear)
+
+    frames = []
+
+    if not incremental_layout:
+        for j in range(beginyear,endyear):
+            frames.append((j,seed,planets.discovered_before(j).copy(),False))
+        return frames
+
+    # Each year depends on the last, so placing is done here, in order, and only plotting is shared out
+    # Planets placed in earlier years stay where they are: only place the new discoveries around them
+    # Their positions are written into the table, so each frame is a view of its first rows
+
+    # Each year's layout is cached under a key that also covers every earlier year's layout
+
+    # One grid serves every year: its cell size comes from the last year's planets (earlier years may have none)
+    grid = place.NeighbourGrid(graphic_border*frame_rad,
+                               place.neighbour_cellsize(planets.discovered_before(endyear-1).radius,placing_spacing),
+                               placing_spacing)
+    nplaced = 0
+    layout_key = ''
+
+    for j in range(beginyear,endyear):
+
+        year_planets = planets.discovered_before(j)
+        radii = year_planets.radius
+        circle_rad = year_circle_radius(radii)
+
+        layout_key = place.layout_key([radii], seed, area_spacing_factor, placing_spacing,
+                                      'movie/'+str(j)+'/'+str(frame_rad), previous=layout_key)
+        layout = place.load_layout(layout_key)
+
+        if layout is not None:
+            say('Year ',str(j),': using cached layout (',len(radii),' planets)')
+            year_planets.x[:],year_planets.y[:] = layout['xp'],layout['yp']
+            nplaced = len(year_planets)
+            frames.append((j,seed,year_planets,True))
+            continue
+
+        # Planets read from the cache are not in the grid yet
+        for k in range(grid.nplaced,nplaced):
+            grid.insert(planets.x[k], planets.y[k], planets.radius[k])
+
+        new_planets = planets[nplaced:len(year_planets)]
+        say('Year ',str(j),': placing ',len(new_planets),' newly discovered planets (',len(radii),' in total)')
+
+        new_planets.x[:],new_planets.y[:] = place.place_circles(new_planets.radius, 0.0, circle_rad, placing_spacing,
+                                                                rng=year_random_state(seed,j), grid=grid,
+                                                                test_bounds=False, stats=stats, layer=str(j))
+        nplaced = len(year_planets)
+
+        place.save_layout(layout_key, radii=radii, xp=year_planets.x, yp=year_planets.y)
+
+        frames.append((j,seed,year_planets,True))
+
+    return frames
+
+def raster_images(frames):
+    '''Draws every frame (see layout_years) in order with the raster backend, yielding (year, image) for each,
+    the image an RGB uint8 array. The legend is drawn once, and the planets are kept in one layer from frame to
+    frame: each frame only draws the planets discovered since the last (or all of them, if it is placed from scratch)'''
+
+    import matplotlib.pyplot as plt
+
+    fig,ax = frame_axes()
+    viewport = raster.axis_viewport(fig,ax)
+
+    legend = raster.artist_layer(fig,[fun.make_category_legend(ax)])
+    planet_layer = raster.blank_layer(*viewport[:2])
+    ndrawn = 0
+
+    try:
+        for year,seed,planets,placed in frames:
+
+            # Frames laid out incrementally hold the planets of the last frame first
+            if placed:
+                new_planets = planets[ndrawn:]
+            else:
+                place_year(planets,year,seed)
+                planet_layer[:] = 0.0
+                new_planets = planets
+
+            raster.draw_axis_circles(planet_layer,ax,new_planets.x,new_planets.y,new_planets.radius,new_planets.category)
+            ndrawn = len(planets)
+
+            caption = raster.artist_layer(fig,[fun.make_caption(ax,frame_caption(year,len(planets)),0.0,0.0)])
+
+            yield year,raster.to_rgb8(raster.composite([planet_layer,legend,caption]))
+    finally:
+        plt.close(fig)
+
+def frame_image(frame):
+    '''Places (if it has not been placed yet) and plots one frame in memory, without writing a file.
+    Returns (year, image), the image an RGB uint8 array'''
+
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    year,seed,planets,placed = frame
+
+    if not placed:
+        place_year(planets,year,seed)
+
+    fig,ax = frame_axes()
+
+    fun.make_circle_legend(ax,frame_caption(year,len(planets)),0.0,0.0)
+    fun.plot_circles(ax,planets.x,planets.y,planets.radius,planets.category)
+
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    image = np.asarray(canvas.buffer_rgba())[:,:,:3].copy()
+
+    plt.close(fig)
+
+    return year,image
+
+def ordered_map(pool, function, items, window):
+    '''Like pool.imap, but with at most window items handed to the pool and not yet returned, so only that many
+    frames are held in memory at once (without a pool, function is simply called on each item in turn)'''
+
+    if pool is None:
+        for item in items:
+            yield function(item)
+        return
+
+    pending = deque()
+
+    for item in items:
+        pending.append(pool.apply_async(function,(item,)))
+        if len(pending) > window:
+            yield pending.popleft().get()
+
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+def frame_images(frames, jobs=1):
+    '''Yields (year, image) for every frame (see layout_years) in order, drawn with jobs processes in parallel
+    (with render_backend = 'raster', frames are drawn in order, each from the last: see raster_images)'''
+
+    if render_backend=='raster':
+        for item in raster_images(frames):
+            yield item
+        return
+
+    pool = Pool(jobs) if jobs > 1 else None
+
+    try:
+        for item in ordered_map(pool, frame_image, frames, jobs):
+            yield item
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def write_frame(item):
+    '''Writes the image of one frame, given as (year, image), to confirmed0YYYY.png. Returns the year'''
+
+    year,image = item
+    raster.write_png(frame_filename(year), image)
+
+    return year
+
+def make_frames(frames, jobs=1):
+    '''Plots every frame (see layout_years) to its own PNG file, with jobs processes in parallel
+    (with render_backend = 'raster', frames are drawn in order, and jobs threads compress them)'''
+
+    pool = None
+    if render_backend=='raster':
+        # zlib releases the GIL, so frames are compressed in parallel while the next ones are drawn
+        if jobs > 1: pool = ThreadPool(jobs)
+        finished = ordered_map(pool, write_frame, raster_images(frames), jobs)
+    elif jobs > 1:
+        pool = Pool(jobs)
+        finished = pool.imap(make_frame,frames)
+    else:
+        finished = (make_frame(frame) for frame in frames)
+
+    for year in finished:
+        say('Year ',str(year), ' Done')
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def make_movie(frames, filename, jobs=1):
+    '''Streams every frame (see layout_years) into one animated file as it is drawn (an animated PNG, or a video if
+    filename ends in e.g. .mp4 and ffmpeg is installed: see exo_circle_animation.open_writer).
+    No frame files are written, and only a few frames are held in memory at once however many years there are.
+    With interpolate_frames, that many frames fading from each year to the next are added'''
+
+    steps = interpolate_frames
+    nframes = len(frames)+steps*max(len(frames)-1,0)
+
+    images = animation.interpolate(frame_images(frames, jobs), steps)
+
+    with animation.open_writer(filename, nframes, movie_fps*(steps+1)) as writer:
+        for year,image in images:
+            writer.write(image)
+            if year is not None:
+                say('Year ',str(year), ' Done')
+
+def run(seed=None, jobs=1, stats=None, movie=None):
+    '''Makes the frame of every year from begin_and_end_years, for today's seed unless seed is given.
+    Frames are written to one PNG file per year, or streamed into the animated file movie (default movie_file)'''
+
+    if movie is None:
+        movie = movie_file
+
+    if seed is None:
+        seed = fun.gen_random_seed_date()
+    say("Today's seed is ",seed)
+
+    # Loop over confirmed exoplanet data by discovery date
+
+    beginyear,endyear = fun.begin_and_end_years()
+
+    say("Generating graphics for years ",beginyear, " to ",endyear)
+
+    planets = fetch_discoveries(stats=stats)
+
+    place_start = time()
+    frames = layout_years(planets, beginyear, endyear, seed, stats=stats)
+    if stats is not None: stats.add_stage('place', time()-place_start)
+
+    say('Plotting with ',jobs,' processes')
+    plot_start = time()
+
+    if movie:
+        make_movie(frames, movie, jobs)
+    else:
+        make_frames(frames, jobs)
+
+    if stats is not None: stats.add_stage('plot', time()-plot_start, jobs=jobs)
+
+def main(argv=None):
+    '''Command line entry point (see the usage at the top of this file)'''
+
+    global verbose, render_backend, movie_fps, interpolate_frames, report_file
+
+    parser = argparse.ArgumentParser(description='Plots the exoplanets discovered before each year, one frame per year')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of processes producing frames in parallel')
+    parser.add_argument('--batch', action='store_true',
+                        help='Run headless: non-interactive matplotlib backend, no progress messages')
+    parser.add_argument('--quiet', action='store_true', help='No progress messages')
+    parser.add_argument('--backend', default=render_backend, choices=['matplotlib','raster'], help='Circle rendering')
+    parser.add_argument('--movie', default=movie_file,
+                        help='Stream the frames into this animated file (.png: animated PNG, .mp4 etc: video via ffmpeg)')
+    parser.add_argument('--fps', type=float, default=movie_fps, help='Years per second in the animated file')
+    parser.add_argument('--interpolate', type=int, default=interpolate_frames,
+                        help='Frames added between years in the animated file, fading from one to the next')
+    parser.add_argument('--seed', type=int, help='Random number seed (default: from the date)')
+    parser.add_argument('--report', default=report_file, help='Write stage timings and placement statistics to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        import matplotlib
+        matplotlib.use('Agg')
+
+    verbose = not (args.batch or args.quiet)
+    render_backend = args.backend
+    movie_fps = args.fps
+    interpolate_frames = args.interpolate
+    report_file = args.report
+
+    stats = instrument.Instrumentation()
+
+    run(seed=args.seed, jobs=args.jobs, stats=stats, movie=args.movie)
+
+    if report_file:
+        stats.write_report(report_file)
+        say('Timings and placement statistics written to ',report_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+# Serves the exoplanet circle images from a long-running local process: the catalogue is fetched and the layouts
+# are placed once, and kept in memory, instead of every time an image is wanted
+#
+# Usage: python exoplanet_circle_service.py [--host 127.0.0.1] [--port 8765] [--refresh 3600] [--backend raster]
+#                                           [--seed 1234] [--tiles tiles] [--quiet]
+#
+#   /confirmed.png, /combined.png   the images written by exoplanet_circle.py
+#   /years/YYYY.png                 the planets discovered before the end of YYYY (a frame of the movie)
+#   /tiles/z/x/y.png                zoomable tiles of the combined image (see exo_circle_tiles)
+#   /status                         the data being served, as JSON
+#
+# Images are made when they are first asked for, and kept in an LRU cache. The data is fetched and placed again
+# every refresh_interval seconds in a background thread (with that day's seed, unless --seed is given): requests are
+# answered from the data loaded before until the new layouts are ready, and then from the new ones
+
+import os
+import json
+import shutil
+import threading
+import argparse
+from io import BytesIO
+from collections import OrderedDict
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from timeit import default_timer as time
+import exo_circle_functions as fun
+import exo_circle_raster as raster
+import exo_circle_tiles as tiles
+import exoplanet_circle as circle
+import exoplanet_circle_movie as movie
+
+host = '127.0.0.1' # Address the service listens on (only this machine, by default)
+port = 8765
+refresh_interval = 3600.0 # Seconds between fetching the data again (cached archive results are revalidated as often)
+image_cache_size = 256 # Images and tiles kept in memory
+render_backend = 'raster' # Circles drawn by 'matplotlib' or by 'raster' (exo_circle_raster)
+tile_dir = None # Tiles are also kept in this directory, under the key of their layout (None: only in memory)
+
+verbose = False # Print progress messages and requests (main() switches them on, unless run with --quiet)
+
+
+def say(*message):
+    '''Prints a progress message (if verbose is set)'''
+
+    if verbose:
+        print(*message)
+
+
+class Snapshot(object):
+    '''Everything served from one fetch of the data: the layout of the confirmed planets and candidates (see
+    exoplanet_circle.place_planets), the frame of every year (see exoplanet_circle_movie.layout_years) and the tiles
+    of the combined image. A snapshot is not changed once it is made, so it can be read by any number of requests'''
+
+    def __init__(self, seed):
+
+        self.seed = seed
+        self.loaded = datetime.now()
+
+        planets = circle.fetch_planets()
+        self.layout = circle.place_planets(planets, seed=seed)
+
+        # The movie's frames are placed from the same confirmed planets (layout_years sorts a copy by year)
+        beginyear,endyear = fun.begin_and_end_years()
+        frames = movie.layout_years(planets.confirmed_planets(), beginyear, endyear, seed)
+        self.frames = OrderedDict((frame[0],frame) for frame in frames)
+
+        # The layout key covers the radii of every planet and candidate, the seed and the placing settings
+        self.key = self.layout['key']
+
+        # Each layout keeps its tiles in its own directory, so the tiles of the snapshot being served are never
+        # removed or overwritten while this one is made
+        self.pyramid = circle.tile_pyramid(self.layout, tile_directory(self.key))
+
+    def status(self):
+        '''Returns a description of the snapshot'''
+
+        planets = self.layout['planets']
+
+        return {'key': self.key, 'seed': self.seed, 'loaded': self.loaded.isoformat(),
+                'nplanet': len(planets.confirmed_planets()), 'ncandidate': len(planets.candidates()),
+                'years': list(self.frames), 'tile_size': tiles.tile_size, 'max_zoom': self.pyramid.max_zoom}
+
+
+class ImageCache(object):
+    '''Encoded images shared by every request: the least recently used are dropped once there are more than maxitems'''
+
+    def __init__(self, maxitems=None):
+
+        self.maxitems = maxitems
+        if self.maxitems is None:
+            self.maxitems = image_cache_size
+
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns the image stored under key, or None'''
+
+        with self.lock:
+            data = self.items.get(key)
+            if data is not None:
+                self.items.move_to_end(key)
+
+        return data
+
+    def put(self, key, data):
+        '''Stores an image under key'''
+
+        with self.lock:
+            self.items[key] = data
+            self.items.move_to_end(key)
+
+            while len(self.items) > self.maxitems:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+
+        return len(self.items)
+
+
+class RenderService(object):
+    '''Holds the snapshot being served, and makes images from it (see respond).
+    seed fixes the seed of every layout (None: today's seed, as the scripts use)'''
+
+    def __init__(self, seed=None):
+
+        self.seed = seed
+        self.snapshot = None
+        self.images = ImageCache()
+
+        # matplotlib (and the layer cache of exoplanet_circle) must only be used by one thread at a time;
+        # tiles are drawn with numpy alone, and need no lock
+        self.render_lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def refresh(self):
+        '''Fetches the data and places the layouts again, then serves them. Until they are ready, requests go on
+        being answered from the snapshot before. Returns the new snapshot'''
+
+        with self.refresh_lock:
+            seed = self.seed
+            if seed is None:
+                seed = fun.gen_random_seed_date()
+
+            t0 = time()
+            snapshot = Snapshot(seed)
+
+            # Requests already under way keep the snapshot they started with
+            self.snapshot = snapshot
+
+            remove_old_tiles(snapshot.key)
+
+        say('Serving layout ',snapshot.key,' (seed ',seed,', loaded in ','%.1f' % (time()-t0),' s)')
+
+        return snapshot
+
+    def refresh_periodically(self, interval):
+        '''Refreshes the data every interval seconds, until stop is called (run in a background thread)'''
+
+        while not self.stopped.wait(interval):
+            try:
+                self.refresh()
+            except Exception as error:
+                say('Refresh failed (still serving the data loaded before): ',error)
+
+    def stop(self):
+        '''Ends refresh_periodically'''
+
+        self.stopped.set()
+
+    def image(self, key, draw, lock=True):
+        '''Returns the image stored under key, calling draw() to make it if it is not in the cache
+        (holding the render lock, unless lock is False)'''
+
+        data = self.images.get(key)
+        if data is not None:
+            return data
+
+        if not lock:
+            data = draw()
+        else:
+            with self.render_lock:
+                # Another request may have made the same image while this one waited
+                data = self.images.get(key)
+                if data is not None:
+                    return data
+                data = draw()
+
+        self.images.put(key, data)
+
+        return data
+
+    def respond(self, path):
+        '''Returns (content type, data) for a request path (see the top of this file).
+        Raises KeyError if there is nothing at path'''
+
+        snapshot = self.snapshot
+        parts = path.strip('/').split('/')
+
+        if parts in (['status'],['']):
+            status = snapshot.status()
+            status['images_cached'] = len(self.images)
+            return 'application/json', json.dumps(status, indent=1).encode('utf-8')
+
+        if parts in (['confirmed.png'],['combined.png']):
+            render = {'confirmed.png': circle.render_confirmed, 'combined.png': circle.render_combined}[parts[0]]
+
+            # The caption ends with today's date
+            key = (snapshot.key,parts[0],fun.date_string())
+            return 'image/png', self.image(key, lambda: render_png(render, snapshot.layout))
+
+        try:
+            if len(parts)==2 and parts[0]=='years' and parts[1].endswith('.png'):
+                frame = snapshot.frames[int(parts[1][:-4])]
+                return 'image/png', self.image((snapshot.key,'years',frame[0]), lambda: frame_png(frame))
+
+            if len(parts)==4 and parts[0]=='tiles' and parts[3].endswith('.png'):
+                z,x,y = int(parts[1]),int(parts[2]),int(parts[3][:-4])
+                snapshot.pyramid.check_tile(z,x,y)
+                return 'image/png', self.image((snapshot.key,'tiles',z,x,y), lambda: snapshot.pyramid.tile(z,x,y),
+                                               lock=False)
+        except ValueError:
+            pass
+
+        raise KeyError(path)
+
+
+def tile_directory(key):
+    '''Returns the directory keeping the tiles of the layout with this key (None if tiles are only kept in memory)'''
+
+    if tile_dir is None:
+        return None
+
+    return os.path.join(tile_dir,key)
+
+def remove_old_tiles(key):
+    '''Removes the tile directories of every layout but key from tile_dir (called once key is being served)'''
+
+    if tile_dir is None or not os.path.isdir(tile_dir):
+        return
+
+    for name in os.listdir(tile_dir):
+        # Only directories named like layout keys are touched
+        if name!=key and len(name)==len(key) and all(character in '0123456789abcdef' for character in name):
+            shutil.rmtree(os.path.join(tile_dir,name), ignore_errors=True)
+
+def render_png(render, layout):
+    '''Returns the PNG data of an image drawn by exoplanet_circle.render_confirmed or render_combined'''
+
+    output = BytesIO()
+    render(layout, output)
+
+    return output.getvalue()
+
+def frame_png(frame):
+    '''Returns the PNG data of one year's frame (see exoplanet_circle_movie.layout_years)'''
+
+    if movie.render_backend=='raster':
+        for year,image in movie.raster_images([frame]):
+            pass
+    else:
+        year,image = movie.frame_image(frame)
+
+    return raster.encode_png(image)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    '''Answers GET requests from the RenderService of its server'''
+
+    def do_GET(self):
+
+        path = self.path.split('?')[0]
+
+        try:
+            content_type,data = self.server.service.respond(path)
+        except KeyError:
+            self.send_error(404, 'Nothing at '+path)
+            return
+        except Exception as error:
+            self.send_error(500, str(error))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+
+        if verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def make_server(service, address=None):
+    '''Returns an HTTP server answering requests from service, each in its own thread'''
+
+    if address is None:
+        address = (host,port)
+
+    server = ThreadingHTTPServer(address, ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+
+    return server
+
+def serve(seed=None):
+    '''Loads the data, then serves it until interrupted, refreshing it every refresh_interval seconds'''
+
+    import exoplanet_data as exo
+
+    # Images are only ever drawn off screen
+    import matplotlib
+    matplotlib.use('Agg')
+
+    circle.verbose = movie.verbose = False
+    circle.pause = False
+    circle.render_backend = movie.render_backend = render_backend
+
+    # Each refresh asks the archive whether the data has changed
+    exo.cache_ttl = min(exo.cache_ttl, refresh_interval)
+
+    service = RenderService(seed)
+
+    say('Loading the catalogue and placing the layouts')
+    service.refresh()
+
+    server = make_server(service)
+
+    refresher = threading.Thread(target=service.refresh_periodically, args=(refresh_interval,))
+    refresher.daemon = True
+    refresher.start()
+
+    say('Serving on http://'+host+':'+str(server.server_address[1])+'/')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+def main(argv=None):
+    '''Command line entry point (see the usage at the top of this file)'''
+
+    global verbose, host, port, refresh_interval, render_backend, tile_dir
+
+    parser = argparse.ArgumentParser(description='Serves the exoplanet circle images from data kept in memory')
+    parser.add_argument('--host', default=host, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=port, help='Port to listen on')
+    parser.add_argument('--refresh', type=float, default=refresh_interval, help='Seconds between refreshing the data')
+    parser.add_argument('--backend', default=render_backend, choices=['matplotlib','raster'], help='Circle rendering')
+    parser.add_argument('--seed', type=int, help='Random number seed (default: from the date)')
+    parser.add_argument('--tiles', default=tile_dir, help='Directory the tiles are also kept in (one directory per layout)')
+    parser.add_argument('--quiet', action='store_true', help='No progress messages or request logs')
+    args = parser.parse_args(argv)
+
+    verbose = not args.quiet
+    host = args.host
+    port = args.port
+    refresh_interval = args.refresh
+    render_backend = args.backend
+    tile_dir = args.tiles
+
+    serve(seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,87 +1,512 @@
 import numpy as np
-from os import system
+import os
+import csv
+import zipfile
+from itertools import chain
+import hashlib
+import warnings
+import threading
+import atexit
+from multiprocessing.pool import ThreadPool
+from time import time
+import exo_circle_functions as fun
+
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit
+
+
+# Base URL of the Exoplanet Archive API (Caltech)
+# Set EXOPLANET_ARCHIVE_URL (or call set_archive_url) to use a local stand-in server instead
+archive_url = os.environ.get('EXOPLANET_ARCHIVE_URL','http://exoplanetarchive.ipac.caltech.edu/cgi-bin/nstedAPI/nph-nstedAPI?')
+archive_timeout = 60.0 # Seconds to wait for the archive to respond
+
+response_format = 'ascii' # Format requested from the archive: 'ascii' (IPAC table) or 'csv' (both can be parsed)
+parse_block = 4096 # Rows converted to numbers at a time while parsing
+
+# Persistent (keep-alive) connections to the archive host, one per thread, reused by every query
+connections = threading.local()
+
+# Threads running concurrent queries (see pull_concurrently), kept between calls so their connections are reused
+query_pool = None
+query_pool_size = 0
+query_pool_pid = None
+query_pool_lock = threading.Lock()
+
+# Local cache of parsed query results (one .npz file per query)
+use_cache = True
+cache_dir = os.environ.get('EXOPLANET_CACHE_DIR',os.path.join(os.path.expanduser('~'),'.exoplanet_circle','cache'))
+cache_ttl = 86400.0 # Seconds before a cached result is revalidated with the archive
+offline = False # Set this to true to serve cached results without contacting the archive
+
+# Instrumentation (exo_circle_instrument.Instrumentation) recording the time taken by each query, if set
+stats = None
+
+
+def set_archive_url(url):
+    '''Points all subsequent queries at a different archive URL (e.g. a local test server)'''
+
+    global archive_url
+
+    archive_url = url
+    close_connection()
+
+def close_connection():
+    '''Closes this thread's persistent connection to the archive (a new one is opened by the next query)'''
+
+    connection = getattr(connections,'connection',None)
+
+    if connection is not None:
+        connection.close()
+    connections.connection = None
+
+def open_connection():
+    '''Returns this thread's persistent connection to the archive host, opening it if necessary'''
+
+    connection = getattr(connections,'connection',None)
+
+    # Connections opened before the archive URL was changed are replaced
+    if connection is not None and connections.url!=archive_url:
+        close_connection()
+        connection = None
+
+    if connection is None:
+        url = urlsplit(archive_url)
+        if url.scheme=='https':
+            connection = HTTPSConnection(url.netloc, timeout=archive_timeout)
+        else:
+            connection = HTTPConnection(url.netloc, timeout=archive_timeout)
+
+        connections.connection = connection
+        connections.url = archive_url
+
+    return connection
+
+def query_string(table,entries,conditions,order,form='ascii'):
+    '''Builds the API query (See http://exoplanetarchive.ipac.caltech.edu/docs/program_interfaces.html for documentation)'''
+
+    return 'table='+table+'&select='+entries+'&where='+conditions+'&order='+order+'&format='+form
+
+def send_query(query,headers={}):
+    '''Sends a query to the archive over the persistent connection, and returns the (unread) response'''
+
+    url = urlsplit(archive_url)
+    target = url.path+'?'
+    if url.query!='':
+        target = target+url.query+'&'
+    target = target+query
+
+    # A kept-alive connection may have been dropped by the server: if so, reconnect and try once more
+    for attempt in range(2):
+        try:
+            conn = open_connection()
+            conn.request('GET', target, headers=headers)
+            response = conn.getresponse()
+            break
+        except (HTTPException,IOError):
+            close_connection()
+            if attempt==1: raise
+
+    if response.status not in (200,304):
+        response.read()
+        raise IOError('Exoplanet Archive query failed with HTTP status '+str(response.status)+': '+query)
+
+    return response
+
+def response_lines(response):
+    '''Iterates over the lines of a response as they arrive, as text'''
+
+    while True:
+        line = response.readline()
+        if not line: break
+        if not isinstance(line,str):
+            line = line.decode('ascii','replace')
+        yield line
+
+def read_header(lines):
+    '''Reads the header of an archive table from an iterator of lines, leaving the iterator at the first row.
+    ascii tables (IPAC format) start with \\keyword and comment lines, then |-delimited lines giving the column
+    names, types, units and null values; csv tables start with a line of column names.
+    Returns (format, names, types, nulls, spans, first row), where spans are the character ranges of
+    ascii columns, and first row is None for an empty table'''
+
+    form = None
+    header = []
+    spans = None
+
+    for line in lines:
+        if line.strip()=='':
+            continue
+
+        if form is None and not line.startswith(('\\','|')):
+            # Not an IPAC table: either csv column names or an error message from the archive
+            if line.startswith('<') or line.upper().startswith('ERROR'):
+                raise IOError('Exoplanet Archive returned an error: '+line.strip()+' '+''.join(lines).strip())
+
+            names = [name.strip() for name in next(csv.reader([line]))]
+            types = ['double']*len(names)
+            nulls = [['']]*len(names)
+            return 'csv',names,types,nulls,None,next(lines,None)
+
+        form = 'ascii'
+
+        if line.startswith('\\'):
+            continue
+
+        if line.startswith('|'):
+            line = line.rstrip('\r\n')
+            if spans is None:
+                bars = [k for k,character in enumerate(line) if character=='|']
+                spans = [(bars[k],bars[k+1]+1) for k in range(len(bars)-1)]
+            header.append([field.strip() for field in line.strip('|').split('|')])
+            continue
+
+        first = line
+        break
+    else:
+        first = None
+
+    if form is None:
+        raise IOError('Exoplanet Archive returned an empty response')
+
+    if len(header)==0:
+        raise IOError('Exoplanet Archive table has no column names')
+
+    names = header[0]
+    types = header[1] if len(header) > 1 else ['double']*len(names)
+    nulls = [['null',value] for value in header[3]] if len(header) > 3 else [['null']]*len(names)
+
+    return form,names,types,nulls,spans,first
+
+def parse_columns(lines):
+    '''Parses an archive table (ascii or csv) as it streams in, finding its format and columns from the header.
+    Numeric columns go straight into preallocated float arrays (null entries become NaN), converted parse_block
+    rows at a time; char columns of ascii tables are kept as strings.
+    Returns (names, columns): the column names, and one array per column'''
+
+    lines = iter(lines)
+    form,names,types,nulls,spans,first = read_header(lines)
+
+    ncolumn = len(names)
+    numeric = [not kind.lower().startswith('char') and not kind.lower().startswith('date') for kind in types]
+
+    capacity = 1024
+    nrow = 0
+    columns = [np.empty(capacity, dtype=float if numeric[k] else object) for k in range(ncolumn)]
+
+    nullvalues = set(value for values in nulls for value in values)
+    # Blank fields would vanish when rows are split on whitespace: with a blank null marker, columns are sliced
+    fastpath = all(numeric) and '' not in nullvalues and all(value.isalpha() for value in nullvalues)
+
+    def convert(block):
+        '''Converts a block of rows into the column arrays, growing them if necessary'''
+
+        nonlocal capacity, nrow, columns
+
+        nblock = len(block)
+        if nrow+nblock > capacity:
+            while nrow+nblock > capacity: capacity *= 2
+            for k in range(ncolumn):
+                grown = np.empty(capacity, dtype=columns[k].dtype)
+                grown[:nrow] = columns[k][:nrow]
+                columns[k] = grown
+
+        if form=='ascii' and fastpath:
+            # Every entry is a number or a (word-like) null marker: convert the whole block at once
+            text = ' '.join(block)
+            for value in nullvalues:
+                text = text.replace(value,'nan')
+            values = np.array(text.split(), dtype=float)
+
+            if len(values)!=nblock*ncolumn:
+                raise ValueError('Malformed archive table: expected '+str(ncolumn)+' columns per row')
+
+            values = values.reshape(nblock,ncolumn)
+            for k in range(ncolumn):
+                columns[k][nrow:nrow+nblock] = values[:,k]
+
+        else:
+            if form=='csv':
+                # An empty line is a row of one null entry
+                rows = [row or [''] for row in csv.reader(block)]
+            else:
+                rows = [[line[start:end].strip() for start,end in spans] for line in block]
+
+            if any(len(row)!=ncolumn for row in rows):
+                raise ValueError('Malformed archive table: expected '+str(ncolumn)+' columns per row')
+
+            for k in range(ncolumn):
+                values = [row[k] for row in rows]
+                if numeric[k]:
+                    values = np.array(['nan' if value in nullvalues else value for value in values], dtype=float)
+                columns[k][nrow:nrow+nblock] = values
+
+        nrow += nblock
+
+    # Blank lines are skipped, except in a csv table of one column (where they are null entries)
+    skip_blank = form=='ascii' or ncolumn > 1
+
+    if first is not None:
+        block = []
+        for line in chain([first],lines):
+            if skip_blank and line.strip()=='': continue
+            block.append(line)
+            if len(block)==parse_block:
+                convert(block)
+                block = []
+        if len(block) > 0:
+            convert(block)
+
+    columns = [column[:nrow] if column.dtype!=object else column[:nrow].astype(str) for column in columns]
+
+    return names,columns
+
+def parse_table(lines):
+    '''Parses an archive table (ascii or csv, see parse_columns) into a float array:
+    one value per row for a single column, or one row of values per object for several ('null' becomes NaN).
+    An empty result gives an array with no rows'''
+
+    names,columns = parse_columns(lines)
+
+    if len(columns)==1:
+        return columns[0].astype(float)
+
+    return np.column_stack([column.astype(float) for column in columns]).reshape(-1,len(columns))
+
+def cache_filename(table,entries,conditions,order):
+    '''Location of the cached result for a query: the name is a hash of the archive URL, the response format,
+    table, select, where and order (so results from a stand-in server are never served as the archive's)'''
+
+    key = '|'.join((archive_url,response_format,table,entries,conditions,order))
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    return os.path.join(cache_dir,key+'.npz')
+
+def load_cache(filename):
+    '''Reads a cached query result: returns (data, fetch time, Last-Modified, ETag), or None if there is no usable copy'''
+
+    if not os.path.exists(filename):
+        return None
+
+    try:
+        cached = np.load(filename)
+        entry = (cached['data'],float(cached['fetched']),str(cached['last_modified']),str(cached['etag']))
+        cached.close()
+    except (IOError,ValueError,KeyError,EOFError,zipfile.BadZipFile):
+        # A truncated or damaged file is a cache miss
+        return None
+
+    return entry
+
+def save_cache(filename,data,last_modified,etag):
+    '''Writes a query result to the cache (atomically, so readers never see a partial file).
+    A cache that cannot be written (read-only or full disk) only gives a warning: the result is still good'''
+
+    try:
+        fun.write_atomically(filename, lambda f: np.savez(f,data=data,fetched=time(),last_modified=last_modified,etag=etag))
+    except OSError as error:
+        warnings.warn('Could not write to the cache ('+str(error)+'): the query result is not kept')
+
+def fetch_query(table,entries,conditions,order,headers={}):
+    '''Pulls columns from the archive, streaming the response straight into the parser.
+    Returns (data, response), where data is None if the archive answered 304 Not Modified'''
+
+    response = send_query(query_string(table,entries,conditions,order,response_format),headers)
+
+    data = None
+    try:
+        if response.status==200:
+            data = parse_table(response_lines(response))
+    finally:
+        # Drain anything left so the connection can be reused
+        response.read()
+
+    return data,response
+
+def cached_query(table,entries,conditions,order):
+    '''Returns the result of a query, from the local cache if it is younger than cache_ttl.
+    Older results are revalidated (If-Modified-Since/If-None-Match); if the archive is unreachable, or offline
+    is set, the cached result is used however old it is.
+    Returns (data, source), where source is one of archive, cache, revalidated or stale'''
+
+    if not use_cache:
+        data,response = fetch_query(table,entries,conditions,order)
+        return data,'archive'
+
+    filename = cache_filename(table,entries,conditions,order)
+    cached = load_cache(filename)
+
+    if cached is not None:
+        data,fetched,last_modified,etag = cached
+        if offline or time()-fetched < cache_ttl:
+            return data,'cache'
+    elif offline:
+        raise IOError('No cached copy of this query is available offline: '+query_string(table,entries,conditions,order))
+
+    headers = {}
+    if cached is not None:
+        if last_modified!='': headers['If-Modified-Since'] = last_modified
+        if etag!='': headers['If-None-Match'] = etag
+
+    try:
+        newdata,response = fetch_query(table,entries,conditions,order,headers)
+    except (HTTPException,IOError) as error:
+        if cached is None: raise
+        warnings.warn('Exoplanet Archive unreachable ('+str(error)+'): using cached data')
+        return data,'stale'
+
+    if newdata is None:
+        # Not modified: keep the cached result for another cache_ttl
+        save_cache(filename,data,last_modified,etag)
+        return data,'revalidated'
+
+    save_cache(filename,newdata,response.getheader('Last-Modified',''),response.getheader('ETag',''))
+
+    return newdata,'archive'
+
+def query_archive(table,entries,conditions,order):
+    '''Returns the result of a query (see cached_query), recording the time it took if stats is set.
+    Returns a 1D array for a single column, or one row per object for several columns'''
+
+    t0 = time()
+    data,source = cached_query(table,entries,conditions,order)
+
+    if stats is not None:
+        stats.add_stage('query '+table+' '+entries, time()-t0, source=source, rows=len(data))
+
+    return data
+
+
+def run_query(query):
+    '''Runs one (function, keyword arguments) query, returning (result, None) or (None, the exception raised)'''
+
+    function,kwargs = query
+
+    try:
+        return function(**kwargs),None
+    except Exception as error:
+        return None,error
+
+def open_query_pool(nthreads):
+    '''Returns the pool of threads running concurrent queries, with at least nthreads threads. The same threads
+    (and so their keep-alive connections) serve every call; the pool is only replaced to grow it, or in a new process'''
+
+    global query_pool, query_pool_size, query_pool_pid
+
+    with query_pool_lock:
+        if query_pool is not None and (query_pool_size < nthreads or query_pool_pid!=os.getpid()):
+            close_query_pool(locked=True)
+
+        if query_pool is None:
+            query_pool = ThreadPool(nthreads)
+            query_pool_size = nthreads
+            query_pool_pid = os.getpid()
+
+        return query_pool
+
+def close_query_pool(locked=False):
+    '''Stops the threads running concurrent queries (a new pool is started by the next pull_concurrently)'''
+
+    global query_pool, query_pool_size
+
+    if not locked:
+        with query_pool_lock:
+            return close_query_pool(locked=True)
+
+    pool = query_pool
+    query_pool = None
+    query_pool_size = 0
+
+    # A pool inherited from the parent of this process has no threads to stop
+    if pool is not None and query_pool_pid==os.getpid():
+        pool.terminate()
+        pool.join()
+
+atexit.register(close_query_pool)
+
+def pull_concurrently(queries,nthreads=None):
+    '''Runs several queries at once, each given as (function, keyword arguments), e.g.
+    [(pull_exoplanet_radii,{}), (pull_exoplanet_masses,{'extraconditions':'+AND+pl_rade+is+null'})].
+    Returns a list of results and a list of errors, both in the order of queries:
+    a query that fails has result None and its exception in errors (the other queries still complete)'''
+
+    if nthreads is None:
+        nthreads = len(queries)
+
+    if len(queries)==0:
+        return [],[]
+
+    pool = open_query_pool(nthreads)
+    try:
+        outcomes = pool.map(run_query,queries,chunksize=1)
+    except BaseException:
+        # Interrupted: the pool's threads may still be busy, so it is not reused
+        close_query_pool()
+        raise
+
+    results = [result for result,error in outcomes]
+    errors = [error for result,error in outcomes]
+
+    return results,errors
 
 
 def pull_exoplanet_radii(extraconditions=''):
-    '''Uses wget to pull exoplanet radii (in Earth Radii) from Exoplanet Archive (Caltech) using its API
+    '''Pulls exoplanet radii (in Earth Radii) from Exoplanet Archive (Caltech) using its API
     (See http://exoplanetarchive.ipac.caltech.edu/docs/program_interfaces.html for documentation)'''
-    
-    # Pull data and write to file
-    
-    weblink = 'http://exoplanetarchive.ipac.caltech.edu/cgi-bin/nstedAPI/nph-nstedAPI?'
-     
-    filename = 'planetradii.dat'
-    table = 'table=exoplanets'
-    entries = '&select=pl_rade'
-    conditions = '&where=pl_rade+is+not+null'+extraconditions
-    order = '&order=pl_rade'
-    form = '&format=ascii'
-
-    #command = 'wget "'+weblink+table+entries+order+conditions+form+'" -O "'+filename+'"'
-    command = '/usr/local/bin/wget "'+weblink+table+entries+order+conditions+form+'" -O "'+filename+'"'
-    system(command)
-    
-    # Read data from file into array and return it
-    radii = np.genfromtxt(filename,skiprows=11)
-    
-    # Delete file
-    command = 'rm '+filename
-    system(command)
-    
+
+    table = 'exoplanets'
+    entries = 'pl_rade'
+    conditions = 'pl_rade+is+not+null'+extraconditions
+    order = 'pl_rade'
+
+    radii = query_archive(table,entries,conditions,order)
+
     return radii
-    
+
 def pull_exoplanet_masses(extraconditions=''):
-    '''Uses wget to pull exoplanet mass (in Earth masses) from Exoplanet Archive (Caltech) using its API
+    '''Pulls exoplanet mass (in Earth masses) from Exoplanet Archive (Caltech) using its API
     (See http://exoplanetarchive.ipac.caltech.edu/docs/program_interfaces.html for documentation)'''
-     # Pull data and write to file
-    
-    weblink = 'http://exoplanetarchive.ipac.caltech.edu/cgi-bin/nstedAPI/nph-nstedAPI?'
-     
-    filename = 'planetmasses.dat'
-    table = 'table=exoplanets'
-    entries = '&select=pl_msinie'
-    conditions = '&where=pl_msinie+is+not+null'
-    order = '&order=pl_msinie'
-    form = '&format=ascii'
-
-    #command = 'wget "'+weblink+table+entries+order+conditions+form+'" -O "'+filename+'"'
-    command = '/usr/local/bin/wget "'+weblink+table+entries+order+conditions+form+'" -O "'+filename+'"'
-    system(command)
-    
-    # Read data from file into array and return it
-    masses = np.genfromtxt(filename,skiprows=11)
-    
-    # Delete file
-    command = 'rm '+filename
-    system(command)
-    
+
+    table = 'exoplanets'
+    entries = 'pl_msinie'
+    conditions = 'pl_msinie+is+not+null'+extraconditions
+    order = 'pl_msinie'
+
+    masses = query_archive(table,entries,conditions,order)
+
     return masses
-    
-    
+
+
 def pull_candidate_exoplanet_radii(extraconditions=''):
-    '''Uses wget to pull candidate exoplanet radii (in Earth Radii) from Exoplanet Archive (Caltech) using its API
+    '''Pulls candidate exoplanet radii (in Earth Radii) from Exoplanet Archive (Caltech) using its API
+    (See http://exoplanetarchive.ipac.caltech.edu/docs/program_interfaces.html for documentation)'''
+
+    table = 'q1_q6_kepler_candidates'
+    entries = 'koi_prad'
+    conditions = 'koi_prad+is+not+null'+extraconditions
+    order = 'koi_prad'
+
+    radii = query_archive(table,entries,conditions,order)
+
+    return radii
+
+
+def pull_exoplanet_discoveries():
+    '''Pulls radius (Earth Radii), mass (Earth masses) and discovery year of every exoplanet with a
+    radius or mass from Exoplanet Archive (Caltech) in a single query.
+    Missing radii or masses are returned as NaN.
     (See http://exoplanetarchive.ipac.caltech.edu/docs/program_interfaces.html for documentation)'''
-    
-    # Pull data and write to file
-    
-    weblink = 'http://exoplanetarchive.ipac.caltech.edu/cgi-bin/nstedAPI/nph-nstedAPI?'
-     
-    filename = 'candidateradii.dat'
-    table = 'table=q1_q6_kepler_candidates'
-    entries = '&select=koi_prad'
-    conditions = '&where=koi_prad+is+not+null'
-    order = '&order=koi_prad'
-    form = '&format=ascii'
-
-    #command = 'wget "'+weblink+table+entries+order+conditions+form+'" -O "'+filename+'"'
-    command = '/usr/local/bin/wget "'+weblink+table+entries+order+conditions+form+'" -O "'+filename+'"'
-    system(command)
-    
-    # Read data from file into array and return it
-    radii = np.genfromtxt(filename,skiprows=11)
-    
-    # Delete file
-    command = 'rm '+filename
-    system(command)
-    
-    return radii
\ No newline at end of file
+
+    table = 'exoplanets'
+    entries = 'pl_rade,pl_msinie,pl_disc'
+    conditions = 'pl_rade+is+not+null+OR+pl_msinie+is+not+null'
+    order = 'pl_disc'
+
+    # One row per planet, 'null' entries become NaN
+    data = query_archive(table,entries,conditions,order)
+    data = data.reshape(-1,3)
+
+    radii = data[:,0]
+    masses = data[:,1]
+    years = data[:,2]
+
+    return radii,masses,years
@@ -0,0 +1,318 @@
+# A minimal stand-in for the Exoplanet Archive API, so exoplanet_data (and the scripts) can be run without the archive
+#
+# Answers the queries exoplanet_data sends (table, select, where, order and format: ascii IPAC tables or csv) from
+# a small synthetic catalogue, over keep-alive HTTP/1.1 connections. Responses carry a Last-Modified date and an
+# ETag, and conditional requests for unchanged data are answered 304 Not Modified. Connections, requests,
+# 304 responses and the most requests answered at once are counted, and latency or failures can be switched on,
+# for tests.
+#
+# Usage: python tests/archive_standin.py [--port 18765] [--planets 3000] [--candidates 4000]
+# then run e.g. EXOPLANET_ARCHIVE_URL='http://127.0.0.1:18765/api?' python exoplanet_circle.py --batch
+
+import numpy as np
+import sys
+import socket
+import threading
+import argparse
+from time import sleep
+from urllib.parse import parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+column_width = 14 # Characters per column of ascii tables
+
+
+def synthetic_catalogue(nplanet=300, ncandidate=400, seed=1):
+    '''Returns the columns of a catalogue-shaped table of confirmed planets (pl_rade, pl_msinie, pl_disc: a quarter of
+    the planets have only a mass, a few only a radius) and candidates (koi_prad), keyed by archive table name'''
+
+    rng = np.random.default_rng(seed)
+
+    radii = np.where(rng.random(nplanet) < 0.7, rng.lognormal(0.7,0.5,nplanet), rng.lognormal(2.4,0.2,nplanet))
+    masses = rng.lognormal(2.0,1.5,nplanet)
+    years = rng.integers(1995,2025,nplanet).astype(float)
+
+    radii[rng.random(nplanet) < 0.25] = np.nan
+    masses[rng.random(nplanet) < 0.1] = np.nan
+
+    candidates = rng.lognormal(0.8,0.6,ncandidate)
+
+    return {'exoplanets': {'pl_rade': radii, 'pl_msinie': masses, 'pl_disc': years},
+            'q1_q6_kepler_candidates': {'koi_prad': candidates}}
+
+def select_rows(columns, conditions):
+    '''Returns the rows of a table meeting an archive where clause: clauses 'column+is+null' or
+    'column+is+not+null', joined by +AND+ or +OR+ (OR binding less tightly)'''
+
+    nrow = len(next(iter(columns.values())))
+    selected = np.zeros(nrow, dtype=bool)
+
+    for alternative in conditions.split('+OR+'):
+        rows = np.ones(nrow, dtype=bool)
+        for clause in alternative.split('+AND+'):
+            words = clause.split('+')
+            if len(words) < 3 or words[0] not in columns:
+                raise ValueError('Unsupported where clause: '+clause)
+            missing = np.isnan(columns[words[0]])
+            rows &= ~missing if words[1:]==['is','not','null'] else missing
+        selected |= rows
+
+    return np.flatnonzero(selected)
+
+def ascii_table(names, values):
+    '''Formats columns as an IPAC ascii table, as the archive does (nulls as 'null')'''
+
+    def line(fields):
+        return '|'+'|'.join(field.rjust(column_width-1) for field in fields)+'|\n'
+
+    text = ['\\fixlen = T\n', '\\RowsRetrieved = '+str(len(values[0]) if values else 0)+'\n']
+    text.append(line(names))
+    text.append(line(['double']*len(names)))
+    text.append(line(['']*len(names)))
+    text.append(line(['null']*len(names)))
+
+    for row in zip(*values):
+        text.append(' '+' '.join(('null' if np.isnan(value) else repr(float(value))).rjust(column_width-1)
+                                 for value in row)+' \n')
+
+    return ''.join(text)
+
+def csv_table(names, values):
+    '''Formats columns as a csv table, as the archive does (nulls as empty fields)'''
+
+    text = [','.join(names)+'\n']
+
+    for row in zip(*values):
+        text.append(','.join('' if np.isnan(value) else repr(float(value)) for value in row)+'\n')
+
+    return ''.join(text)
+
+
+class StandinServer(ThreadingHTTPServer):
+    '''Answers every connection in its own thread, without reporting clients that hang up (as the clients
+    under test do when their connections are dropped or closed)'''
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+
+        ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class StandinArchive(object):
+    '''The stand-in server: start() it, point exoplanet_data at url (set_archive_url), stop() it afterwards.
+    tables defaults to synthetic_catalogue(). Set latency (seconds before every answer), failing (table names
+    answered with HTTP 500) or error_body (answered with this text instead of a table) to test error handling,
+    and call update() to change the data (and its ETag). With barrier (a threading.Barrier) set, every request
+    waits there before it is answered, so a test can check that requests arrive together'''
+
+    def __init__(self, tables=None, port=0, host='127.0.0.1'):
+
+        self.tables = tables
+        if self.tables is None:
+            self.tables = synthetic_catalogue()
+
+        self.address = (host,port)
+        self.server = None
+        self.thread = None
+
+        self.latency = 0.0
+        self.failing = set()
+        self.error_body = None
+        self.barrier = None
+        self.version = 1
+
+        self.lock = threading.Lock()
+        self.sockets = []
+        self.connections = 0
+        self.requests = []
+        self.not_modified = 0
+        self.active = 0
+        self.max_active = 0
+
+    @property
+    def url(self):
+        '''Base URL to give to exoplanet_data.set_archive_url'''
+
+        host,port = self.server.server_address[:2]
+
+        return 'http://'+host+':'+str(port)+'/cgi-bin/nstedAPI/nph-nstedAPI?'
+
+    @property
+    def etag(self):
+
+        return '"standin-'+str(self.version)+'"'
+
+    @property
+    def last_modified(self):
+
+        return 'Mon, 0'+str(min(self.version,9))+' Jan 2024 00:00:00 GMT'
+
+    def update(self, tables=None):
+        '''Replaces the data (or marks it as changed), so cached copies are no longer current'''
+
+        if tables is not None:
+            self.tables = tables
+        self.version += 1
+
+    def query(self, parameters):
+        '''Returns the text of the table answering a query'''
+
+        columns = self.tables[parameters['table']]
+        names = parameters['select'].split(',')
+
+        rows = select_rows(columns, parameters.get('where',''))
+        order = parameters.get('order','')
+        if order in columns:
+            rows = rows[np.argsort(columns[order][rows], kind='stable')]
+
+        values = [columns[name][rows] for name in names]
+
+        if parameters.get('format','ascii')=='csv':
+            return csv_table(names, values)
+
+        return ascii_table(names, values)
+
+    def start(self):
+        '''Starts serving in a background thread; returns the server's URL'''
+
+        archive = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            # HTTP/1.1: connections are kept alive between requests
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+
+                BaseHTTPRequestHandler.setup(self)
+                with archive.lock:
+                    archive.connections += 1
+                    archive.sockets.append(self.connection)
+
+            def do_GET(self):
+
+                archive.answer(self)
+
+            def log_message(self, format, *args):
+
+                pass
+
+        self.server = StandinServer(self.address, Handler)
+
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self.url
+
+    def answer(self, handler):
+        '''Answers one request, counting the requests being answered at once'''
+
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+        try:
+            if self.barrier is not None:
+                self.barrier.wait()
+            self.respond(handler)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def respond(self, handler):
+        '''Sends the answer to one request'''
+
+        query = handler.path.split('?',1)[1] if '?' in handler.path else ''
+        # The archive's query values use + for spaces: keep them as written
+        parameters = dict(parse_qsl(query.replace('+','%2B'), keep_blank_values=True))
+
+        with self.lock:
+            self.requests.append((parameters,dict(handler.headers)))
+
+        if self.latency > 0.0:
+            sleep(self.latency)
+
+        if parameters.get('table') in self.failing:
+            return self.send(handler, 500, b'Internal Server Error')
+
+        if self.error_body is not None:
+            return self.send(handler, 200, self.error_body.encode('ascii'))
+
+        if handler.headers.get('If-None-Match')==self.etag:
+            with self.lock:
+                self.not_modified += 1
+            return self.send(handler, 304, None)
+
+        try:
+            body = self.query(parameters).encode('ascii')
+        except (KeyError,ValueError) as error:
+            return self.send(handler, 400, ('ERROR '+str(error)).encode('ascii'))
+
+        self.send(handler, 200, body)
+
+    def send(self, handler, status, body):
+        '''Sends a response (with no body for 304)'''
+
+        handler.send_response(status)
+        handler.send_header('ETag', self.etag)
+        handler.send_header('Last-Modified', self.last_modified)
+        if body is None:
+            handler.end_headers()
+            return
+        handler.send_header('Content-Type', 'text/plain')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def stop(self):
+        '''Stops serving, closing every connection'''
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+        # Connections kept alive would otherwise go on being answered
+        with self.lock:
+            for connection in self.sockets:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.sockets = []
+
+    def __enter__(self):
+
+        self.start()
+        return self
+
+    def __exit__(self, *exception):
+
+        self.stop()
+
+
+def main(argv=None):
+    '''Serves a synthetic catalogue until interrupted'''
+
+    parser = argparse.ArgumentParser(description='Stand-in Exoplanet Archive serving a synthetic catalogue')
+    parser.add_argument('--port', type=int, default=18765)
+    parser.add_argument('--planets', type=int, default=3000, help='Confirmed planets in the catalogue')
+    parser.add_argument('--candidates', type=int, default=4000, help='Candidates in the catalogue')
+    args = parser.parse_args(argv)
+
+    archive = StandinArchive(synthetic_catalogue(args.planets,args.candidates), port=args.port)
+    print('Serving a stand-in archive at '+archive.start())
+
+    try:
+        archive.thread.join()
+    except KeyboardInterrupt:
+        archive.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules under test sit at the top of the repository, and the stand-in archive next to the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,59 @@
+# Reads the PNG files written by exo_circle_raster and exo_circle_animation back, for tests: the chunks of a file
+# (checking every CRC), and the pixels of its image data (as written there: 8 bits per channel, no row filters)
+
+import numpy as np
+import zlib
+import struct
+
+signature = b'\x89PNG\r\n\x1a\n'
+
+
+def read_chunks(data):
+    '''Returns the (type, contents) of every chunk of PNG data, raising ValueError if the data is not a valid PNG'''
+
+    if data[:8]!=signature:
+        raise ValueError('No PNG signature')
+
+    chunks = []
+    position = 8
+    while position < len(data):
+        length, = struct.unpack('>I',data[position:position+4])
+        kind = data[position+4:position+8]
+        contents = data[position+8:position+8+length]
+        crc, = struct.unpack('>I',data[position+8+length:position+12+length])
+
+        if len(contents)!=length or crc!=zlib.crc32(kind+contents) & 0xffffffff:
+            raise ValueError('Damaged '+kind.decode('ascii','replace')+' chunk')
+
+        chunks.append((kind,contents))
+        position += 12+length
+
+    if len(chunks)==0 or chunks[0][0]!=b'IHDR' or chunks[-1][0]!=b'IEND':
+        raise ValueError('PNG data must start with IHDR and end with IEND')
+
+    return chunks
+
+def header(chunks):
+    '''Returns (width, height, channels) from the IHDR chunk'''
+
+    width,height,depth,colour_type = struct.unpack('>IIBB',chunks[0][1][:10])
+
+    return width, height, {2: 3, 6: 4}[colour_type]
+
+def decode_pixels(compressed, width, height, channels):
+    '''Returns the (height, width, channels) uint8 pixels of compressed image data'''
+
+    rows = np.frombuffer(zlib.decompress(compressed),dtype=np.uint8).reshape(height,width*channels+1)
+
+    if np.any(rows[:,0]!=0):
+        raise ValueError('Only unfiltered rows can be decoded here')
+
+    return rows[:,1:].reshape(height,width,channels)
+
+def read_image(data):
+    '''Returns the pixels of PNG data'''
+
+    chunks = read_chunks(data)
+    width,height,channels = header(chunks)
+
+    return decode_pixels(b''.join(contents for kind,contents in chunks if kind==b'IDAT'), width, height, channels)
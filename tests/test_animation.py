@@ -0,0 +1,135 @@
+# Checks exo_circle_animation: the animated PNG files written frame by frame, and the frames faded in between years
+
+import struct
+import warnings
+import numpy as np
+import pytest
+import exo_circle_animation as animation
+from png_chunks import read_chunks, header, decode_pixels
+
+
+def movie_frames(n=5, seed=1):
+    '''n frames of 30x40 pixels, each changing a different rectangle of the one before (the third changes nothing)'''
+
+    rng = np.random.default_rng(seed)
+    frame = np.full((30,40,3), 255, dtype=np.uint8)
+    frames = [frame.copy()]
+
+    for k in range(1,n):
+        if k!=2:
+            y,x = rng.integers(0,25),rng.integers(0,35)
+            frame[y:y+5,x:x+5] = rng.integers(0,256,3)
+        frames.append(frame.copy())
+
+    return frames
+
+def read_apng(filename):
+    '''Returns the number of frames in the acTL chunk, and every frame rebuilt from the fcTL/IDAT/fdAT chunks'''
+
+    with open(filename,'rb') as f:
+        chunks = read_chunks(f.read())
+
+    width,height,channels = header(chunks)
+    nframes = None
+    sequence = []
+    frames = []
+    canvas = None
+    control = None
+
+    for kind,contents in chunks:
+        if kind==b'acTL':
+            nframes, = struct.unpack('>I',contents[:4])
+        elif kind==b'fcTL':
+            number,w,h,x0,y0 = struct.unpack('>IIIII',contents[:20])
+            sequence.append(number)
+            control = (w,h,x0,y0)
+        elif kind in (b'IDAT',b'fdAT'):
+            if kind==b'fdAT':
+                sequence.append(struct.unpack('>I',contents[:4])[0])
+                contents = contents[4:]
+            w,h,x0,y0 = control
+            if canvas is None:
+                canvas = np.zeros((height,width,channels), dtype=np.uint8)
+            canvas[y0:y0+h,x0:x0+w] = decode_pixels(contents, w, h, channels)
+            frames.append(canvas.copy())
+
+    # Chunks of the animation are numbered in order
+    assert sequence == list(range(len(sequence)))
+
+    return nframes, frames
+
+
+def test_apng_frames(tmp_path):
+
+    frames = movie_frames()
+    filename = str(tmp_path/'movie.png')
+
+    with animation.APNGWriter(filename, len(frames), fps=2.0) as writer:
+        for frame in frames:
+            writer.write(frame)
+
+    nframes,written = read_apng(filename)
+
+    assert nframes == len(frames)
+    assert len(written) == len(frames)
+    for frame,image in zip(frames,written):
+        assert np.array_equal(frame, image)
+
+def test_apng_frame_count_is_corrected(tmp_path):
+
+    frames = movie_frames()
+    filename = str(tmp_path/'movie.png')
+
+    # Fewer frames written than announced
+    with animation.APNGWriter(filename, 10) as writer:
+        for frame in frames[:3]:
+            writer.write(frame)
+
+    nframes,written = read_apng(filename)
+
+    assert nframes == 3 and len(written) == 3
+
+def test_apng_is_read_by_other_readers(tmp_path):
+
+    Image = pytest.importorskip('PIL.Image')
+
+    frames = movie_frames()
+    filename = str(tmp_path/'movie.png')
+    with animation.APNGWriter(filename, len(frames)) as writer:
+        for frame in frames:
+            writer.write(frame)
+
+    with Image.open(filename) as image:
+        assert image.n_frames == len(frames)
+        image.seek(len(frames)-1)
+        assert np.array_equal(np.asarray(image.convert('RGB')), frames[-1])
+
+def test_frames_must_keep_their_size(tmp_path):
+
+    with animation.APNGWriter(str(tmp_path/'movie.png'), 2) as writer:
+        writer.write(np.zeros((10,10,3), dtype=np.uint8))
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((10,12,3), dtype=np.uint8))
+
+def test_videos_fall_back_to_apng_without_ffmpeg(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(animation, 'ffmpeg_path', None)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        writer = animation.open_writer(str(tmp_path/'movie.mp4'), 2)
+    writer.close()
+
+    assert isinstance(writer, animation.APNGWriter)
+    assert writer.filename == str(tmp_path/'movie.png')
+    assert len(caught) == 1
+
+def test_interpolated_frames():
+
+    first = np.zeros((2,2,3), dtype=np.uint8)
+    last = np.full((2,2,3), 200, dtype=np.uint8)
+
+    frames = list(animation.interpolate([(2000,first),(2001,last)], 3))
+
+    assert [label for label,image in frames] == [2000,None,None,None,2001]
+    assert [int(image[0,0,0]) for label,image in frames] == [0,50,100,150,200]
@@ -0,0 +1,248 @@
+# Checks the archive client of exoplanet_data against a local stand-in server (archive_standin.py): connection
+# reuse, the query cache (TTL, revalidation, stale and offline use), error reporting and concurrent queries
+
+import numpy as np
+import pytest
+import warnings
+import threading
+import exoplanet_data as exo
+from archive_standin import StandinArchive
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    '''A running stand-in archive, with exoplanet_data pointed at it and caching into a temporary directory'''
+
+    standin = StandinArchive()
+    monkeypatch.setattr(exo, 'cache_dir', str(tmp_path/'cache'))
+    monkeypatch.setattr(exo, 'use_cache', True)
+    monkeypatch.setattr(exo, 'offline', False)
+    monkeypatch.setattr(exo, 'cache_ttl', 86400.0)
+    original_url = exo.archive_url
+
+    exo.set_archive_url(standin.start())
+    yield standin
+
+    standin.stop()
+    exo.set_archive_url(original_url)
+
+def expected_radii(archive):
+
+    radii = archive.tables['exoplanets']['pl_rade']
+
+    return np.sort(radii[np.isfinite(radii)])
+
+
+def test_queries_share_one_connection(archive, monkeypatch):
+
+    monkeypatch.setattr(exo, 'use_cache', False)
+
+    radii = exo.pull_exoplanet_radii()
+    exo.pull_exoplanet_masses()
+    exo.pull_candidate_exoplanet_radii()
+    exo.pull_exoplanet_discoveries()
+
+    assert np.array_equal(radii, expected_radii(archive))
+    assert len(archive.requests) == 4
+    assert archive.connections == 1
+
+def test_reconnects_when_the_connection_is_dropped(archive, monkeypatch):
+
+    monkeypatch.setattr(exo, 'use_cache', False)
+
+    exo.pull_exoplanet_radii()
+    exo.connections.connection.sock.close()
+    radii = exo.pull_exoplanet_radii()
+
+    assert np.array_equal(radii, expected_radii(archive))
+    assert archive.connections == 2
+
+def test_discoveries_keep_missing_values(archive):
+
+    radii,masses,years = exo.pull_exoplanet_discoveries()
+    columns = archive.tables['exoplanets']
+
+    assert len(radii) == np.count_nonzero(np.isfinite(columns['pl_rade']) | np.isfinite(columns['pl_msinie']))
+    assert np.all(np.isfinite(radii) | np.isfinite(masses))
+    assert np.any(np.isnan(radii)) and np.any(np.isnan(masses))
+    assert np.all(np.diff(years) >= 0)
+
+def test_csv_responses_match_ascii(archive, monkeypatch):
+
+    monkeypatch.setattr(exo, 'use_cache', False)
+
+    ascii = exo.pull_exoplanet_discoveries()
+    monkeypatch.setattr(exo, 'response_format', 'csv')
+    csv = exo.pull_exoplanet_discoveries()
+
+    for a,c in zip(ascii,csv):
+        assert np.array_equal(a, c, equal_nan=True)
+
+
+def test_cached_results_are_reused(archive):
+
+    first,source = exo.cached_query('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+    assert source == 'archive'
+
+    again,source = exo.cached_query('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+    assert source == 'cache'
+    assert np.array_equal(first, again)
+    assert len(archive.requests) == 1
+
+def test_expired_results_are_revalidated(archive, monkeypatch):
+
+    query = ('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+    first,source = exo.cached_query(*query)
+
+    monkeypatch.setattr(exo, 'cache_ttl', 0.0)
+    again,source = exo.cached_query(*query)
+
+    assert source == 'revalidated'
+    assert archive.not_modified == 1
+    assert archive.requests[-1][1].get('If-None-Match') == archive.etag
+    assert np.array_equal(first, again)
+
+    # Changed data is fetched again
+    archive.update()
+    changed,source = exo.cached_query(*query)
+    assert source == 'archive'
+
+def test_stale_results_are_used_when_the_archive_is_unreachable(archive, monkeypatch):
+
+    query = ('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+    first,source = exo.cached_query(*query)
+
+    archive.stop()
+    monkeypatch.setattr(exo, 'cache_ttl', 0.0)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        stale,source = exo.cached_query(*query)
+
+    assert source == 'stale'
+    assert len(caught) == 1
+    assert np.array_equal(first, stale)
+
+def test_results_of_different_servers_are_kept_apart(archive, monkeypatch):
+
+    query = ('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+    exo.cached_query(*query)
+    standin_file = exo.cache_filename(*query)
+
+    monkeypatch.setattr(exo, 'archive_url', 'http://elsewhere.invalid/api?')
+    assert exo.cache_filename(*query) != standin_file
+
+    monkeypatch.setattr(exo, 'offline', True)
+    with pytest.raises(IOError):
+        exo.cached_query(*query)
+
+def test_results_of_different_formats_are_kept_apart(archive, monkeypatch):
+
+    query = ('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+    ascii_file = exo.cache_filename(*query)
+
+    monkeypatch.setattr(exo, 'response_format', 'csv')
+    assert exo.cache_filename(*query) != ascii_file
+
+def test_unwritable_cache_only_warns(archive, tmp_path, monkeypatch):
+
+    # A file where the cache directory should be: nothing can be written under it
+    blocker = str(tmp_path/'not-a-directory')
+    with open(blocker,'w') as f:
+        f.write('')
+    monkeypatch.setattr(exo, 'cache_dir', blocker)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        data,source = exo.cached_query('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+
+    assert source == 'archive'
+    assert np.array_equal(data, expected_radii(archive))
+    assert any('cache' in str(warning.message) for warning in caught)
+
+def test_damaged_cache_files_are_misses(archive):
+
+    query = ('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+    exo.cached_query(*query)
+
+    filename = exo.cache_filename(*query)
+    with open(filename,'rb') as f:
+        data = f.read()
+    with open(filename,'wb') as f:
+        f.write(data[:len(data)//2])
+
+    again,source = exo.cached_query(*query)
+
+    assert source == 'archive'
+    assert np.array_equal(again, expected_radii(archive))
+
+def test_offline_mode(archive, monkeypatch):
+
+    query = ('exoplanets','pl_rade','pl_rade+is+not+null','pl_rade')
+    monkeypatch.setattr(exo, 'offline', True)
+
+    with pytest.raises(IOError):
+        exo.cached_query(*query)
+
+    monkeypatch.setattr(exo, 'offline', False)
+    exo.cached_query(*query)
+
+    monkeypatch.setattr(exo, 'offline', True)
+    monkeypatch.setattr(exo, 'cache_ttl', 0.0)
+    data,source = exo.cached_query(*query)
+
+    assert source == 'cache'
+    assert len(archive.requests) == 1
+
+
+def test_http_errors_are_raised(archive):
+
+    archive.failing.add('exoplanets')
+
+    with pytest.raises(IOError, match='HTTP status 500'):
+        exo.pull_exoplanet_radii()
+
+def test_error_messages_are_raised(archive):
+
+    archive.error_body = 'ERROR<br>\nUnknown column pl_rade\n'
+
+    with pytest.raises(IOError, match='Unknown column'):
+        exo.pull_exoplanet_radii()
+
+def test_concurrent_queries_report_errors_separately(archive):
+
+    archive.failing.add('q1_q6_kepler_candidates')
+
+    queries = [(exo.pull_exoplanet_radii,{}), (exo.pull_candidate_exoplanet_radii,{}), (exo.pull_exoplanet_masses,{})]
+    results,errors = exo.pull_concurrently(queries)
+
+    assert np.array_equal(results[0], expected_radii(archive))
+    assert results[1] is None and isinstance(errors[1], IOError)
+    assert results[2] is not None and errors[2] is None
+    assert errors[0] is None
+
+def test_concurrent_queries_reuse_connections(archive, monkeypatch):
+
+    monkeypatch.setattr(exo, 'use_cache', False)
+
+    queries = [(exo.pull_exoplanet_radii,{}), (exo.pull_candidate_exoplanet_radii,{}), (exo.pull_exoplanet_masses,{})]
+    for attempt in range(3):
+        results,errors = exo.pull_concurrently(queries)
+        assert errors == [None,None,None]
+
+    # The same threads answer every call, over the connections they opened the first time
+    assert len(archive.requests) == 9
+    assert archive.connections <= 3
+
+def test_concurrent_queries_overlap(archive, monkeypatch):
+
+    monkeypatch.setattr(exo, 'use_cache', False)
+
+    # No request is answered until all three have arrived: run one after another, the queries would fail
+    archive.barrier = threading.Barrier(3, timeout=30.0)
+
+    queries = [(exo.pull_exoplanet_radii,{}), (exo.pull_candidate_exoplanet_radii,{}), (exo.pull_exoplanet_masses,{})]
+    results,errors = exo.pull_concurrently(queries)
+
+    assert errors == [None,None,None]
+    assert archive.max_active == 3
@@ -0,0 +1,50 @@
+# Checks exo_circle_instrument: placement statistics recorded from several threads, and the size of the report
+
+import json
+import threading
+import exo_circle_instrument as instrument
+
+
+def test_concurrent_placements_are_all_counted():
+
+    stats = instrument.Instrumentation(window=10)
+
+    def place(thread):
+        for i in range(2000):
+            stats.record_placement('candidates', i, 1.0, 1+(i % 5), 1.0e-6*thread)
+
+    threads = [threading.Thread(target=place, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    layer = stats.report()['placement']['candidates']
+
+    assert layer['placed'] == 16000
+    assert layer['trials'] == 8*400*(1+2+3+4+5)
+    assert sum(layer['trials_histogram'].values()) == 16000
+    assert len(layer['acceptance_over_time']) == 1600
+    assert len(layer['slowest']) == stats.nslowest
+
+def test_report_size_does_not_grow_with_the_circles_placed():
+
+    sizes = []
+    for n in (1000,100000):
+        stats = instrument.Instrumentation(window=n)
+        for i in range(n):
+            stats.record_placement('planets', i, 1.0, 1+(i % 100), 0.0)
+        sizes.append(len(json.dumps(stats.report())))
+
+    assert sizes[1] < sizes[0]+100
+
+def test_trials_histogram_bins():
+
+    stats = instrument.Instrumentation()
+    for trials in (1,2,3,4,7,8,100):
+        stats.record_placement('planets', 0, 1.0, trials, 0.0)
+
+    layer = stats.report()['placement']['planets']
+
+    assert layer['trials_histogram'] == {'1': 1, '2-3': 2, '4-7': 2, '8-15': 1, '16-31': 0, '32-63': 0, '64-127': 1}
+    assert layer['max_trials'] == 100
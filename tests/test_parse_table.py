@@ -0,0 +1,141 @@
+# Checks the streaming archive table parser of exoplanet_data (parse_table and parse_columns) on the ascii (IPAC)
+# and csv formats: null markers, empty and single-row results, blank rows, long tables and error responses
+
+import numpy as np
+import pytest
+import exoplanet_data as exo
+import archive_standin
+
+
+def ipac_table(names, rows, nulls=None, types=None, width=12):
+    '''Returns the lines of an IPAC ascii table with columns width characters wide; rows are lists of field text'''
+
+    if types is None:
+        types = ['double']*len(names)
+    if nulls is None:
+        nulls = ['null']*len(names)
+
+    def header(fields):
+        return '|'+'|'.join(field.rjust(width) for field in fields)+'|\n'
+
+    lines = ['\\fixlen = T\n', '\\RowsRetrieved = '+str(len(rows))+'\n', '\\ a comment\n',
+             header(names), header(types), header(['']*len(names)), header(nulls)]
+    lines += [' '+' '.join(field.rjust(width) for field in row)+' \n' for row in rows]
+
+    return lines
+
+
+def test_ascii_columns_and_nulls():
+
+    lines = ipac_table(['pl_rade','pl_msinie','pl_disc'], [['1.5','null','2001'], ['null','300.0','2010'],
+                                                           ['11.2','1.0e3','2020']])
+    data = exo.parse_table(lines)
+
+    expected = np.array([[1.5,np.nan,2001.0], [np.nan,300.0,2010.0], [11.2,1000.0,2020.0]])
+    assert data.shape == (3,3)
+    assert np.array_equal(data, expected, equal_nan=True)
+
+def test_ascii_blank_null_marker():
+
+    # The null row of the header is blank: blank fields are nulls, and must not shift the columns
+    lines = ipac_table(['pl_rade','pl_msinie'], [['1.0000',''], ['2.5000','3.0000'], ['','4.0']], nulls=['',''])
+    data = exo.parse_table(lines)
+
+    assert np.array_equal(data, np.array([[1.0,np.nan], [2.5,3.0], [np.nan,4.0]]), equal_nan=True)
+
+def test_ascii_numeric_null_marker():
+
+    lines = ipac_table(['koi_prad'], [['-999'], ['2.0']], nulls=['-999'])
+
+    assert np.array_equal(exo.parse_table(lines), [np.nan,2.0], equal_nan=True)
+
+def test_ascii_single_column_and_single_row():
+
+    data = exo.parse_table(ipac_table(['pl_rade'], [['2.5']]))
+    assert data.shape == (1,)
+    assert data[0] == 2.5
+
+    data = exo.parse_table(ipac_table(['pl_rade','pl_msinie','pl_disc'], [['2.5','null','1999']]))
+    assert data.shape == (1,3)
+
+def test_ascii_empty_result():
+
+    assert exo.parse_table(ipac_table(['pl_rade'], [])).shape == (0,)
+    assert exo.parse_table(ipac_table(['pl_rade','pl_msinie','pl_disc'], [])).shape == (0,3)
+
+def test_ascii_char_columns_are_kept_as_text():
+
+    lines = ipac_table(['pl_name','pl_rade'], [['Kepler-22 b','2.1'], ['null','null']], types=['char','double'])
+    names,columns = exo.parse_columns(lines)
+
+    assert names == ['pl_name','pl_rade']
+    assert list(columns[0]) == ['Kepler-22 b','null']
+    assert np.array_equal(columns[1], [2.1,np.nan], equal_nan=True)
+
+def test_csv_columns_and_nulls():
+
+    lines = ['pl_rade,pl_msinie,pl_disc\n', '1.5,,2001\n', '\n', ',300.0,2010\n']
+    data = exo.parse_table(lines)
+
+    # A blank row in a table of several columns is skipped
+    assert np.array_equal(data, np.array([[1.5,np.nan,2001.0], [np.nan,300.0,2010.0]]), equal_nan=True)
+
+def test_csv_single_column_blank_rows_are_nulls():
+
+    data = exo.parse_table(['koi_prad\n', '1.0\n', '\n', '3.0\n'])
+
+    assert np.array_equal(data, [1.0,np.nan,3.0], equal_nan=True)
+
+def test_csv_empty_result():
+
+    assert exo.parse_table(['koi_prad\n']).shape == (0,)
+    assert exo.parse_table(['pl_rade,pl_msinie,pl_disc\n']).shape == (0,3)
+
+def test_long_tables_are_converted_in_blocks(monkeypatch):
+
+    monkeypatch.setattr(exo, 'parse_block', 7)
+
+    values = [k*0.25 for k in range(5000)]
+    rows = [[repr(value),'null' if k%3==0 else repr(-value)] for k,value in enumerate(values)]
+    data = exo.parse_table(ipac_table(['a','b'], rows))
+
+    assert data.shape == (5000,2)
+    values = np.array(values)
+    assert np.array_equal(data[:,0], values)
+    assert np.isnan(data[::3,1]).all()
+    assert np.array_equal(data[1::3,1], -values[1::3])
+
+def test_malformed_rows_are_reported():
+
+    lines = ipac_table(['pl_rade','pl_msinie'], [['1.0','2.0']])
+    lines.append(' 1.0 2.0 3.0\n')
+
+    with pytest.raises(ValueError, match='Malformed'):
+        exo.parse_table(lines)
+
+    with pytest.raises(ValueError, match='Malformed'):
+        exo.parse_table(['a,b\n', '1,2\n', '1,2,3\n'])
+
+@pytest.mark.parametrize('body', [['<html><body>Server Error</body></html>\n'],
+                                  ['ERROR<br>\n', 'Error Type: UserError\n', 'Message: column pl_xyz not found\n']])
+def test_error_responses_are_raised(body):
+
+    with pytest.raises(IOError, match='returned an error'):
+        exo.parse_table(body)
+
+def test_empty_response_is_raised():
+
+    with pytest.raises(IOError, match='empty response'):
+        exo.parse_table(['\n'])
+
+@pytest.mark.parametrize('formatter', [archive_standin.ascii_table, archive_standin.csv_table])
+def test_standin_responses(formatter):
+
+    columns = archive_standin.synthetic_catalogue()['exoplanets']
+    names = ['pl_rade','pl_msinie','pl_disc']
+    values = [columns[name] for name in names]
+
+    text = formatter(names, values)
+    data = exo.parse_table(text.splitlines(True))
+
+    assert np.array_equal(data, np.column_stack(values), equal_nan=True)
@@ -0,0 +1,199 @@
+# Checks exo_circle_placement: layouts of the placing engines (no overlaps, inside their bounds, reproducible)
+# and the layout cache
+
+import os
+import numpy as np
+import pytest
+import warnings
+import exo_circle_placement as place
+import exo_circle_instrument as instrument
+
+
+spacing = 1.1
+
+def disc_radii(n=200, seed=3):
+    '''Radii of n circles (in descending order), and the radius of a disc with twice their area'''
+
+    radii = np.sort(np.random.default_rng(seed).lognormal(0.0,0.5,n))[::-1]
+
+    return radii, np.sqrt(2.0*np.sum(radii*radii))
+
+def assert_valid_layout(x, y, radii, rmin, rmax):
+    '''Every circle placed, inside rmin < r < rmax, and no two closer than placing_spacing allows'''
+
+    assert np.all(np.isfinite(x)) and np.all(np.isfinite(y))
+
+    r = np.sqrt(x*x + y*y)
+    assert np.all(r+radii <= rmax*(1.0+1.0e-9))
+    if rmin > 0.0:
+        assert np.all(r-radii >= rmin*(1.0-1.0e-9))
+
+    sep = np.sqrt((x[:,None]-x[None,:])**2 + (y[:,None]-y[None,:])**2)
+    minsep = spacing*(radii[:,None]+radii[None,:])
+    np.fill_diagonal(sep, np.inf)
+    assert np.all(sep >= minsep*(1.0-1.0e-9))
+
+
+def test_frontchain_disc():
+
+    radii,rmax = disc_radii()
+    x,y = place.place_circles_frontchain(radii, 0.0, rmax, spacing)
+
+    assert_valid_layout(x, y, radii, 0.0, rmax)
+
+def test_frontchain_annulus():
+
+    radii,width = disc_radii()
+    rmin = 10.0
+    rmax = np.sqrt(rmin*rmin + width*width)
+    x,y = place.place_circles_frontchain(radii, rmin, rmax, spacing)
+
+    assert_valid_layout(x, y, radii, rmin, rmax)
+
+def test_frontchain_is_deterministic():
+
+    radii,rmax = disc_radii()
+    first = place.place_circles_frontchain(radii, 0.0, rmax, spacing)
+    again = place.place_circles_frontchain(radii.copy(), 0.0, rmax, spacing)
+
+    assert np.array_equal(first[0], again[0]) and np.array_equal(first[1], again[1])
+
+def test_frontchain_raises_when_circles_do_not_fit():
+
+    radii,rmax = disc_radii()
+
+    with pytest.raises(place.PlacementError):
+        place.place_circles_frontchain(radii, 0.0, 0.5*rmax, spacing)
+
+
+@pytest.mark.parametrize('sampler', ['polar','raster'])
+def test_random_engine_disc(sampler):
+
+    radii,rmax = disc_radii()
+    x,y = place.place_circles(radii, 0.0, rmax, spacing, rng=place.make_rng(11), sampler=sampler)
+
+    assert_valid_layout(x, y, radii, 0.0, rmax)
+
+@pytest.mark.parametrize('sampler', ['polar','raster'])
+def test_random_engine_annulus(sampler):
+
+    radii,width = disc_radii()
+    rmin = 10.0
+    rmax = np.sqrt(rmin*rmin + width*width)
+    x,y = place.place_circles(radii, rmin, rmax, spacing, rng=place.make_rng(11), sampler=sampler)
+
+    assert_valid_layout(x, y, radii, rmin, rmax)
+
+@pytest.mark.parametrize('sampler', ['polar','raster'])
+def test_random_engine_repeats_with_the_same_seed(sampler):
+
+    radii,rmax = disc_radii()
+    first = place.place_circles(radii, 0.0, rmax, spacing, rng=place.make_rng(11), sampler=sampler)
+    again = place.place_circles(radii, 0.0, rmax, spacing, rng=place.make_rng(11), sampler=sampler)
+    other = place.place_circles(radii, 0.0, rmax, spacing, rng=place.make_rng(12), sampler=sampler)
+
+    assert np.array_equal(first[0], again[0]) and np.array_equal(first[1], again[1])
+    assert not np.array_equal(first[0], other[0])
+
+def test_raster_sampler_keeps_obstacles_clear():
+
+    # Circles already in the grid are avoided by the raster sampler's trials, as by the polar sampler's
+    radii,rmax = disc_radii()
+    grid = place.NeighbourGrid(rmax, place.neighbour_cellsize(radii,spacing), spacing)
+    grid.insert(0.0, 0.0, 0.3*rmax)
+
+    x,y = place.place_circles(radii[:100], 0.0, rmax, spacing, rng=place.make_rng(11), grid=grid, sampler='raster')
+
+    assert_valid_layout(np.append(x,0.0), np.append(y,0.0), np.append(radii[:100],0.3*rmax), 0.0, rmax)
+
+
+def annulus_radii(n=400, seed=5):
+    '''Radii of n candidates (in descending order), and an annulus around a disc of radius 20 with twice their area'''
+
+    radii,width = disc_radii(n, seed)
+
+    return radii, 20.0, np.sqrt(400.0 + width*width)
+
+def test_sectors_fill_the_annulus():
+
+    radii,rmin,rmax = annulus_radii()
+    x,y = place.place_annulus_sectors(radii, rmin, rmax, spacing, 21, 4)
+
+    assert_valid_layout(x, y, radii, rmin, rmax)
+
+def test_sectors_give_the_same_layout_for_every_number_of_jobs():
+
+    radii,rmin,rmax = annulus_radii()
+    layouts = [place.place_annulus_sectors(radii, rmin, rmax, spacing, 21, 4, jobs=jobs, stream=(1,))
+               for jobs in (1,2,4)]
+
+    for x,y in layouts[1:]:
+        assert np.array_equal(x, layouts[0][0]) and np.array_equal(y, layouts[0][1])
+
+def test_sectors_record_every_circle():
+
+    radii,rmin,rmax = annulus_radii()
+    stats = instrument.Instrumentation()
+    place.place_annulus_sectors(radii, rmin, rmax, spacing, 21, 3, jobs=2, stats=stats, layer='candidates')
+
+    assert stats.report()['placement']['candidates']['placed'] == len(radii)
+
+
+@pytest.fixture
+def layout_cache(tmp_path, monkeypatch):
+    '''The layout cache, in a temporary directory'''
+
+    monkeypatch.setattr(place, 'use_layout_cache', True)
+    monkeypatch.setattr(place, 'layout_cache_dir', str(tmp_path/'layouts'))
+
+    return str(tmp_path/'layouts')
+
+
+def test_layouts_are_cached(layout_cache):
+
+    key = place.layout_key([np.array([1.0,2.0])], 1, 2.0, 1.1, 'random')
+    place.save_layout(key, xp=np.array([0.5,-0.5]))
+
+    assert np.array_equal(place.load_layout(key)['xp'], [0.5,-0.5])
+
+def test_keys_cover_the_layout_version(monkeypatch):
+
+    key = place.layout_key([np.array([1.0,2.0])], 1, 2.0, 1.1, 'random')
+    monkeypatch.setattr(place, 'layout_version', place.layout_version+1)
+
+    assert place.layout_key([np.array([1.0,2.0])], 1, 2.0, 1.1, 'random') != key
+
+def test_engine_settings_only_cover_what_the_engine_uses():
+
+    assert place.engine_settings('frontchain','polar',1) == place.engine_settings('frontchain','raster',4)
+    assert place.engine_settings('random','polar',0) == place.engine_settings('random','polar',1)
+    assert place.engine_settings('random','polar',1) != place.engine_settings('random','raster',1)
+    assert place.engine_settings('random','polar',2) != place.engine_settings('random','polar',3)
+
+def test_unwritable_cache_only_warns(tmp_path, monkeypatch):
+
+    # A file where the cache directory should be: nothing can be written under it
+    blocker = str(tmp_path/'not-a-directory')
+    with open(blocker,'w') as f:
+        f.write('')
+    monkeypatch.setattr(place, 'use_layout_cache', True)
+    monkeypatch.setattr(place, 'layout_cache_dir', blocker)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        place.save_layout('abc', xp=np.zeros(3))
+
+    assert len(caught) == 1
+    assert place.load_layout('abc') is None
+
+def test_damaged_layouts_are_misses(layout_cache):
+
+    place.save_layout('abc', xp=np.arange(1000.0))
+
+    filename = place.layout_filename('abc')
+    with open(filename,'rb') as f:
+        data = f.read()
+    with open(filename,'wb') as f:
+        f.write(data[:len(data)//2])
+
+    assert place.load_layout('abc') is None
@@ -0,0 +1,71 @@
+# Checks exo_circle_raster: circle coverage, clipping at the image edges, compositing and PNG encoding
+
+import numpy as np
+import pytest
+import exo_circle_raster as raster
+from png_chunks import read_image
+
+
+def test_circle_coverage_matches_its_area():
+
+    layer = raster.blank_layer(64,64)
+    raster.draw_circles(layer, 32.0, 32.0, 10.0, 10.0, (1.0,0.0,0.0))
+
+    alpha = layer[:,:,3]
+    assert abs(alpha.sum()-np.pi*100.0) < 0.01*np.pi*100.0
+    assert alpha[32,32] == 1.0 and alpha[0,0] == 0.0
+
+    # Premultiplied colour: red only, in proportion to the coverage
+    assert np.allclose(layer[:,:,0], alpha) and np.all(layer[:,:,1:3] == 0.0)
+
+def test_small_circles_keep_their_area():
+
+    layer = raster.blank_layer(16,16)
+    raster.draw_circles(layer, 8.3, 7.6, 0.2, 0.2, (0.0,0.0,1.0))
+
+    assert abs(layer[:,:,3].sum()-np.pi*0.04) < 0.1*np.pi*0.04
+
+def test_circles_are_clipped_to_the_image():
+
+    layer = raster.blank_layer(40,30)
+    raster.draw_circles(layer, [0.0,20.0,-50.0], [15.0,30.0,-50.0], 8.0, 8.0, (0.0,1.0,0.0))
+
+    # Half of each of the first two circles is inside; the third is outside altogether
+    assert abs(layer[:,:,3].sum()-np.pi*64.0) < 0.02*np.pi*64.0
+
+def test_many_circles_drawn_at_once_match_one_at_a_time():
+
+    rng = np.random.default_rng(2)
+    px,py = rng.uniform(0.0,100.0,50),rng.uniform(0.0,80.0,50)
+    radii = rng.uniform(0.3,6.0,50)
+    colours = rng.random((50,3))
+
+    together = raster.draw_circles(raster.blank_layer(100,80), px, py, radii, radii, colours)
+
+    apart = raster.blank_layer(100,80)
+    for k in range(50):
+        raster.draw_circles(apart, px[k], py[k], radii[k], radii[k], colours[k])
+
+    assert np.allclose(together, apart, atol=1.0e-5)
+
+def test_composite_over_the_background():
+
+    layer = raster.blank_layer(20,20)
+    raster.draw_circles(layer, 10.0, 10.0, 6.0, 6.0, (1.0,0.0,0.0), alpha=0.5)
+
+    image = raster.composite([layer])
+
+    assert np.allclose(image[10,10], [1.0,0.5,0.5])
+    assert np.allclose(image[0,0], [1.0,1.0,1.0])
+
+def test_png_round_trip():
+
+    pixels = np.random.default_rng(3).integers(0,256,(12,17,3)).astype(np.uint8)
+    data = raster.encode_png(pixels)
+
+    assert np.array_equal(read_image(data), pixels)
+
+    # Any PNG reader agrees (if one is installed)
+    Image = pytest.importorskip('PIL.Image')
+    from io import BytesIO
+    assert np.array_equal(np.asarray(Image.open(BytesIO(data))), pixels)
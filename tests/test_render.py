@@ -0,0 +1,53 @@
+# Checks the images of exoplanet_circle drawn with the raster backend
+
+import numpy as np
+import pytest
+
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+
+import exo_circle_table as table
+import exo_circle_placement as place
+import exo_circle_raster as raster
+import exoplanet_circle as circle
+
+
+@pytest.fixture
+def layout(monkeypatch):
+    '''A small placed layout (not cached), with the raster backend and an empty layer cache'''
+
+    monkeypatch.setattr(place, 'use_layout_cache', False)
+    monkeypatch.setattr(circle, 'render_backend', 'raster')
+    monkeypatch.setattr(circle, 'layer_cache', raster.LayerCache())
+
+    rng = np.random.default_rng(4)
+    confirmed = table.PlanetTable(np.sort(rng.lognormal(0.7,0.5,80))[::-1], confirmed=True)
+    candidates = table.PlanetTable(np.sort(rng.lognormal(0.8,0.6,120))[::-1], confirmed=False)
+
+    return circle.place_planets(table.concatenate((confirmed,candidates)), seed=7)
+
+
+def test_combined_image_does_not_depend_on_confirmed(layout, tmp_path):
+
+    # By default, the planets of combined.png are drawn afresh, not rescaled from confirmed.png
+    circle.render_combined(layout, str(tmp_path/'alone.png'))
+
+    circle.layer_cache.clear()
+    circle.render_confirmed(layout, str(tmp_path/'confirmed.png'))
+    circle.render_combined(layout, str(tmp_path/'after.png'))
+
+    with open(str(tmp_path/'alone.png'),'rb') as f:
+        alone = f.read()
+    with open(str(tmp_path/'after.png'),'rb') as f:
+        after = f.read()
+
+    assert alone == after
+
+def test_rescaled_layers_are_opt_in(layout, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(circle, 'rescale_layers', True)
+
+    circle.render_confirmed(layout, str(tmp_path/'confirmed.png'))
+    circle.render_combined(layout, str(tmp_path/'combined.png'))
+
+    assert (tmp_path/'combined.png').stat().st_size > 0
@@ -0,0 +1,61 @@
+# Checks that the render service keeps the tiles of each layout apart: a refresh to new data must not remove or
+# replace the tiles of the snapshot being served, and old tiles are removed once the new layout is served
+
+import os
+import pytest
+import exoplanet_data as exo
+import exo_circle_placement as place
+import exoplanet_circle_service as service
+from archive_standin import StandinArchive, synthetic_catalogue
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    '''A stand-in archive serving a small catalogue, with every cache in a temporary directory'''
+
+    standin = StandinArchive(synthetic_catalogue(60,80))
+    monkeypatch.setattr(exo, 'cache_dir', str(tmp_path/'cache'))
+    monkeypatch.setattr(exo, 'cache_ttl', 0.0)
+    monkeypatch.setattr(place, 'layout_cache_dir', str(tmp_path/'layouts'))
+    monkeypatch.setattr(service, 'tile_dir', str(tmp_path/'tiles'))
+    original_url = exo.archive_url
+
+    exo.set_archive_url(standin.start())
+    yield standin
+
+    standin.stop()
+    exo.set_archive_url(original_url)
+
+
+def test_refresh_keeps_tiles_of_each_layout_apart(archive):
+
+    renders = service.RenderService(seed=3)
+    old = renders.refresh()
+    old_tile = renders.respond('/tiles/1/0/1.png')[1]
+
+    assert os.path.exists(os.path.join(service.tile_dir,old.key,'1','0','1.png'))
+
+    # New data gives a new layout, in its own directory; the old layout's directory goes once it is replaced
+    archive.update(synthetic_catalogue(60,80,seed=2))
+    new = renders.refresh()
+
+    assert new.key != old.key
+    assert os.listdir(service.tile_dir) == [new.key]
+
+    # A request still using the old snapshot gets the old layout's tile, and leaves the new layout's tiles alone
+    assert old.pyramid.tile(1,0,1) == old_tile
+
+    new_tile = renders.respond('/tiles/1/0/1.png')[1]
+    assert new_tile == new.pyramid.tile(1,0,1)
+    assert new_tile != old_tile
+
+    renders.refresh()
+    assert os.listdir(service.tile_dir) == [new.key]
+
+def test_other_directories_are_left_alone(archive):
+
+    os.makedirs(os.path.join(service.tile_dir,'notes'))
+
+    service.RenderService(seed=3).refresh()
+
+    assert 'notes' in os.listdir(service.tile_dir)
@@ -0,0 +1,73 @@
+# Checks exo_circle_table: the columns of a PlanetTable, its slices (views) and subsets, and how it is built from
+# archive results
+
+import numpy as np
+import exo_circle_functions as fun
+import exo_circle_table as table
+
+
+def test_columns_and_defaults():
+
+    planets = table.PlanetTable([3.0,1.0,12.0])
+
+    assert len(planets) == 3
+    assert np.all(np.isnan(planets.mass)) and np.all(np.isnan(planets.x))
+    assert np.array_equal(planets.category, fun.pick_circle_categories(planets.radius))
+    assert np.all(planets.year == 0) and np.all(planets.confirmed)
+    for name in table.columns:
+        assert getattr(planets,name).dtype == table.column_types[name]
+
+def test_slices_are_views():
+
+    planets = table.PlanetTable([3.0,1.0,12.0])
+
+    planets[1:].x[:] = 5.0
+    assert np.array_equal(planets.x[1:], [5.0,5.0]) and np.isnan(planets.x[0])
+
+    planets[[0]].x[:] = 7.0
+    assert np.isnan(planets.x[0])
+
+def test_confirmed_planets_and_candidates():
+
+    confirmed = table.PlanetTable([1.0,4.0], confirmed=True)
+    candidates = table.PlanetTable([2.0,0.5,3.0], confirmed=False)
+    planets = table.concatenate((confirmed.sorted_by_radius(), candidates.sorted_by_radius()))
+
+    assert np.array_equal(planets.confirmed_planets().radius, [4.0,1.0])
+    assert np.array_equal(planets.candidates().radius, [3.0,2.0,0.5])
+
+    # Positions written into the subsets land in the table
+    planets.candidates().x[:] = 1.0
+    assert np.array_equal(planets.x[2:], [1.0,1.0,1.0])
+
+def test_category_rows():
+
+    planets = table.PlanetTable([0.5,1.5,3.0,8.0,20.0,0.7,2.5]).sorted_by_radius()
+
+    rows = sum(len(planets.category_rows(category)) for category in range(len(fun.category_colours)))
+    assert rows == len(planets)
+    for category in np.unique(planets.category):
+        assert np.all(planets.category_rows(category).category == category)
+
+def test_years():
+
+    planets = table.PlanetTable([1.0,2.0,3.0,4.0], year=[2005,1999,2005,2010]).sorted_by_year(first_year=2000)
+
+    assert np.array_equal(planets.year, [1999,2005,2005,2010])
+    assert np.array_equal(planets.radius, [2.0,3.0,1.0,4.0])
+    assert len(planets.discovered_before(2004)) == 1
+    assert len(planets.discovered_before(2005)) == 3
+
+def test_from_discoveries():
+
+    radii = [1.0,np.nan,np.nan,2.0]
+    masses = [np.nan,10.0,np.nan,5.0]
+    years = [2001.0,2002.0,2003.0,np.nan]
+
+    guessed = table.from_discoveries(radii, masses, years)
+    assert len(guessed) == 3
+    assert guessed.radius[1] == fun.guess_radii_from_masses_PHL([10.0])[0]
+    assert np.array_equal(guessed.year, [2001,2002,0])
+
+    measured = table.from_discoveries(radii, masses, years, guess_radius_from_mass=False)
+    assert np.array_equal(measured.radius, [1.0,2.0])
@@ -0,0 +1,108 @@
+# Checks exo_circle_tiles: which directories a pyramid may write into, and what its tiles show
+
+import os
+import json
+import numpy as np
+import pytest
+import exo_circle_table as table
+import exo_circle_tiles as tiles
+
+
+def small_layout(n=40, seed=5):
+    '''A PlanetTable of n planets at random (possibly overlapping) positions inside [-10,10]'''
+
+    rng = np.random.default_rng(seed)
+    radius = rng.uniform(0.2,1.5,n)
+
+    return table.PlanetTable(radius, x=rng.uniform(-8.0,8.0,n), y=rng.uniform(-8.0,8.0,n))
+
+def pyramid(directory, key='a', max_zoom=2):
+
+    return tiles.TilePyramid(small_layout(), 10.0, backdrop_rad=6.0, directory=directory, key=key, max_zoom=max_zoom)
+
+
+def test_new_directory_is_created(tmp_path):
+
+    directory = str(tmp_path/'new')
+    pyramid(directory).generate()
+
+    assert os.path.exists(os.path.join(directory,tiles.metadata_file))
+    assert sorted(os.listdir(directory)) == ['0','1','2',tiles.metadata_file]
+
+def test_directory_holding_other_files_is_refused(tmp_path):
+
+    # A directory that never held a pyramid, with digit-named subdirectories of its own
+    os.makedirs(str(tmp_path/'2023'))
+    with open(str(tmp_path/'2023'/'important.txt'),'w') as f:
+        f.write('keep me')
+
+    with pytest.raises(ValueError):
+        pyramid(str(tmp_path))
+
+    assert os.path.exists(str(tmp_path/'2023'/'important.txt'))
+    assert not os.path.exists(str(tmp_path/tiles.metadata_file))
+
+def test_unreadable_metadata_is_refused(tmp_path):
+
+    os.makedirs(str(tmp_path/'0'))
+    with open(str(tmp_path/tiles.metadata_file),'w') as f:
+        f.write('not json')
+
+    with pytest.raises(ValueError):
+        pyramid(str(tmp_path))
+
+    assert os.path.isdir(str(tmp_path/'0'))
+
+def test_only_the_earlier_pyramids_levels_are_removed(tmp_path):
+
+    directory = str(tmp_path)
+    pyramid(directory, key='a', max_zoom=1).generate()
+
+    # Files beside the pyramid, including a level deeper than it made
+    os.makedirs(os.path.join(directory,'7'))
+    with open(os.path.join(directory,'notes.txt'),'w') as f:
+        f.write('keep me')
+
+    second = pyramid(directory, key='b', max_zoom=2)
+
+    assert sorted(os.listdir(directory)) == ['7','notes.txt',tiles.metadata_file]
+    with open(os.path.join(directory,tiles.metadata_file)) as f:
+        assert json.load(f)['key'] == 'b'
+
+    assert second.generate() == 1+4+16
+
+def test_tiles_of_the_same_layout_are_reused(tmp_path):
+
+    directory = str(tmp_path)
+    assert pyramid(directory).generate() == 1+4+16
+    assert pyramid(directory).generate() == 0
+
+def test_tiles_are_crops_of_the_whole_image(monkeypatch):
+
+    planets = small_layout(300)
+    z = 2
+    n = 1 << z
+
+    tiled = tiles.TilePyramid(planets, 10.0, backdrop_rad=6.0, max_zoom=z)
+    pieces = [[tiled.render_tile(z,x,y) for x in range(n)] for y in range(n)]
+
+    # The whole graphic in one image at the same scale: level 0 of a pyramid with tiles n times as large
+    monkeypatch.setattr(tiles, 'tile_size', n*tiles.tile_size)
+    whole = tiles.TilePyramid(planets, 10.0, backdrop_rad=6.0, max_zoom=0).render_tile(0,0,0)
+
+    size = tiles.tile_size//n
+    for y in range(n):
+        for x in range(n):
+            crop = whole[y*size:(y+1)*size,x*size:(x+1)*size].astype(int)
+            assert np.abs(pieces[y][x].astype(int)-crop).max() <= 1
+
+def test_tiles_read_back_from_the_directory(tmp_path):
+
+    first = pyramid(str(tmp_path))
+    data = first.tile(2,1,3)
+
+    assert os.path.exists(first.tile_filename(2,1,3))
+    assert pyramid(str(tmp_path)).tile(2,1,3) == data
+
+    with pytest.raises(ValueError):
+        first.tile(3,0,0)